@@ -6,11 +6,15 @@ from sqlalchemy import pool
 from alembic import context
 
 from database.db_models import Base
+from helpers.config import DATABASE_URL
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 
+# Migrate the same database the server uses (AUTOPI_DATABASE_URL).
+config.set_main_option("sqlalchemy.url", DATABASE_URL.replace("%", "%%"))
+
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -67,7 +71,9 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata,
+            # SQLite can't ALTER most things, batch mode recreates the table instead.
+            render_as_batch=connection.dialect.name == "sqlite"
         )
 
         with context.begin_transaction():
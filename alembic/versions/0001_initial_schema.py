@@ -0,0 +1,89 @@
+"""Initial schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('House',
+                    sa.Column('houseId', sa.Uuid(), nullable=False),
+                    sa.Column('houseName', sa.Text(), nullable=False),
+                    sa.Column('passwordHash', sa.Text(), nullable=False),
+                    sa.Column('createdAt', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+                    sa.Column('updatedAt', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+                    sa.PrimaryKeyConstraint('houseId')
+                    )
+    op.create_table('DeviceControlLogs',
+                    sa.Column('deviceControlLogId', sa.Uuid(), nullable=False),
+                    sa.Column('statusChangedFrom', sa.Boolean(), nullable=False),
+                    sa.Column('statusChangedTo', sa.Boolean(), nullable=False),
+                    sa.Column('deviceId', sa.Uuid(), nullable=False),
+                    sa.Column('deviceWattage', sa.Float(), nullable=True),
+                    sa.Column('userId', sa.Text(), nullable=False),
+                    sa.Column('createdAt', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+                    sa.Column('updatedAt', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+                    sa.PrimaryKeyConstraint('deviceControlLogId')
+                    )
+    op.create_table('DeviceEnergyRollups',
+                    sa.Column('deviceId', sa.Uuid(), nullable=False),
+                    sa.Column('bucketStart', sa.DateTime(timezone=True), nullable=False),
+                    sa.Column('onSeconds', sa.Float(), nullable=False),
+                    sa.Column('wattHours', sa.Float(), nullable=False),
+                    sa.PrimaryKeyConstraint('deviceId', 'bucketStart')
+                    )
+    op.create_table('HouseMembers',
+                    sa.Column('userId', sa.Text(), nullable=False),
+                    sa.Column('houseId', sa.Uuid(), nullable=False),
+                    sa.ForeignKeyConstraint(['houseId'], ['House.houseId'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('userId', 'houseId')
+                    )
+    op.create_table('Rooms',
+                    sa.Column('roomId', sa.Uuid(), nullable=False),
+                    sa.Column('roomName', sa.Text(), nullable=True),
+                    sa.Column('houseId', sa.Uuid(), nullable=False),
+                    sa.Column('createdAt', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+                    sa.Column('updatedAt', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+                    sa.ForeignKeyConstraint(['houseId'], ['House.houseId'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('roomId')
+                    )
+    op.create_table('Devices',
+                    sa.Column('deviceId', sa.Uuid(), nullable=False),
+                    sa.Column('deviceName', sa.Text(), nullable=False),
+                    sa.Column('pinNumber', sa.Integer(), nullable=False),
+                    sa.Column('status', sa.Boolean(), nullable=False),
+                    sa.Column('isDefault', sa.Boolean(), nullable=False),
+                    sa.Column('roomId', sa.Uuid(), nullable=False),
+                    sa.Column('isScheduled', sa.Boolean(), nullable=False),
+                    sa.Column('daysScheduled', sa.VARCHAR(length=30), nullable=True),
+                    sa.Column('startTime', sa.VARCHAR(length=64), nullable=True),
+                    sa.Column('offTime', sa.VARCHAR(length=64), nullable=True),
+                    sa.Column('scheduledBy', sa.Text(), nullable=True),
+                    sa.Column('wattage', sa.Float(), nullable=True),
+                    sa.Column('createdAt', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+                    sa.Column('updatedAt', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+                    sa.ForeignKeyConstraint(['roomId'], ['Rooms.roomId'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('deviceId'),
+                    sa.UniqueConstraint('pinNumber')
+                    )
+
+
+def downgrade() -> None:
+    op.drop_table('Devices')
+    op.drop_table('Rooms')
+    op.drop_table('HouseMembers')
+    op.drop_table('DeviceEnergyRollups')
+    op.drop_table('DeviceControlLogs')
+    op.drop_table('House')
@@ -0,0 +1,32 @@
+"""Device control log indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Per device history and the latest log per device.
+    op.create_index('ix_DeviceControlLogs_deviceId_createdAt', 'DeviceControlLogs', ['deviceId', 'createdAt'])
+    # Logs are appended in time order, a BRIN index covers date range scans in a few pages.
+    if op.get_context().dialect.name == 'postgresql':
+        op.create_index('ix_DeviceControlLogs_createdAt_brin', 'DeviceControlLogs', ['createdAt'], postgresql_using='brin')
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == 'postgresql':
+        op.drop_index('ix_DeviceControlLogs_createdAt_brin', table_name='DeviceControlLogs')
+    op.drop_index('ix_DeviceControlLogs_deviceId_createdAt', table_name='DeviceControlLogs')
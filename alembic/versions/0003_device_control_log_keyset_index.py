@@ -0,0 +1,27 @@
+"""Device control log keyset index
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Log pages and exports walk the table in (createdAt, deviceControlLogId) order.
+    op.create_index('ix_DeviceControlLogs_createdAt_deviceControlLogId', 'DeviceControlLogs', ['createdAt', 'deviceControlLogId'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_DeviceControlLogs_createdAt_deviceControlLogId', table_name='DeviceControlLogs')
@@ -0,0 +1,38 @@
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.actions import iter_device_switch_history, replace_energy_rollups
+from services.energy_rollup import RollupIncrements, add_interval
+
+
+# Rebuilds the hourly energy rollups from the device control logs.
+# Run it while the server is stopped, switches made meanwhile would be counted twice.
+# The logs are streamed, only the rollups are held in memory.
+
+increments: RollupIncrements = {}
+log_count = 0
+current_device_id = None
+on_since = None
+on_wattage = None
+
+for device_id, created_at, status_changed_to, wattage in iter_device_switch_history():
+    log_count += 1
+    if device_id != current_device_id:
+        # Intervals still open are added by the server at query time.
+        current_device_id, on_since, on_wattage = device_id, None, None
+    if status_changed_to:
+        if on_since is None:
+            on_since, on_wattage = created_at, wattage
+    elif on_since is not None:
+        add_interval(increments, device_id, on_since, created_at,
+                     on_wattage if on_wattage is not None else wattage)
+        on_since, on_wattage = None, None
+
+rollup_count = replace_energy_rollups([
+    {"deviceId": device_id, "bucketStart": bucket_start,
+        "onSeconds": on_seconds, "wattHours": watt_hours}
+    for (device_id, bucket_start), (on_seconds, watt_hours) in increments.items()])
+
+if isinstance(rollup_count, SQLAlchemyError):
+    raise Exception(rollup_count._message())
+
+print(f"[Backfilled] {rollup_count} hourly energy rollup(s) from {log_count} log(s).")
@@ -0,0 +1,260 @@
+'''
+Profiles a cold start of server.py: what importing it costs, how long each module level
+singleton takes to build, and how long the staged startup takes to reach ready.
+
+Every run is a fresh interpreter started with -X importtime against a local SQLite
+database seeded with a house of --devices devices. Relays use the --gpio-backend from
+controller/gpio.py (gpiozero's mock pins by default) and the NTP sync is skipped, so the
+system clock is never touched. The first run only warms up the bytecode cache.
+
+python -m benchmarks.cold_start [--runs 5] [--devices 12] [--top 20] [--gpio-backend mock|simulated] [--sqlite /tmp/autopi_cold_start.sqlite3]
+'''
+import argparse
+import ast
+import asyncio
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+SERVER_PATH = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), "server.py")
+PROJECT_PACKAGES = {"server", "controller", "database", "helpers", "services"}
+IMPORT_TIME_LINE = re.compile(
+    r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+READY_TIMEOUT_SECONDS = 30
+
+
+def get_server_imports() -> Tuple[List[str], Dict[str, str]]:
+    '''Modules server.py imports and, for `from x import Name`, Name -> module.'''
+    with open(SERVER_PATH, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules: List[str] = []
+    names: Dict[str, str] = {}
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module is not None:
+            modules.append(node.module)
+            for alias in node.names:
+                names[alias.asname or alias.name] = node.module
+    return modules, names
+
+
+def get_server_singletons(names: Dict[str, str]) -> List[Tuple[str, str, str]]:
+    '''(variable, module, class) of every `variable = Class(...)` at server.py's module level.'''
+    with open(SERVER_PATH, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    singletons: List[Tuple[str, str, str]] = []
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name):
+            class_name = node.value.func.id
+            if class_name in names and isinstance(node.targets[0], ast.Name):
+                singletons.append(
+                    (node.targets[0].id, names[class_name], class_name))
+    return singletons
+
+
+def time_constructor(cls: type, name: str, timings: Dict[str, float]):
+    constructor = cls.__init__
+
+    def timed_constructor(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            constructor(self, *args, **kwargs)
+        finally:
+            timings[name] = (time.perf_counter() - start) * 1000
+    setattr(cls, "__init__", timed_constructor)
+
+
+async def wait_until_ready(server) -> Tuple[float, float]:
+    '''Runs the app's lifespan until the staged startup reports ready, returns how long that took and when.'''
+    start = time.perf_counter()
+    async with server.lifespan(server.app):
+        deadline = start + READY_TIMEOUT_SECONDS
+        while not server.sys.is_ready:
+            if len(server.sys.phase_errors) > 0 or time.perf_counter() > deadline:
+                raise RuntimeError(
+                    f"Startup did not complete: {server.sys.phase_errors}")
+            await asyncio.sleep(0.001)
+        ready_ms, ready_at = (time.perf_counter() - start) * 1000, time.time()
+    return ready_ms, ready_at
+
+
+def run_child(result_path: str):
+    '''One cold start, run in its own interpreter by main().'''
+    modules, names = get_server_imports()
+
+    start = time.perf_counter()
+    for module in modules:
+        __import__(module)
+    imports_ms = (time.perf_counter() - start) * 1000
+
+    # The NTP sync runs in the background and would set the clock with sudo.
+    from helpers.system_time import SystemTime
+    setattr(SystemTime, "set_system_time_from_server", lambda self: False)
+
+    singleton_ms: Dict[str, float] = {}
+    for variable, module, class_name in get_server_singletons(names):
+        time_constructor(getattr(sys.modules[module], class_name),
+                         f"{variable} ({class_name})", singleton_ms)
+
+    start = time.perf_counter()
+    import server
+    module_body_ms = (time.perf_counter() - start) * 1000
+
+    from database.database import create_db_engine
+    start = time.perf_counter()
+    engine = create_db_engine()
+    with engine.connect():
+        pass
+    engine_ms = (time.perf_counter() - start) * 1000
+    engine.dispose()
+
+    ready_ms, ready_at = asyncio.run(wait_until_ready(server))
+
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "imports_ms": imports_ms,
+            "module_body_ms": module_body_ms,
+            "engine_ms": engine_ms,
+            "singleton_ms": singleton_ms,
+            "startup_ms": ready_ms,
+            "phase_ms": server.sys.phase_timings_ms,
+            "ready_at": ready_at,
+        }, f)
+
+
+def prepare_database(devices: int):
+    '''Creates the schema and a house with `devices` devices, replacing whatever is in the file.'''
+    from sqlalchemy import insert
+
+    from database.database import Base, create_db_engine
+    from database.db_models import Houses, Room, Device
+
+    engine = create_db_engine()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    house_id, room_id = uuid.uuid4(), uuid.uuid4()
+    with engine.begin() as connection:
+        connection.execute(insert(Houses), [
+                           {"houseId": house_id, "houseName": "Benchmark House", "passwordHash": "-"}])
+        connection.execute(insert(Room), [
+                           {"roomId": room_id, "roomName": "Room", "houseId": house_id}])
+        if devices > 0:
+            # BCM GPIO 2-27, the pins devices can be configured on.
+            connection.execute(insert(Device), [{"deviceId": uuid.uuid4(), "deviceName": f"Device {index}", "pinNumber": 2 + index,
+                                                 "roomId": room_id, "status": False, "isDefault": False, "isScheduled": False}
+                                                for index in range(devices)])
+    engine.dispose()
+
+
+def parse_import_times(stderr: str) -> Tuple[Dict[str, int], Dict[str, int]]:
+    '''Self time per top-level package and cumulative time per module from -X importtime, in microseconds.'''
+    package_self_us: Dict[str, int] = defaultdict(int)
+    module_cumulative_us: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, _, module = match.groups()
+        package_self_us[module.split(".")[0]] += int(self_us)
+        module_cumulative_us[module] = int(cumulative_us)
+    return package_self_us, module_cumulative_us
+
+
+def cold_start(result_path: str) -> Tuple[dict, Dict[str, int], Dict[str, int]]:
+    started_at = time.time()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-m", "benchmarks.cold_start", "--child", result_path],
+                             capture_output=True, text=True, env=os.environ.copy())
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"Cold start failed:\n{process.stdout}\n{process.stderr[-4000:]}")
+    with open(result_path, "r", encoding="utf-8") as f:
+        result = json.load(f)
+    result["process_to_ready_ms"] = (result["ready_at"] - started_at) * 1000
+    package_self_us, module_cumulative_us = parse_import_times(process.stderr)
+    return result, package_self_us, module_cumulative_us
+
+
+def median(values: List[float]) -> float:
+    return statistics.median(values) if len(values) > 0 else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--devices", type=int, default=12, choices=range(0, 27),
+                        metavar="0-26")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--gpio-backend", default="mock",
+                        choices=["mock", "simulated"])
+    parser.add_argument("--sqlite", default=os.path.join(
+        tempfile.gettempdir(), "autopi_cold_start.sqlite3"))
+    parser.add_argument("--child", metavar="RESULT_PATH", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(args.child)
+        return
+
+    # helpers.config reads these at import, in this process and in every child.
+    os.environ["AUTOPI_DB_BACKEND"] = "sqlite"
+    os.environ["AUTOPI_SQLITE_PATH"] = args.sqlite
+    os.environ.pop("AUTOPI_DATABASE_URL", None)
+    os.environ["AUTOPI_GPIO_BACKEND"] = args.gpio_backend
+    prepare_database(args.devices)
+
+    results: List[dict] = []
+    package_self_us: Dict[str, List[int]] = defaultdict(list)
+    module_cumulative_us: Dict[str, List[int]] = defaultdict(list)
+    with tempfile.TemporaryDirectory() as directory:
+        result_path = os.path.join(directory, "result.json")
+        cold_start(result_path)
+        for _ in range(args.runs):
+            result, packages, modules = cold_start(result_path)
+            results.append(result)
+            for package, self_us in packages.items():
+                package_self_us[package].append(self_us)
+            for module, cumulative_us in modules.items():
+                module_cumulative_us[module].append(cumulative_us)
+
+    print(f"Cold start of server.py, median of {args.runs} run(s), {args.devices} device(s), {args.gpio_backend} GPIO, SQLite at {args.sqlite}")
+    print(f"  {'process start to ready':<46} {median([r['process_to_ready_ms'] for r in results]):9.1f} ms")
+    print(f"  {'server.py imports':<46} {median([r['imports_ms'] for r in results]):9.1f} ms")
+    print(f"  {'server.py module body':<46} {median([r['module_body_ms'] for r in results]):9.1f} ms")
+    print(f"  {'engine create + first connect':<46} {median([r['engine_ms'] for r in results]):9.1f} ms")
+    print(f"  {'lifespan start to ready':<46} {median([r['startup_ms'] for r in results]):9.1f} ms")
+
+    print("\nSingleton construction")
+    for name in results[0]["singleton_ms"]:
+        print(f"  {name:<46} {median([r['singleton_ms'].get(name, 0.0) for r in results]):9.2f} ms")
+
+    print("\nStartup phases")
+    for name in results[0]["phase_ms"]:
+        print(f"  {name:<46} {median([r['phase_ms'].get(name, 0.0) for r in results]):9.2f} ms")
+
+    package_medians = sorted(((median(times) / 1000, package) for package, times in package_self_us.items()),
+                             reverse=True)
+    total_ms = sum(milliseconds for milliseconds, _ in package_medians)
+    print(f"\nImport time by top-level package (self time, {total_ms:.1f} ms total)")
+    for milliseconds, package in package_medians[:args.top]:
+        marker = "*" if package in PROJECT_PACKAGES else " "
+        print(f" {marker}{package:<46} {milliseconds:9.1f} ms  {milliseconds / total_ms * 100 if total_ms > 0 else 0:5.1f}%")
+
+    module_medians = sorted(((median(times) / 1000, module) for module, times in module_cumulative_us.items()),
+                            reverse=True)
+    print("\nSlowest modules (cumulative, includes their imports)")
+    for milliseconds, module in module_medians[:args.top]:
+        print(f"  {module:<46} {milliseconds:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
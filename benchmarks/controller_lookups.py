@@ -0,0 +1,75 @@
+'''Compares ControllerDevice's indexed lookups with the previous linear scan over the house tree.
+
+Run from the repository root: python -m benchmarks.controller_lookups
+'''
+import timeit
+import uuid
+
+from controller.controller_device import ControllerDevice
+from helpers.data_models import House, Room, Device
+
+
+DEVICES_PER_ROOM = 10
+HOUSE_SIZES = [10, 100, 1000]
+LOOKUPS = 10_000
+
+
+def build_house(device_count: int) -> House:
+    house = House()
+    house.house_id = str(uuid.uuid4())
+    house.house_name = "Benchmark House"
+    house.rooms = []
+    for index in range(device_count):
+        if index % DEVICES_PER_ROOM == 0:
+            room = Room()
+            room.room_id = str(uuid.uuid4())
+            room.room_name = f"Room {len(house.rooms)}"
+            room.house_id = house.house_id
+            room.devices = []
+            house.rooms.append(room)
+        device = Device()
+        device.device_id = str(uuid.uuid4())
+        device.device_name = f"Device {index}"
+        device.pin_number = index
+        device.status = False
+        device.room_id = house.rooms[-1].room_id
+        house.rooms[-1].devices.append(device)
+    return house
+
+
+def scan_device(house: House, id: str):
+    '''The lookup ControllerDevice.get_device used before the indexes were added.'''
+    for room in house.rooms:
+        for device in room.devices:
+            if device.device_id == id:
+                return device
+
+
+def build_controller(house: House) -> ControllerDevice:
+    # Skip __init__ so no database or GPIO is touched.
+    controller = ControllerDevice.__new__(ControllerDevice)
+    controller.house = house
+    controller.build_indexes()
+    return controller
+
+
+def main():
+    print(f"{'devices':>8} {'scan (us)':>12} {'index (us)':>12} {'speedup':>9}")
+    for device_count in HOUSE_SIZES:
+        house = build_house(device_count)
+        controller = build_controller(house)
+        # The last device is the worst case for the scan.
+        device_id = house.rooms[-1].devices[-1].device_id
+
+        scan_seconds = timeit.timeit(
+            lambda: scan_device(house, device_id), number=LOOKUPS)
+        index_seconds = timeit.timeit(
+            lambda: controller.get_device(device_id), number=LOOKUPS)
+
+        scan_us = scan_seconds / LOOKUPS * 1_000_000
+        index_us = index_seconds / LOOKUPS * 1_000_000
+        print(f"{device_count:>8} {scan_us:>12.3f} {index_us:>12.3f} {scan_us / index_us:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
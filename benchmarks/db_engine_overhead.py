@@ -0,0 +1,59 @@
+'''
+Measures engine startup and per-query overhead for the previous engine settings
+(echo=True, default pool) and the configured ones from helpers.config.
+
+python -m benchmarks.db_engine_overhead [--queries 500]
+
+Results are printed to stderr so stdout (where echo writes) can be sent to a file or journald.
+'''
+import argparse
+import sys
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.database import create_db_engine
+from database.db_models import Houses, HouseMember
+from helpers.config import DATABASE_URL
+
+
+def measure(name: str, engine_factory, queries: int):
+    start = time.perf_counter()
+    engine = engine_factory()
+    with engine.connect():
+        pass
+    startup_ms = (time.perf_counter() - start) * 1000
+
+    get_db = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    start = time.perf_counter()
+    for _ in range(queries):
+        db = get_db()
+        try:
+            with db.begin():
+                # The two lookups get_access used to run on every request.
+                house = db.query(Houses).first()
+                if house is not None:
+                    db.query(HouseMember).filter(
+                        HouseMember.houseId == house.houseId).first()
+        finally:
+            db.close()
+    per_query_ms = (time.perf_counter() - start) * 1000 / queries
+    engine.dispose()
+
+    print(f"{name:>10}  startup: {startup_ms:8.2f} ms  per request: {per_query_ms:6.3f} ms",
+          file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    measure("previous", lambda: create_engine(
+        DATABASE_URL, echo=True), args.queries)
+    measure("tuned", create_db_engine, args.queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+'''
+Times the NumPy energy engine on synthetic control logs and checks it against a
+per-device Python loop.
+
+Then compares feeding it from a log window (--window-days of logs at --switches-per-hour per
+device): ISO timestamp strings parsed with datetime.fromisoformat() per log, the way logs used
+to arrive, against the epoch-microsecond columns of a LogBatch.
+
+Needs numpy: pip install -r requirements-dev.txt
+
+python -m benchmarks.energy_consumption [--rows 1000000] [--devices 200] [--window-days 30] [--switches-per-hour 2]
+'''
+import argparse
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import numpy as np
+
+from helpers.data_models import LogBatch
+from services.energy_consumption import calculate_device_watt_hours, calculate_energy_consumption
+from services.energy_rollup import summarize_energy_consumption
+
+
+def generate_logs(rows: int, devices: int, seed: int = 7):
+    '''Interleaved logs for `devices` devices over 30 days, with repeated ONs/OFFs and missing wattages.'''
+    rng = np.random.default_rng(seed)
+    device_codes = rng.integers(0, devices, rows)
+    timestamps = rng.uniform(0, 30 * 86400, rows)
+    status_changed_to = rng.random(rows) < 0.5
+    wattages = rng.choice([5.0, 60.0, 100.0, 1500.0, np.nan], rows)
+    return device_codes, timestamps, status_changed_to, wattages
+
+
+def reference_watt_hours(device_codes, timestamps, status_changed_to, wattages, end_timestamp: float, devices: int):
+    '''The same rules as the engine, one log at a time.'''
+    totals = [0.0] * devices
+    on_since: Dict[int, tuple] = {}
+    for index in sorted(range(len(device_codes)), key=lambda i: (device_codes[i], timestamps[i])):
+        device = int(device_codes[index])
+        if status_changed_to[index]:
+            on_since.setdefault(
+                device, (timestamps[index], wattages[index]))
+        elif device in on_since:
+            start, watts = on_since.pop(device)
+            watts = watts if not np.isnan(watts) else wattages[index]
+            if not np.isnan(watts):
+                totals[device] += (timestamps[index] - start) / 3600 * watts
+    for device, (start, watts) in on_since.items():
+        if not np.isnan(watts):
+            totals[device] += (end_timestamp - start) / 3600 * watts
+    return np.array(totals)
+
+
+def generate_window(devices: int, window_days: int, switches_per_hour: int) -> List[tuple]:
+    '''Log rows as the database returns them, `devices` devices switching alternately ON and OFF.'''
+    device_ids = [uuid.uuid4() for _ in range(devices)]
+    count = devices * window_days * 24 * switches_per_hour
+    start = datetime.now(timezone.utc) - timedelta(days=window_days)
+    step = timedelta(days=window_days) / count
+    rows = []
+    for index in range(count):
+        created_at = start + step * index
+        is_on = (index // devices) % 2 == 0
+        rows.append((uuid.uuid4(), device_ids[index % devices], "benchmark",
+                     not is_on, is_on, 60.0, created_at, created_at))
+    return rows
+
+
+def iso_string_watt_hours(device_ids: List[str], created_at: List[str], status_changed_to: List[bool],
+                          wattages: List[float | None], end_date: datetime) -> np.ndarray:
+    '''How calculate_energy_consumption built its arrays from logs with ISO string timestamps.'''
+    unique_ids, device_codes = np.unique(
+        np.array(device_ids, dtype=object).astype(str), return_inverse=True)
+    timestamps = np.fromiter((datetime.fromisoformat(moment).timestamp()
+                             for moment in created_at), dtype=np.float64, count=len(created_at))
+    is_on = np.fromiter((bool(status) for status in status_changed_to),
+                        dtype=bool, count=len(status_changed_to))
+    watts = np.fromiter((wattage if wattage is not None else np.nan for wattage in wattages),
+                        dtype=np.float64, count=len(wattages))
+    return calculate_device_watt_hours(device_codes, timestamps, is_on, watts, end_date.timestamp(), len(unique_ids))
+
+
+def compare_window(devices: int, window_days: int, switches_per_hour: int):
+    rows = generate_window(devices, window_days, switches_per_hour)
+    end_date = datetime.now(timezone.utc)
+    device_ids = [str(row[1]) for row in rows]
+    created_at = [row[6].isoformat() for row in rows]
+    status_changed_to = [row[4] for row in rows]
+    wattages = [row[5] for row in rows]
+    log_batch = LogBatch()
+    log_batch.extend(rows)
+
+    start = time.perf_counter()
+    expected = iso_string_watt_hours(
+        device_ids, created_at, status_changed_to, wattages, end_date)
+    iso_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    consumption = calculate_energy_consumption(log_batch, end_date)
+    batch_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{len(rows)} logs over {window_days} day(s), {devices} devices")
+    print(f"iso strings    {iso_ms:10.1f} ms")
+    print(f"LogBatch       {batch_ms:10.1f} ms  {iso_ms / batch_ms if batch_ms > 0 else 0:5.1f}x")
+    print(f"house total    {consumption.total_watt_hours:.1f} Wh, matches: {np.isclose(consumption.total_watt_hours, expected.sum())}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--window-days", type=int, default=30)
+    parser.add_argument("--switches-per-hour", type=int, default=2)
+    args = parser.parse_args()
+
+    logs = generate_logs(args.rows, args.devices)
+    end_timestamp = 30 * 86400.0
+
+    start = time.perf_counter()
+    device_watt_hours = calculate_device_watt_hours(
+        *logs, end_timestamp, args.devices)
+    engine_ms = (time.perf_counter() - start) * 1000
+
+    device_ids = [f"device-{index}" for index in range(args.devices)]
+    device_rooms = {device_id: f"room-{index // 10}" for index,
+                    device_id in enumerate(device_ids)}
+    start = time.perf_counter()
+    consumption = summarize_energy_consumption(
+        dict(zip(device_ids, device_watt_hours.tolist())), device_rooms)
+    summary_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    expected = reference_watt_hours(*logs, end_timestamp, args.devices)
+    reference_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{args.rows} logs, {args.devices} devices, {len(consumption.room_watt_hours)} rooms")
+    print(f"numpy engine   {engine_ms:10.1f} ms")
+    print(f"totals         {summary_ms:10.1f} ms")
+    print(f"python loop    {reference_ms:10.1f} ms")
+    print(f"house total    {consumption.total_watt_hours:.1f} Wh, matches loop: {np.allclose(device_watt_hours, expected)}")
+    print()
+
+    compare_window(args.devices, args.window_days, args.switches_per_hour)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+'''
+Measures memory and construction time of bulk device control logs: a list of DeviceControlLog
+objects built the way DeviceControlLog.get_data() builds them, before (__dict__, ISO string
+timestamps) and now (__slots__, datetimes), against the columnar LogBatch the bulk log
+queries return.
+
+Rows are generated up front as the database driver hands them over (uuid.UUID IDs, time zone
+aware datetimes), so only the conversion is measured. Memory is what tracemalloc counts as
+still allocated by the result. The slotted objects share their datetimes with the generated
+rows, so add 2 x 48 bytes per log for objects holding their own.
+
+python -m benchmarks.log_batch [--logs 1000000] [--devices 42] [--users 4]
+'''
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List
+
+from helpers.data_models import DeviceControlLog, LogBatch
+
+CHUNK_SIZE = 5000
+
+
+@dataclass(eq=False)
+class DictDeviceControlLog():
+    '''DeviceControlLog before slots and datetimes, every instance with its own __dict__.'''
+    device_control_log_id: str = ""
+    device_id: str = ""
+    user_id: str = ""
+    status_changed_from: bool = False
+    status_changed_to: bool = False
+    device_wattage: float | None = None
+    created_at: str = ""
+    updated_at: str = ""
+
+
+def generate_rows(logs: int, devices: int, users: int, seed: int = 7) -> List[tuple]:
+    rng = random.Random(seed)
+    device_ids = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(devices)]
+    user_ids = [f"user-{index}" for index in range(users)]
+    start = datetime.now(timezone.utc) - timedelta(days=30)
+    step = timedelta(days=30) / logs
+    rows = []
+    for index in range(logs):
+        created_at = start + step * index
+        rows.append((uuid.UUID(int=rng.getrandbits(128)), device_ids[index % devices], user_ids[index % users],
+                     index % 2 == 1, index % 2 == 0, 60.0 if index % 5 else None, created_at, created_at))
+    return rows
+
+
+def build_objects(model, rows: List[tuple], timestamp: Callable[[datetime], object]) -> list:
+    return [model(device_control_log_id=str(log_id), device_id=str(device_id), user_id=str(user_id),
+                  status_changed_from=bool(status_changed_from), status_changed_to=bool(
+                      status_changed_to),
+                  device_wattage=float(str(wattage)) if wattage is not None else None,
+                  created_at=timestamp(created_at), updated_at=timestamp(updated_at))
+            for log_id, device_id, user_id, status_changed_from, status_changed_to, wattage, created_at, updated_at in rows]
+
+
+def build_log_batch(rows: List[tuple]) -> LogBatch:
+    log_batch = LogBatch()
+    for index in range(0, len(rows), CHUNK_SIZE):
+        log_batch.extend(rows[index:index + CHUNK_SIZE])
+    return log_batch
+
+
+def measure(build: Callable[[], object], repeats: int) -> tuple:
+    durations = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        result = build()
+        durations.append(time.perf_counter() - start)
+        del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return min(durations), retained, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--logs", type=int, default=1_000_000)
+    parser.add_argument("--devices", type=int, default=42)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    rows = generate_rows(args.logs, args.devices, args.users)
+    print(f"{args.logs} log(s), {args.devices} device(s), {args.users} user(s)")
+
+    for name, build in (("objects, __dict__", lambda: build_objects(DictDeviceControlLog, rows, datetime.isoformat)),
+                        ("objects, __slots__", lambda: build_objects(
+                            DeviceControlLog, rows, lambda moment: moment)),
+                        ("LogBatch", lambda: build_log_batch(rows))):
+        seconds, retained, peak = measure(build, args.repeats)
+        print(f"  {name:<20} {seconds * 1000:9.0f} ms  {retained / 2 ** 20:8.1f} MB retained  "
+              f"{peak / 2 ** 20:8.1f} MB peak  {retained / args.logs:6.0f} B/log")
+
+    log_batch = build_log_batch(rows)
+    start = time.perf_counter()
+    encoded = sum(1 for _ in log_batch)
+    print(f"  LogBatch -> {encoded} DeviceControlLog(s) one at a time: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+'''
+Measures what the metrics in services/metrics.py cost: recording a sample from one and from
+several threads, the timed() decorator around a no-op and the ASGI middleware around a
+minimal app, and rendering /metrics with --routes routes worth of latency series.
+
+python -m benchmarks.metrics_overhead [--calls 200000] [--threads 4] [--routes 40]
+'''
+import argparse
+import asyncio
+import threading
+import time
+from typing import Callable
+
+from services.metrics import MetricsMiddleware, MetricsRegistry, timed
+
+
+def per_call_ns(operation: Callable[[], None], calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        operation()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def contended_ns(operation: Callable[[], None], calls: int, threads: int) -> float:
+    '''Wall time per call with `threads` threads recording at once.'''
+    workers = [threading.Thread(target=lambda: [operation() for _ in range(calls)])
+               for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (calls * threads) * 1e9
+
+
+async def middleware_ns(calls: int) -> tuple:
+    registry = MetricsRegistry()
+    histogram = registry.histogram("benchmark_request_seconds", "Benchmark.", ("method", "route", "status"))
+    scope = {"type": "http", "method": "GET", "path": "/benchmark"}
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    results = []
+    for handler in (app, MetricsMiddleware(app, histogram)):
+        start = time.perf_counter()
+        for _ in range(calls):
+            await handler(dict(scope), receive, send)
+        results.append((time.perf_counter() - start) / calls * 1e9)
+    return tuple(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--routes", type=int, default=40)
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    counter = registry.counter("benchmark_total", "Benchmark.", ("result",))
+    histogram = registry.histogram("benchmark_seconds", "Benchmark.", ("action",))
+
+    @timed(histogram, "noop")
+    def timed_noop():
+        pass
+
+    def noop():
+        pass
+
+    print(f"counter.inc          {per_call_ns(lambda: counter.inc('ok'), args.calls):8.0f} ns")
+    print(f"histogram.observe    {per_call_ns(lambda: histogram.observe(0.003, 'get_house'), args.calls):8.0f} ns")
+    print(f"  {args.threads} threads        {contended_ns(lambda: histogram.observe(0.003, 'get_house'), args.calls // args.threads, args.threads):8.0f} ns")
+    print(f"timed() overhead     {per_call_ns(timed_noop, args.calls) - per_call_ns(noop, args.calls):8.0f} ns")
+
+    bare_ns, measured_ns = asyncio.run(middleware_ns(args.calls // 4))
+    print(f"middleware overhead  {measured_ns - bare_ns:8.0f} ns ({bare_ns:.0f} ns -> {measured_ns:.0f} ns per request)")
+
+    routes = registry.histogram("benchmark_request_seconds", "Benchmark.", ("method", "route", "status"))
+    for index in range(args.routes):
+        for status in ("200", "400", "500"):
+            routes.observe(0.01, "GET", f"/route-{index}", status)
+    start = time.perf_counter()
+    body = registry.render()
+    print(f"render               {(time.perf_counter() - start) * 1000:8.2f} ms ({args.routes * 3} route series, {len(body) / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    main()
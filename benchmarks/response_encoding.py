@@ -0,0 +1,170 @@
+'''
+Compares response encoding with the stdlib json module over to_dict() copies (the previous
+path) against orjson encoding the helpers.data_models dataclasses directly.
+
+Payloads are the /get-house tree, a /get-device-control-logs page and the NDJSON body of
+/export-device-control-logs for a realistic house (--rooms rooms of --devices-per-room
+devices, a month of --switches-per-day switches per device) and one --scale times larger.
+
+Then times the same served payloads with the timestamps formatted into strings as the models
+are built (the previous get_data(), str() for the house and isoformat() for logs) against
+datetimes that orjson formats while encoding.
+
+python -m benchmarks.response_encoding [--rooms 6] [--devices-per-room 7] [--switches-per-day 24] [--scale 10]
+'''
+import argparse
+import dataclasses
+import json
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List
+
+import orjson
+
+from helpers.data_models import Device, DeviceControlLog, House, Room
+from helpers.request_models import ResponseStatusCodes
+from helpers.responses import build_envelope
+from services.log_export import LogExportFormats, encode_logs
+
+LOG_PAGE_SIZE = 500
+
+
+def build_house(rooms: int, devices_per_room: int) -> House:
+    now = datetime.now(timezone.utc)
+    house = House(house_id=str(uuid.uuid4()), house_name="Benchmark House",
+                  created_at=now, updated_at=now, _house_password_hash="-")
+    for room_index in range(rooms):
+        room = Room(room_id=str(uuid.uuid4()), room_name=f"Room {room_index}",
+                    house_id=house.house_id, created_at=now, updated_at=now)
+        for device_index in range(devices_per_room):
+            room.devices.append(Device(device_id=str(uuid.uuid4()), device_name=f"Device {device_index}",
+                                       pin_number=room_index * devices_per_room + device_index, status=device_index % 2 == 0,
+                                       room_id=room.room_id, is_scheduled=device_index % 3 == 0,
+                                       days_scheduled="mon,tue,wed,thu,fri", start_time="18:00", off_time="23:00",
+                                       scheduled_by="benchmark", wattage=60.0, created_at=now, updated_at=now))
+        house.rooms.append(room)
+    return house
+
+
+def build_logs(house: House, switches_per_day: int, days: int = 30) -> List[DeviceControlLog]:
+    device_ids = [device.device_id for room in house.rooms for device in room.devices]
+    count = len(device_ids) * switches_per_day * days
+    start = datetime.now(timezone.utc) - timedelta(days=days)
+    step = timedelta(days=days) / max(count, 1)
+    logs: List[DeviceControlLog] = []
+    for index in range(count):
+        created_at = start + step * index
+        logs.append(DeviceControlLog(device_control_log_id=str(uuid.uuid4()), device_id=device_ids[index % len(device_ids)],
+                                     user_id="benchmark", status_changed_from=index % 2 == 1, status_changed_to=index % 2 == 0,
+                                     device_wattage=60.0, created_at=created_at, updated_at=created_at))
+    return logs
+
+
+def stdlib_ndjson(logs: List[DeviceControlLog]) -> bytes:
+    return "".join(json.dumps(log.to_dict(), separators=(",", ":")) + "\n" for log in logs).encode("utf-8")
+
+
+def measure(operation: Callable[[], bytes], repeats: int) -> tuple:
+    durations = []
+    size = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        size = len(operation())
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations), size
+
+
+def compare(name: str, previous: Callable[[], bytes], current: Callable[[], bytes], repeats: int):
+    previous_ms, previous_size = measure(previous, repeats)
+    current_ms, current_size = measure(current, repeats)
+    print(f"  {name:<22} json: {previous_ms:9.2f} ms ({previous_size / 1024:8.0f} KB)  "
+          f"orjson: {current_ms:9.2f} ms ({current_size / 1024:8.0f} KB)  {previous_ms / current_ms if current_ms > 0 else 0:5.1f}x")
+
+
+def run(label: str, rooms: int, devices_per_room: int, switches_per_day: int, repeats: int):
+    house = build_house(rooms, devices_per_room)
+    logs = build_logs(house, switches_per_day)
+    page = logs[:LOG_PAGE_SIZE]
+    print(f"{label}: {rooms * devices_per_room} device(s), {len(logs)} log(s) exported, {len(page)} per page")
+
+    compare("/get-house",
+            lambda: json.dumps(build_envelope("success", ResponseStatusCodes.REQUEST_FULLFILLED, "House data retrieved successfully.",
+                                              house.to_dict())).encode("utf-8"),
+            lambda: orjson.dumps(build_envelope("success", ResponseStatusCodes.REQUEST_FULLFILLED, "House data retrieved successfully.",
+                                                house)),
+            repeats)
+    compare("log page",
+            lambda: json.dumps(build_envelope("success", ResponseStatusCodes.REQUEST_FULLFILLED, "Device Control Logs fetched successfully.",
+                                              {"logs": [log.to_dict() for log in page], "next_cursor": None})).encode("utf-8"),
+            lambda: orjson.dumps(build_envelope("success", ResponseStatusCodes.REQUEST_FULLFILLED, "Device Control Logs fetched successfully.",
+                                                {"logs": page, "next_cursor": None})),
+            repeats)
+    compare("log export (ndjson)",
+            lambda: stdlib_ndjson(logs),
+            lambda: b"".join(encode_logs(logs, LogExportFormats.NDJSON)),
+            max(3, repeats // 10))
+    compare_timestamps(house, logs, repeats)
+
+
+def with_string_timestamps(model, format_timestamp: Callable[[datetime], str]):
+    '''Copy of a model with its timestamps formatted, what get_data() built before datetimes were kept.'''
+    return dataclasses.replace(model, created_at=format_timestamp(model.created_at), updated_at=format_timestamp(model.updated_at))
+
+
+def compare_timestamps(house: House, logs: List[DeviceControlLog], repeats: int):
+    '''Model building plus encoding, with the formatting done per timestamp in Python against by orjson.'''
+    page = logs[:LOG_PAGE_SIZE]
+
+    def string_house() -> House:
+        copy = with_string_timestamps(house, str)
+        copy.rooms = []
+        for room in house.rooms:
+            room_copy = with_string_timestamps(room, str)
+            room_copy.devices = [with_string_timestamps(device, str) for device in room.devices]
+            copy.rooms.append(room_copy)
+        return copy
+
+    def datetime_house() -> House:
+        copy = dataclasses.replace(house)
+        copy.rooms = []
+        for room in house.rooms:
+            room_copy = dataclasses.replace(room)
+            room_copy.devices = [dataclasses.replace(device) for device in room.devices]
+            copy.rooms.append(room_copy)
+        return copy
+
+    print("  timestamps, strings -> datetimes (building the models and encoding)")
+    for name, previous, current, name_repeats in (
+            ("/get-house", lambda: orjson.dumps(string_house()), lambda: orjson.dumps(datetime_house()), repeats),
+            ("log page", lambda: orjson.dumps([with_string_timestamps(log, datetime.isoformat) for log in page]),
+             lambda: orjson.dumps([dataclasses.replace(log) for log in page]), repeats),
+            ("log export (ndjson)",
+             lambda: b"".join(encode_logs((with_string_timestamps(log, datetime.isoformat) for log in logs), LogExportFormats.NDJSON)),
+             lambda: b"".join(encode_logs((dataclasses.replace(log) for log in logs), LogExportFormats.NDJSON)),
+             max(3, repeats // 10))):
+        previous_ms, previous_size = measure(previous, name_repeats)
+        current_ms, current_size = measure(current, name_repeats)
+        print(f"  {name:<22} strings: {previous_ms:9.2f} ms ({previous_size / 1024:8.0f} KB)  "
+              f"datetimes: {current_ms:9.2f} ms ({current_size / 1024:8.0f} KB)  {previous_ms / current_ms if current_ms > 0 else 0:5.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rooms", type=int, default=6)
+    parser.add_argument("--devices-per-room", type=int, default=7)
+    parser.add_argument("--switches-per-day", type=int, default=24)
+    parser.add_argument("--scale", type=int, default=10,
+                        help="rooms multiplier for the larger house")
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+
+    run("realistic", args.rooms, args.devices_per_room,
+        args.switches_per_day, args.repeats)
+    run(f"{args.scale}x", args.rooms * args.scale, args.devices_per_room,
+        args.switches_per_day, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
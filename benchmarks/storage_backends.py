@@ -0,0 +1,107 @@
+'''
+Compares switch and log query latency on the storage backends.
+
+Each backend gets the schema, a house with --devices devices and --logs control logs, then
+times persist_device_switches (one switch per transaction, as the log writer does with a
+batch of one) and the log queries behind /get-device-control-logs and the energy report.
+
+python -m benchmarks.storage_backends [--sqlite /tmp/autopi_bench.sqlite3] [--postgres-url postgresql://.../scratch_db]
+
+Use a scratch PostgreSQL database, its tables are emptied first.
+'''
+import argparse
+import os
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+import database.actions as actions
+from database.database import Base, create_db_engine
+from database.db_models import Houses, Room, Device, DeviceControlLog
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def seed(engine, devices: int, logs: int) -> List[str]:
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    house_id, room_id = uuid.uuid4(), uuid.uuid4()
+    device_ids = [uuid.uuid4() for _ in range(devices)]
+    now = datetime.now(timezone.utc)
+    with engine.begin() as connection:
+        connection.execute(insert(Houses), [{"houseId": house_id, "houseName": "Benchmark House", "passwordHash": "-"}])
+        connection.execute(insert(Room), [{"roomId": room_id, "roomName": "Room", "houseId": house_id}])
+        connection.execute(insert(Device), [{"deviceId": device_id, "deviceName": f"Device {index}", "pinNumber": index,
+                                             "roomId": room_id, "status": False, "isDefault": False, "isScheduled": False}
+                                            for index, device_id in enumerate(device_ids)])
+        for start in range(0, logs, 10_000):
+            connection.execute(insert(DeviceControlLog), [{
+                "deviceControlLogId": uuid.uuid4(), "statusChangedFrom": index % 2 == 0, "statusChangedTo": index % 2 == 1,
+                "deviceId": device_ids[index % devices], "deviceWattage": 60.0, "userId": "benchmark",
+                # Spread over the last 365 days, oldest first like the real table.
+                "createdAt": now - timedelta(seconds=(logs - index) * 365 * 86400 / logs)}
+                for index in range(start, min(logs, start + 10_000))])
+    return [str(device_id) for device_id in device_ids]
+
+
+def measure(name: str, operation: Callable[[int], object], count: int):
+    latencies = []
+    for index in range(count):
+        start = time.perf_counter()
+        result = operation(index)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if isinstance(result, Exception):
+            raise result
+    print(f"  {name:<24} p50: {percentile(latencies, 50):7.2f} ms  p99: {percentile(latencies, 99):7.2f} ms  "
+          f"mean: {statistics.mean(latencies):7.2f} ms")
+
+
+def run(label: str, url: str, args: argparse.Namespace):
+    engine = create_db_engine(url)
+    print(f"{label} ({url})")
+    device_ids = seed(engine, args.devices, args.logs)
+    # database.actions opens its sessions through get_db.
+    actions.get_db = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    now = datetime.now(timezone.utc)
+
+    measure("switch", lambda index: actions.persist_device_switches([{
+        "statusChangedFrom": index % 2 == 0, "statusChangedTo": index % 2 == 1, "deviceId": device_ids[index % len(device_ids)],
+        "deviceWattage": 60.0, "userId": "benchmark", "createdAt": datetime.now(timezone.utc)}],
+        {device_ids[index % len(device_ids)]: index % 2 == 1}), args.switches)
+    measure("log page (500)", lambda index: actions.get_device_control_log_page(
+        now - timedelta(days=30), now, "all", None, 500), args.queries)
+    measure("device logs, 30 days", lambda index: actions.get_specific_device_control_logs(
+        now - timedelta(days=30), now, device_ids[index % len(device_ids)]), args.queries)
+    measure("latest log per device", lambda index: actions.get_open_device_intervals(), args.queries)
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sqlite", default="/tmp/autopi_bench.sqlite3")
+    parser.add_argument("--postgres-url", default=None)
+    parser.add_argument("--devices", type=int, default=40)
+    parser.add_argument("--logs", type=int, default=200_000)
+    parser.add_argument("--switches", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.sqlite + suffix):
+            os.remove(args.sqlite + suffix)
+    run("sqlite", f"sqlite:///{args.sqlite}", args)
+    if args.postgres_url is not None:
+        run("postgresql", args.postgres_url, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+'''
+Load test for /switch-device: N concurrent clients toggle a device and the latency
+percentiles are reported. Run it against a build before and after a change to compare.
+
+Off the Pi, start the server with AUTOPI_GPIO_BACKEND=simulated (and optionally
+AUTOPI_GPIO_SIMULATED_LATENCY_MS) to exercise the whole switching pipeline without relays.
+
+Needs httpx: pip install -r requirements-dev.txt
+
+python -m benchmarks.switch_load_test --url http://rpi.local:8000 --user-id <id> --house-id <id> --device-id <id>
+'''
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+import httpx
+
+
+async def run_client(client: httpx.AsyncClient, args: argparse.Namespace, latencies: List[float], errors: List[str]):
+    state = False
+    for _ in range(args.requests):
+        state = not state
+        body = {
+            "houseId": args.house_id,
+            "userId": args.user_id,
+            "userName": "Load Test",
+            "deviceId": args.device_id,
+            "deviceName": "Load Test Device",
+            "statusFrom": not state,
+            "statusTo": state,
+        }
+        start = time.perf_counter()
+        try:
+            response = await client.patch("/switch-device", json=body)
+            if response.json().get("status") != "success":
+                errors.append(response.text)
+        except httpx.HTTPError as e:
+            errors.append(str(e))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def main(args: argparse.Namespace):
+    latencies: List[float] = []
+    errors: List[str] = []
+    # A connection per client like the app's users. One shared pool would rescan all of its
+    # connections for every queued request, which starves the load generator itself on a Pi.
+    clients = [httpx.AsyncClient(base_url=args.url, limits=httpx.Limits(max_connections=1), timeout=30)
+               for _ in range(args.clients)]
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*[run_client(client, args, latencies, errors)
+                               for client in clients])
+        elapsed = time.perf_counter() - start
+    finally:
+        await asyncio.gather(*[client.aclose() for client in clients])
+
+    print(f"clients: {args.clients}, requests: {len(latencies)}, errors: {len(errors)}")
+    print(f"throughput: {len(latencies) / elapsed:.1f} req/s")
+    print(f"latency ms  p50: {percentile(latencies, 50):.1f}  p90: {percentile(latencies, 90):.1f}  "
+          f"p99: {percentile(latencies, 99):.1f}  max: {max(latencies):.1f}  mean: {statistics.mean(latencies):.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--house-id", required=True)
+    parser.add_argument("--device-id", required=True)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=20,
+                        help="requests per client")
+    asyncio.run(main(parser.parse_args()))
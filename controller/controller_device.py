@@ -1,23 +1,56 @@
-from typing import List
-from gpiozero import OutputDevice
+import hashlib
+import time
+from typing import Dict, List, Tuple
 
-import RPi.GPIO as GPIO  # type: ignore
+import orjson
 
 from sqlalchemy.exc import SQLAlchemyError
 
+from controller.gpio import GPIOBackend, OutputChannel, create_gpio_backend
 from database.actions import get_house_data
 from helpers.data_models import House, Room, Device
+from helpers.request_models import Scenes
+from services.metrics import DEVICE_SWITCH_SECONDS, DEVICE_SWITCHES, GPIO_WRITE_SECONDS, timed
 from services.schedule import ScheduleDeviceAssistant
 
 
+def write_output(output_device: OutputChannel, status: bool):
+    start = time.perf_counter()
+    if status:
+        output_device.on()
+    else:
+        output_device.off()
+    GPIO_WRITE_SECONDS.observe(
+        time.perf_counter() - start, "on" if status else "off")
+
+
 class ControllerDevice:
 
+    gpio_backend: GPIOBackend
     house: House | None = None
 
-    def __init__(self):
+    # Lookup indexes over `house`, kept in sync by add/remove room/device.
+    rooms_by_id: Dict[str, Room]
+    devices_by_id: Dict[str, Device]
+    devices_by_pin: Dict[int, Device]
+
+    # Serialized copy of `house` served by /get-house, rebuilt only after the tree changes.
+    house_version: int = 0
+    house_snapshot: bytes | None = None
+    house_snapshot_etag: str | None = None
+
+    def __init__(self, gpio_backend: GPIOBackend | None = None):
+        '''
+        Nothing is loaded here, the server's startup calls load_data() and initialize_gpio().
+        Outputs are opened on `gpio_backend`, by default the one configured with AUTOPI_GPIO_BACKEND.
+        '''
+        self.gpio_backend = gpio_backend if gpio_backend is not None else create_gpio_backend()
+        self.rooms_by_id = {}
+        self.devices_by_id = {}
+        self.devices_by_pin = {}
+
+    def initialize_gpio(self):
         try:
-            self.load_data()
-            self.release_all_rpi_gpio_resources()
             self.initialize_output_devices()
         except Exception as e:
             print(f"Error initializing ControllerDevice: {e}")
@@ -27,95 +60,225 @@ class ControllerDevice:
         try:
             data = get_house_data()
             if isinstance(data, SQLAlchemyError):
-                raise Exception(
-                    "[Controller] [DB] Unable to load controller data.")
+                print("[Controller] [DB] Unable to load controller data.")
+                return data
             self.house = data
+            self.build_indexes()
+            self.invalidate_house_snapshot()
         except Exception as e:
             print(f"Error in load_data: {e}")
 
-    def release_all_rpi_gpio_resources(self):
-        GPIO.cleanup()
+    def build_indexes(self):
+        self.rooms_by_id = {}
+        self.devices_by_id = {}
+        self.devices_by_pin = {}
+        if self.house is not None:
+            for room in self.house.rooms:
+                self.index_room(room)
+
+    def index_room(self, room: Room):
+        self.rooms_by_id[room.room_id] = room
+        for device in room.devices:
+            self.index_device(device)
+
+    def index_device(self, device: Device):
+        self.devices_by_id[device.device_id] = device
+        self.devices_by_pin[device.pin_number] = device
+
+    def unindex_device(self, device: Device):
+        self.devices_by_id.pop(device.device_id, None)
+        if self.devices_by_pin.get(device.pin_number) is device:
+            del self.devices_by_pin[device.pin_number]
+
+    def release_gpio_resources(self):
+        self.gpio_backend.cleanup()
 
     def initialize_output_devices(self):
         try:
             if self.house is not None:
                 for room in self.house.rooms:
                     for device in room.devices:
-                        device.output_device = OutputDevice(
-                            device.pin_number, active_high=False)
+                        device.output_device = self.gpio_backend.open_output(
+                            device.pin_number)
         except Exception as e:
             print(f"Error initializing output devices: {e}")
             raise Exception(f"Error initializing output devices: {e}")
 
+    def invalidate_house_snapshot(self):
+        self.house_version += 1
+        self.house_snapshot = None
+        self.house_snapshot_etag = None
+
+    def get_house_snapshot(self) -> tuple[bytes, str] | None:
+        '''Returns the JSON encoded house and its ETag, serializing only if the house changed since the last call.'''
+        if self.house is None:
+            return None
+
+        snapshot = self.house_snapshot
+        etag = self.house_snapshot_etag
+        if snapshot is not None and etag is not None:
+            return snapshot, etag
+
+        version = self.house_version
+        # The house dataclass is encoded as is, its password hash is a private field orjson skips.
+        snapshot = orjson.dumps(self.house)
+        etag = f'"{hashlib.sha1(snapshot).hexdigest()}"'
+        # Only keep the snapshot if nothing changed the house while it was being serialized.
+        if version == self.house_version:
+            self.house_snapshot = snapshot
+            self.house_snapshot_etag = etag
+        return snapshot, etag
+
     def add_room(self, room: Room):
         if self.house is not None:
             self.house.rooms.append(room)
+            self.index_room(room)
+            self.invalidate_house_snapshot()
 
-    def get_room(self, id: str):
-        try:
-            if self.house is not None:
-                for room in self.house.rooms:
-                    if room.room_id == id:
-                        return room
-        except Exception as e:
-            print(f"Error getting room: {e}")
-            return None
+    def get_room(self, id: str) -> Room | None:
+        return self.rooms_by_id.get(id)
 
-    def remove_room(self, room_id: str, schedule_assistant: ScheduleDeviceAssistant):
+    def remove_room(self, room_id: str, schedule_assistant: ScheduleDeviceAssistant) -> List[str]:
+        '''Returns the IDs of the devices removed with the room.'''
         if self.house is not None:
             room = self.get_room(room_id)
             if room is not None:
                 for device in room.devices:
+                    self.unindex_device(device)
                     if device.output_device is not None:
                         device.output_device.close()
                         schedule_assistant.remove_scheduled_device(
                             device.device_id)
+                self.rooms_by_id.pop(room.room_id, None)
                 self.house.rooms.remove(room)
+                self.invalidate_house_snapshot()
+                return [device.device_id for device in room.devices]
+        return []
 
     def add_device(self, device: Device):
         room = self.get_room(device.room_id)
         if room is not None:
-            device.output_device = OutputDevice(
-                device.pin_number, active_high=False)
+            device.output_device = self.gpio_backend.open_output(
+                device.pin_number)
             room.devices.append(device)
+            self.index_device(device)
+            self.invalidate_house_snapshot()
 
-    def get_device(self, id: str):
-        try:
-            if self.house is not None:
-                for room in self.house.rooms:
-                    for device in room.devices:
-                        if device.device_id == id:
-                            return device
-        except Exception as e:
-            print(f"Error getting device: {e}")
-            return None
+    def get_device(self, id: str) -> Device | None:
+        return self.devices_by_id.get(id)
+
+    def get_device_by_pin(self, pin_number: int) -> Device | None:
+        return self.devices_by_pin.get(pin_number)
+
+    def get_device_rooms(self) -> Dict[str, str]:
+        '''device_id -> room_id of every device in the house.'''
+        return {device_id: device.room_id for device_id, device in self.devices_by_id.items()}
 
     def get_scheduled_devices(self) -> List[Device] | None:
-        scheduled_devices: List[Device] = []
         if self.house is not None:
-            for room in self.house.rooms:
-                for device in room.devices:
-                    if device.is_scheduled:
-                        scheduled_devices.append(device)
-            return scheduled_devices
+            return [device for device in self.devices_by_id.values() if device.is_scheduled]
 
+    @timed(DEVICE_SWITCH_SECONDS)
     def switch_device(self, id: str, status: bool):
         try:
             device = self.get_device(id)
             output_device = device.output_device if device is not None else None
             if output_device is not None:
-                if status:
-                    output_device.on()
-                else:
-                    output_device.off()
+                write_output(output_device, status)
+                if device is not None and device.status != status:
+                    device.status = status
+                    self.invalidate_house_snapshot()
             else:
                 if device is None:
                     raise Exception(f"Device with id '{id}' not found.")
                 if output_device is None:
                     raise Exception(f"Output Device is not initialized.")
         except Exception as e:
+            DEVICE_SWITCHES.inc("error")
             print(f"Error switching device: {e}")
             raise Exception(f"Error switching device: {e}")
+        DEVICE_SWITCHES.inc("ok")
+
+    def get_scene_switches(self, scene: str, room_id: str | None = None) -> List[Tuple[str, bool]] | None:
+        '''(device_id, state) pairs for a built-in scene, None if the scene or room is unknown.'''
+        if scene in Scenes.ROOM:
+            room = self.get_room(room_id) if room_id is not None else None
+            if room is None:
+                return None
+            return [(device.device_id, scene == Scenes.ROOM_ON) for device in room.devices]
+        if scene in (Scenes.ALL_OFF, Scenes.ALL_ON):
+            return [(device_id, scene == Scenes.ALL_ON) for device_id in self.devices_by_id]
+        return None
+
+    def switch_devices(self, switches: List[Tuple[str, bool]]) -> Tuple[List[Tuple[Device, bool]], Dict[str, str]]:
+        '''
+        Switches several devices in one pass, skipping the ones already in the requested state.
+        Returns the switched devices with their previous status, and device_id -> error for the
+        ones that couldn't be switched. The house snapshot is invalidated once.
+        '''
+        switched: List[Tuple[Device, bool]] = []
+        failed: Dict[str, str] = {}
+        for device_id, status in switches:
+            device = self.get_device(device_id)
+            if device is None:
+                failed[device_id] = f"Device with id '{device_id}' not found."
+                continue
+            if device.status == status:
+                continue
+            output_device = device.output_device
+            if output_device is None:
+                failed[device_id] = "Output Device is not initialized."
+                continue
+            try:
+                write_output(output_device, status)
+            except Exception as e:
+                print(f"Error switching device: {e}")
+                failed[device_id] = f"Error switching device: {e}"
+                continue
+            switched.append((device, device.status))
+            device.status = status
+        DEVICE_SWITCHES.inc("ok", amount=len(switched))
+        if len(failed) > 0:
+            DEVICE_SWITCHES.inc("error", amount=len(failed))
+        if len(switched) > 0:
+            self.invalidate_house_snapshot()
+        return switched, failed
+
+    def configure_device(self, device_id: str, device_name: str, pin_number: int, is_on: bool | None, is_default: bool,
+                         is_scheduled: bool, days_scheduled: str, start_time: str, off_time: str, scheduled_by: str,
+                         wattage: float | None) -> Device | None:
+        '''
+        Applies a device's new configuration and re-opens its output on the (possibly new) pin, all in one
+        call on the GPIO thread. `is_on` None keeps the current status. Returns the device, None if
+        there is no such device.
+        '''
+        device = self.get_device(device_id)
+        if device is None:
+            return None
+        self.remove_device(device_id)
+
+        device.device_name = device_name
+        device.pin_number = pin_number
+        device.is_scheduled = is_scheduled
+        device.days_scheduled = days_scheduled if is_scheduled else ""
+        device.start_time = start_time if is_scheduled else ""
+        device.off_time = off_time if is_scheduled else ""
+        if is_on is not None:
+            device.status = is_on
+        device.scheduled_by = scheduled_by
+        device.wattage = wattage
+        device.output_device = None
+
+        # Mirror database.actions.configure_device: changing the default device clears the room's other defaults.
+        if device.is_default != is_default:
+            room = self.get_room(device.room_id)
+            if room is not None:
+                for room_device in room.devices:
+                    room_device.is_default = False
+        device.is_default = is_default
+
+        self.add_device(device)
+        return device
 
     def remove_device(self, device_id):
         device = self.get_device(device_id)
@@ -123,6 +286,8 @@ class ControllerDevice:
             output_device = device.output_device
             if output_device is not None:
                 output_device.close()
-            room = self.get_room(device.device_id)
+            self.unindex_device(device)
+            room = self.get_room(device.room_id)
             if room is not None:
                 room.devices.remove(device)
+                self.invalidate_house_snapshot()
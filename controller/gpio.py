@@ -0,0 +1,146 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Protocol
+
+from helpers.config import GPIO_BACKEND, GPIO_SIMULATED_LATENCY_MS
+
+
+class OutputChannel(Protocol):
+    '''A relay output, what the controller switches a device through.'''
+
+    def on(self) -> None: ...
+
+    def off(self) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class GPIOBackend(ABC):
+    '''Opens output channels by BCM pin number. Relays are active low.'''
+
+    name: str = ""
+
+    @abstractmethod
+    def open_output(self, pin_number: int) -> OutputChannel:
+        ...
+
+    def cleanup(self):
+        '''Releases pins left claimed, e.g. by a previous run that didn't exit cleanly.'''
+
+
+class GpiozeroBackend(GPIOBackend):
+    '''gpiozero OutputDevices on the Pi's pins.'''
+
+    name = "gpiozero"
+    pin_factory: object | None = None
+
+    def open_output(self, pin_number: int) -> OutputChannel:
+        # Imported here so the other backends run where gpiozero's pin libraries aren't installed.
+        from gpiozero import OutputDevice
+        return OutputDevice(pin_number, active_high=False, pin_factory=self.pin_factory)
+
+    def cleanup(self):
+        import RPi.GPIO as GPIO  # type: ignore
+        GPIO.cleanup()
+
+
+class MockGpiozeroBackend(GpiozeroBackend):
+    '''gpiozero OutputDevices on its MockFactory, pin states can be read back from `pin_factory`.'''
+
+    name = "mock"
+
+    def __init__(self):
+        from gpiozero.pins.mock import MockFactory
+        self.pin_factory = MockFactory()
+
+    def cleanup(self):
+        pass
+
+
+class SimulatedOutput():
+    '''In-memory output channel that blocks for the backend's switch latency, like a relay driver would.'''
+
+    pin_number: int
+    backend: "SimulatedBackend"
+    is_active: bool = False
+    switch_count: int = 0
+    closed: bool = False
+
+    def __init__(self, pin_number: int, backend: "SimulatedBackend"):
+        self.pin_number = pin_number
+        self.backend = backend
+
+    def on(self):
+        self.set(True)
+
+    def off(self):
+        self.set(False)
+
+    def set(self, is_active: bool):
+        if self.closed:
+            raise RuntimeError(f"GPIO{self.pin_number} is closed.")
+        if self.backend.latency_seconds > 0:
+            time.sleep(self.backend.latency_seconds)
+        self.is_active = is_active
+        self.switch_count += 1
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.backend.release(self)
+
+
+class SimulatedBackend(GPIOBackend):
+    '''
+    Pure Python outputs with a configurable switch latency, for running and load testing the
+    switching pipeline on any machine. Like gpiozero, a pin can only be opened once at a time.
+    '''
+
+    name = "simulated"
+    latency_seconds: float
+    outputs: Dict[int, SimulatedOutput]
+    lock: threading.Lock
+
+    def __init__(self, latency_ms: float = GPIO_SIMULATED_LATENCY_MS):
+        self.latency_seconds = latency_ms / 1000
+        self.outputs = {}
+        self.lock = threading.Lock()
+
+    def open_output(self, pin_number: int) -> OutputChannel:
+        with self.lock:
+            if pin_number in self.outputs:
+                raise RuntimeError(f"GPIO{pin_number} is already in use.")
+            output = SimulatedOutput(pin_number, self)
+            self.outputs[pin_number] = output
+            return output
+
+    def release(self, output: SimulatedOutput):
+        with self.lock:
+            if self.outputs.get(output.pin_number) is output:
+                del self.outputs[output.pin_number]
+
+    def cleanup(self):
+        with self.lock:
+            outputs = list(self.outputs.values())
+        for output in outputs:
+            output.close()
+
+    def get_states(self) -> Dict[int, bool]:
+        with self.lock:
+            return {pin_number: output.is_active for pin_number, output in self.outputs.items()}
+
+
+GPIO_BACKENDS = {
+    GpiozeroBackend.name: GpiozeroBackend,
+    MockGpiozeroBackend.name: MockGpiozeroBackend,
+    SimulatedBackend.name: SimulatedBackend,
+}
+
+
+def create_gpio_backend(name: str = GPIO_BACKEND) -> GPIOBackend:
+    backend = GPIO_BACKENDS.get(name)
+    if backend is None:
+        raise ValueError(
+            f"Unknown GPIO backend '{name}', expected one of {', '.join(GPIO_BACKENDS)}.")
+    return backend()
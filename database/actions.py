@@ -1,18 +1,42 @@
 
 from datetime import datetime
-from typing import List
-from sqlalchemy import or_
+import functools
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+from sqlalchemy import Row, bindparam, func, insert, or_, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
 
-from database.database import get_db
-from database.db_models import Houses, HouseMember, Room, Device, DeviceControlLog
-from helpers.data_models import HouseMember as HouseMemberData, Room as RoomData, Device as DeviceData, House as HouseData, DeviceControlLog as DeviceControlLogData
+from database.database import disable_statement_timeout, get_db
+from database.db_models import Houses, HouseMember, Room, Device, DeviceControlLog, DeviceEnergyRollup
+from helpers.data_models import HouseMember as HouseMemberData, Room as RoomData, Device as DeviceData, House as HouseData, DeviceControlLog as DeviceControlLogData, LogBatch as LogBatchData
 
+from services.metrics import DB_ACTION_ERRORS, DB_ACTION_SECONDS
 from services.scheduled_device import get_scheduled_device_status
 
 from helpers.header_pins import HeaderPinType, HeaderPinConfigDataModel, pin_header_config
 
 
+def timed_action(action):
+    '''Records the action's duration, and SQLAlchemyErrors it returns, as autopi_db_action_* metrics by function name.'''
+    name = action.__name__
+
+    @functools.wraps(action)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = action(*args, **kwargs)
+        finally:
+            DB_ACTION_SECONDS.observe(time.perf_counter() - start, name)
+        if isinstance(result, SQLAlchemyError):
+            DB_ACTION_ERRORS.inc(name)
+        return result
+    return timed
+
+
+@timed_action
 def init_house_db(house_password_hash: str):
     db = get_db()
     try:
@@ -31,6 +55,7 @@ def init_house_db(house_password_hash: str):
         db.close()
 
 
+@timed_action
 def get_house() -> HouseData | None | SQLAlchemyError:
     db = get_db()
     try:
@@ -49,6 +74,7 @@ def get_house() -> HouseData | None | SQLAlchemyError:
         db.close()
 
 
+@timed_action
 def add_user(user_id: str) -> HouseMemberData | SQLAlchemyError:
     db = get_db()
     try:
@@ -74,6 +100,7 @@ def add_user(user_id: str) -> HouseMemberData | SQLAlchemyError:
         db.close()
 
 
+@timed_action
 def get_house_members() -> List[HouseMemberData] | SQLAlchemyError:
     db = get_db()
     try:
@@ -89,6 +116,7 @@ def get_house_members() -> List[HouseMemberData] | SQLAlchemyError:
         db.close()
 
 
+@timed_action
 def get_user(user_id: str) -> HouseMemberData | None | SQLAlchemyError:
     db = get_db()
     try:
@@ -107,6 +135,7 @@ def get_user(user_id: str) -> HouseMemberData | None | SQLAlchemyError:
         db.close()
 
 
+@timed_action
 def delete_user(user_id: str) -> int | SQLAlchemyError:
     db = get_db()
     try:
@@ -123,6 +152,7 @@ def delete_user(user_id: str) -> int | SQLAlchemyError:
         db.close()
 
 
+@timed_action
 def get_access(user_id: str) -> bool | SQLAlchemyError:
     db = get_db()
     try:
@@ -149,6 +179,7 @@ def get_access(user_id: str) -> bool | SQLAlchemyError:
         db.close()
 
 
+@timed_action
 def create_room(room_name: str, house_id: str) -> RoomData | SQLAlchemyError:
     db = get_db()
     try:
@@ -165,6 +196,7 @@ def create_room(room_name: str, house_id: str) -> RoomData | SQLAlchemyError:
         db.close()
 
 
+@timed_action
 def remove_room(room_id: str) -> int | SQLAlchemyError:
     db = get_db()
     try:
@@ -181,6 +213,7 @@ def remove_room(room_id: str) -> int | SQLAlchemyError:
         db.close()
 
 
+@timed_action
 def create_device(device_name: str, pin_number: int, wattage: float, room_id: str) -> DeviceData | SQLAlchemyError:
     db = get_db()
     try:
@@ -200,6 +233,7 @@ def create_device(device_name: str, pin_number: int, wattage: float, room_id: st
         db.close()
 
 
+@timed_action
 def switch_device(device_id: str, from_status: bool, to_status: bool, user_id: str) -> int | SQLAlchemyError:
     db = get_db()
     try:
@@ -227,6 +261,34 @@ def switch_device(device_id: str, from_status: bool, to_status: bool, user_id: s
         db.close()
 
 
+@timed_action
+def persist_device_switches(logs: List[Dict[str, Any]], device_statuses: Dict[str, bool], rollups: List[Dict[str, Any]] = []) -> int | SQLAlchemyError:
+    '''Writes a batch of device control logs, the latest status of each device and energy rollup increments in one transaction.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            if len(device_statuses) > 0:
+                # Core executemany, devices removed meanwhile simply match no row.
+                devices = Device.__table__
+                db.connection().execute(
+                    update(devices).where(devices.c.deviceId == bindparam("device_id")).values(
+                        status=bindparam("status")),
+                    [{"device_id": device_id, "status": status} for device_id, status in device_statuses.items()])
+            if len(logs) > 0:
+                db.execute(insert(DeviceControlLog), logs)
+            if len(rollups) > 0:
+                add_energy_rollups(db, rollups)
+            db.flush()
+            return len(logs)
+    except SQLAlchemyError as SQLError:
+        print("[DB] Persist Device Switches Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+@timed_action
 def configure_device(device_id: str, device_name: str, pin_number: int, status: bool, is_default: bool, is_scheduled: bool, days_scheduled: str, start_time: str, off_time: str, wattage: float, user_id: str) -> int | SQLAlchemyError:
     db = get_db()
     try:
@@ -276,6 +338,7 @@ def configure_device(device_id: str, device_name: str, pin_number: int, status:
         db.close()
 
 
+@timed_action
 def remove_device(device_id: str) -> int | SQLAlchemyError:
     db = get_db()
     try:
@@ -293,6 +356,7 @@ def remove_device(device_id: str) -> int | SQLAlchemyError:
         db.close()
 
 
+@timed_action
 def get_house_data() -> HouseData | SQLAlchemyError:
     db = get_db()
     try:
@@ -310,6 +374,7 @@ def get_house_data() -> HouseData | SQLAlchemyError:
         db.close()
 
 
+@timed_action
 def get_scheduled_devices() -> List[DeviceData] | SQLAlchemyError:
     db = get_db()
     try:
@@ -325,6 +390,7 @@ def get_scheduled_devices() -> List[DeviceData] | SQLAlchemyError:
         db.close()
 
 
+@timed_action
 def get_available_gpio_pins() -> List[HeaderPinConfigDataModel] | SQLAlchemyError:
     db = get_db()
     try:
@@ -347,24 +413,80 @@ def get_available_gpio_pins() -> List[HeaderPinConfigDataModel] | SQLAlchemyErro
         db.close()
 
 
-def get_device_control_logs() -> List[DeviceControlLogData] | SQLAlchemyError:
+def read_log_rows(db, query, batch_size: int = 5000) -> Iterator[Sequence[Row]]:
+    '''
+    Runs a DeviceControlLog query for the LogBatch.extend() columns, yielding `batch_size` row chunks
+    as plain tuples, without building ORM objects.
+    '''
+    statement = query.with_entities(DeviceControlLog.deviceControlLogId, DeviceControlLog.deviceId, DeviceControlLog.userId,
+                                    DeviceControlLog.statusChangedFrom, DeviceControlLog.statusChangedTo, DeviceControlLog.deviceWattage,
+                                    DeviceControlLog.createdAt, DeviceControlLog.updatedAt).statement
+    yield from db.execute(statement, execution_options={"yield_per": batch_size}).partitions()
+
+
+def read_log_batch(db, query, batch_size: int = 5000) -> LogBatchData:
+    '''Reads a DeviceControlLog query into a LogBatch in `batch_size` row chunks.'''
+    log_batch = LogBatchData()
+    for rows in read_log_rows(db, query, batch_size):
+        log_batch.extend(rows)
+    return log_batch
+
+
+def filter_device_control_logs(query, start_date: datetime | None, end_date: datetime | None, device_id="all"):
+    if start_date is not None:
+        query = query.filter(DeviceControlLog.createdAt >= start_date)
+    if end_date is not None:
+        query = query.filter(DeviceControlLog.createdAt <= end_date)
+    if device_id != "all":
+        query = query.filter(DeviceControlLog.deviceId == device_id)
+    return query
+
+
+@timed_action
+def get_device_control_log_page(start_date: datetime | None, end_date: datetime | None, device_id="all", after: Tuple[datetime, str] | None = None, limit: int = 500) -> LogBatchData | SQLAlchemyError:
+    '''Keyset pagination in (createdAt, deviceControlLogId) order, `after` is the (createdAt, id) of the previous page's last log.'''
     db = get_db()
     try:
         with db.begin() as txn:
-            logs = db.query(DeviceControlLog).all()
-            logs_data = [log.get_data()
-                         for log in logs] if len(logs) > 0 else []
-            db.flush()
-            return logs_data
+            query = filter_device_control_logs(
+                db.query(DeviceControlLog), start_date, end_date, device_id)
+            if after is not None:
+                query = query.filter(tuple_(DeviceControlLog.createdAt, DeviceControlLog.deviceControlLogId) > tuple_(
+                    after[0], uuid.UUID(after[1])))
+            return read_log_batch(db, query.order_by(DeviceControlLog.createdAt,
+                                                     DeviceControlLog.deviceControlLogId).limit(limit))
     except SQLAlchemyError as SQLError:
-        print("[DB] Fetch Device Control Logs Failed.")
+        print("[DB] Fetch Device Control Log Page Failed.")
         print(SQLError)
         return SQLError
     finally:
         db.close()
 
 
-def get_specific_device_control_logs(start_date: datetime, end_date: datetime, device_id="all") -> List[DeviceControlLogData] | SQLAlchemyError:
+def iter_device_control_logs(start_date: datetime | None = None, end_date: datetime | None = None, device_id="all", batch_size: int = 1000) -> Iterator[DeviceControlLogData]:
+    '''
+    Streams logs in (createdAt, deviceControlLogId) order through a server-side cursor, holding
+    `batch_size` rows at a time. Raises SQLAlchemyError since a stream can't return one midway.
+    '''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            query = filter_device_control_logs(
+                db.query(DeviceControlLog), start_date, end_date, device_id)
+            for rows in read_log_rows(db, query.order_by(DeviceControlLog.createdAt, DeviceControlLog.deviceControlLogId), batch_size):
+                log_batch = LogBatchData()
+                log_batch.extend(rows)
+                yield from log_batch
+    except SQLAlchemyError as SQLError:
+        print("[DB] Stream Device Control Logs Failed.")
+        print(SQLError)
+        raise
+    finally:
+        db.close()
+
+
+@timed_action
+def get_specific_device_control_logs(start_date: datetime, end_date: datetime, device_id="all") -> LogBatchData | SQLAlchemyError:
     db = get_db()
     try:
         with db.begin() as txn:
@@ -373,14 +495,105 @@ def get_specific_device_control_logs(start_date: datetime, end_date: datetime, d
                 DeviceControlLog.createdAt <= end_date)
             if (device_id != "all"):
                 query = query.filter(DeviceControlLog.deviceId == device_id)
-            logs = query.all()
-            logs_data = [log.get_data()
-                         for log in logs] if len(logs) > 0 else []
-            db.flush()
-            return logs_data
+            return read_log_batch(db, query)
     except SQLAlchemyError as SQLError:
         print("[DB] Fetch Specific Device Control Logs Failed.")
         print(SQLError)
         return SQLError
     finally:
         db.close()
+
+
+def add_energy_rollups(db, rollups: List[Dict[str, Any]]):
+    '''Adds {deviceId, bucketStart, onSeconds, wattHours} increments to the hourly energy rollups.'''
+    rollup_table = DeviceEnergyRollup.__table__
+    dialect_insert = sqlite_insert if db.bind.dialect.name == "sqlite" else postgresql_insert
+    statement = dialect_insert(rollup_table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[rollup_table.c.deviceId, rollup_table.c.bucketStart],
+        set_={
+            "onSeconds": rollup_table.c.onSeconds + statement.excluded.onSeconds,
+            "wattHours": rollup_table.c.wattHours + statement.excluded.wattHours,
+        })
+    db.connection().execute(statement, rollups)
+
+
+@timed_action
+def get_energy_rollup_totals(start_date: datetime, end_date: datetime) -> List[tuple] | SQLAlchemyError:
+    '''Returns (device_id, on_seconds, watt_hours) summed over the hourly buckets starting in [start_date, end_date).'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            totals = db.query(DeviceEnergyRollup.deviceId, func.sum(DeviceEnergyRollup.onSeconds), func.sum(DeviceEnergyRollup.wattHours)).filter(
+                DeviceEnergyRollup.bucketStart >= start_date,
+                DeviceEnergyRollup.bucketStart < end_date).group_by(DeviceEnergyRollup.deviceId).all()
+            return [(str(device_id), float(on_seconds or 0), float(watt_hours or 0)) for device_id, on_seconds, watt_hours in totals]
+    except SQLAlchemyError as SQLError:
+        print("[DB] Fetch Energy Rollups Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+@timed_action
+def get_open_device_intervals() -> List[tuple] | SQLAlchemyError:
+    '''
+    Returns (device_id, on_since, wattage) for every existing device whose latest control log
+    switched it ON. Logs outlive their device (no foreign key), deleted devices are left out.
+    '''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            latest = db.query(DeviceControlLog.deviceId, func.max(DeviceControlLog.createdAt).label(
+                "createdAt")).filter(DeviceControlLog.deviceId.in_(db.query(Device.deviceId))).group_by(DeviceControlLog.deviceId).subquery()
+            logs = db.query(DeviceControlLog).join(latest, (DeviceControlLog.deviceId == latest.c.deviceId) & (
+                DeviceControlLog.createdAt == latest.c.createdAt)).all()
+            return [(str(log.deviceId), log.createdAt, log.deviceWattage) for log in logs if log.statusChangedTo]
+    except SQLAlchemyError as SQLError:
+        print("[DB] Fetch Open Device Intervals Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
+
+
+def iter_device_switch_history(batch_size: int = 5000) -> Iterator[Tuple[str, datetime, bool, float | None]]:
+    '''
+    Streams (device_id, created_at, status_changed_to, wattage) for every control log, ordered by device
+    and time, holding `batch_size` rows at a time. Raises SQLAlchemyError like iter_device_control_logs.
+    '''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            disable_statement_timeout(db.connection())
+            history = db.query(DeviceControlLog.deviceId, DeviceControlLog.createdAt, DeviceControlLog.statusChangedTo, DeviceControlLog.deviceWattage).order_by(
+                DeviceControlLog.deviceId, DeviceControlLog.createdAt).yield_per(batch_size)
+            for device_id, created_at, status_changed_to, wattage in history:
+                yield str(device_id), created_at, status_changed_to, wattage
+    except SQLAlchemyError as SQLError:
+        print("[DB] Stream Device Switch History Failed.")
+        print(SQLError)
+        raise
+    finally:
+        db.close()
+
+
+@timed_action
+def replace_energy_rollups(rollups: List[Dict[str, Any]]) -> int | SQLAlchemyError:
+    '''Deletes all energy rollups and writes `rollups` instead, used by the backfill.'''
+    db = get_db()
+    try:
+        with db.begin() as txn:
+            disable_statement_timeout(db.connection())
+            db.query(DeviceEnergyRollup).delete()
+            for index in range(0, len(rollups), 1000):
+                db.execute(insert(DeviceEnergyRollup), rollups[index:index + 1000])
+            db.flush()
+            return len(rollups)
+    except SQLAlchemyError as SQLError:
+        print("[DB] Replace Energy Rollups Failed.")
+        print(SQLError)
+        return SQLError
+    finally:
+        db.close()
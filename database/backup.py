@@ -0,0 +1,274 @@
+import gzip
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+from sqlalchemy import Connection, Table, func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import sqltypes
+from sqlalchemy.types import TypeDecorator
+
+from database.database import disable_statement_timeout, engine
+from database.db_models import Houses, HouseMember, Room, Device, DeviceControlLog, DeviceEnergyRollup
+
+
+BACKUP_FORMAT = "autopi-hub-backup"
+BACKUP_FORMAT_VERSION = 1
+DEFAULT_BACKUP_PATH = "data/house_backup.ndjson.gz"
+
+# Parents before children, restore deletes in reverse.
+BACKUP_TABLES: List[Table] = [Houses.__table__, HouseMember.__table__, Room.__table__,  # type: ignore
+                              Device.__table__, DeviceControlLog.__table__, DeviceEnergyRollup.__table__]  # type: ignore
+
+INSERT_BATCH_SIZE = 5000
+
+
+class BackupReport():
+    '''Rows per table and how long a backup or restore took.'''
+
+    table_rows: Dict[str, int]
+    table_seconds: Dict[str, float]
+    seconds: float = 0.0
+    archive_bytes: int = 0
+
+    def __init__(self):
+        self.table_rows = {}
+        self.table_seconds = {}
+
+    def print_summary(self, action: str):
+        for table, rows in self.table_rows.items():
+            seconds = self.table_seconds.get(table, 0.0)
+            print(f"[{action}] {table}: {rows} row(s) in {seconds:.2f}s ({rows / seconds if seconds > 0 else 0:.0f} rows/s)")
+        total_rows = sum(self.table_rows.values())
+        print(f"[{action}] {total_rows} row(s), {self.archive_bytes / 1024 / 1024:.1f} MB archive in {self.seconds:.2f}s "
+              f"({total_rows / self.seconds if self.seconds > 0 else 0:.0f} rows/s)")
+
+
+def encode_value(value: Any) -> Any:
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def get_decoder(column_type: Any) -> Callable[[Any], Any] | None:
+    '''Turns archived JSON values back into what the column's type expects.'''
+    if isinstance(column_type, TypeDecorator):
+        column_type = column_type.impl_instance
+    if isinstance(column_type, sqltypes.Uuid):
+        return lambda value: uuid.UUID(value) if value is not None else None
+    if isinstance(column_type, sqltypes.DateTime):
+        return lambda value: datetime.fromisoformat(value) if value is not None else None
+    return None
+
+
+def backup_house_data(path: str = DEFAULT_BACKUP_PATH) -> BackupReport | SQLAlchemyError:
+    '''
+    Writes every table to a gzip NDJSON archive: a header line, then per table a
+    {"table", "columns", "rows"} line followed by one JSON array per row. Rows are
+    streamed from one consistent snapshot and keep their IDs and timestamps.
+    '''
+    report = BackupReport()
+    started = time.perf_counter()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        with engine.connect() as connection:
+            if connection.dialect.name == "postgresql":
+                connection = connection.execution_options(
+                    isolation_level="REPEATABLE READ")
+            with connection.begin(), gzip.open(f"{path}.tmp", "wt", encoding="utf-8", compresslevel=6) as archive:
+                disable_statement_timeout(connection)
+                archive.write(json.dumps({
+                    "format": BACKUP_FORMAT,
+                    "version": BACKUP_FORMAT_VERSION,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "tables": [table.name for table in BACKUP_TABLES]
+                }) + "\n")
+                for table in BACKUP_TABLES:
+                    table_started = time.perf_counter()
+                    columns = [column.name for column in table.columns]
+                    rows = connection.execute(
+                        select(func.count()).select_from(table)).scalar_one()
+                    archive.write(json.dumps(
+                        {"table": table.name, "columns": columns, "rows": rows}) + "\n")
+                    written = 0
+                    result = connection.execution_options(stream_results=True, yield_per=INSERT_BATCH_SIZE).execute(
+                        select(table))
+                    for row in result:
+                        archive.write(json.dumps(
+                            [encode_value(value) for value in row], separators=(",", ":")) + "\n")
+                        written += 1
+                    if written != rows:
+                        raise RuntimeError(
+                            f"{table.name} changed during the backup.")
+                    report.table_rows[table.name] = rows
+                    report.table_seconds[table.name] = time.perf_counter() - \
+                        table_started
+        os.replace(f"{path}.tmp", path)
+    except SQLAlchemyError as SQLError:
+        print("[DB] Backup Failed.")
+        print(SQLError)
+        return SQLError
+    report.seconds = time.perf_counter() - started
+    report.archive_bytes = os.path.getsize(path)
+    return report
+
+
+def read_backup(path: str) -> Iterator[tuple]:
+    '''Yields (table name, columns, row iterator) per section of a backup archive.'''
+    with gzip.open(path, "rt", encoding="utf-8") as archive:
+        header = json.loads(archive.readline())
+        if header.get("format") != BACKUP_FORMAT:
+            raise ValueError(f"{path} is not an AutoPi-Hub backup.")
+        if header.get("version", 0) > BACKUP_FORMAT_VERSION:
+            raise ValueError(
+                f"{path} is backup version {header.get('version')}, this version reads up to {BACKUP_FORMAT_VERSION}.")
+        while True:
+            line = archive.readline()
+            if line == "":
+                return
+            section = json.loads(line)
+            rows = (json.loads(archive.readline())
+                    for _ in range(section["rows"]))
+            yield section["table"], section["columns"], rows
+            # Skip whatever the restore didn't read of this section.
+            for _ in rows:
+                pass
+
+
+class RowStream():
+    '''File-like object over rows in PostgreSQL COPY text format, read lazily by copy_expert.'''
+
+    lines: Iterator[str]
+    buffer: str = ""
+
+    def __init__(self, rows: Iterable[list]):
+        self.lines = ("\t".join(self.escape(value) for value in row) + "\n"
+                      for row in rows)
+
+    @staticmethod
+    def escape(value: Any) -> str:
+        if value is None:
+            return "\\N"
+        return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def restore_rows(connection: Connection, table: Table, columns: List[str], rows: Iterable[list]):
+    '''Inserts archived rows with COPY on PostgreSQL (psycopg2) and batched executemany inserts elsewhere.'''
+    known_columns = [column for column in columns if column in table.columns]
+    if len(known_columns) != len(columns):
+        print(
+            f"[Restore] {table.name}: skipping unknown column(s) {sorted(set(columns) - set(known_columns))}.")
+    positions = [columns.index(column) for column in known_columns]
+
+    dbapi_connection = connection.connection.dbapi_connection
+    if connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2":
+        # COPY parses the archive's text values itself.
+        column_list = ", ".join(f'"{column}"' for column in known_columns)
+        with dbapi_connection.cursor() as cursor:  # type: ignore
+            cursor.copy_expert(f'COPY "{table.name}" ({column_list}) FROM STDIN',
+                               RowStream([row[position] for position in positions] for row in rows))
+        return
+
+    decoders = [get_decoder(table.columns[column].type)
+                for column in known_columns]
+    batch: List[Dict[str, Any]] = []
+    for row in rows:
+        batch.append({column: decoder(row[position]) if decoder is not None else row[position]
+                     for column, position, decoder in zip(known_columns, positions, decoders)})
+        if len(batch) >= INSERT_BATCH_SIZE:
+            connection.execute(table.insert(), batch)
+            batch = []
+    if len(batch) > 0:
+        connection.execute(table.insert(), batch)
+
+
+def count_rows(rows: Iterable[list], counter: List[int]) -> Iterator[list]:
+    for row in rows:
+        counter[0] += 1
+        yield row
+
+
+def restore_sections(sections: Iterable[tuple], archive_bytes: int = 0) -> BackupReport | SQLAlchemyError:
+    '''Replaces the contents of every backed up table in a single transaction.'''
+    report = BackupReport()
+    report.archive_bytes = archive_bytes
+    started = time.perf_counter()
+    tables = {table.name: table for table in BACKUP_TABLES}
+    try:
+        with engine.begin() as connection:
+            disable_statement_timeout(connection)
+            for table in reversed(BACKUP_TABLES):
+                connection.execute(table.delete())
+            for table_name, columns, rows in sections:
+                table = tables.get(table_name)
+                if table is None:
+                    print(f"[Restore] Unknown table {table_name}. (Skipped)")
+                    continue
+                table_started = time.perf_counter()
+                counter = [0]
+                restore_rows(connection, table, columns,
+                             count_rows(rows, counter))
+                report.table_rows[table_name] = counter[0]
+                report.table_seconds[table_name] = time.perf_counter() - \
+                    table_started
+    except SQLAlchemyError as SQLError:
+        print("[DB] Restore Failed.")
+        print(SQLError)
+        return SQLError
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def restore_house_data(path: str = DEFAULT_BACKUP_PATH) -> BackupReport | SQLAlchemyError:
+    return restore_sections(read_backup(path), os.path.getsize(path))
+
+
+def read_legacy_backup(data_dir: str) -> Iterator[tuple]:
+    '''Sections from house_data.json, house_members.json and logs.json written by earlier versions of save_house_data.py.'''
+    with open(os.path.join(data_dir, "house_data.json"), "r", encoding="utf-8") as f:
+        house = json.load(f)
+    yield "House", ["houseId", "houseName", "passwordHash", "createdAt", "updatedAt"], iter([
+        [house["house_id"], house["house_name"], house["house_password_hash"], house["created_at"], house["updated_at"]]])
+
+    with open(os.path.join(data_dir, "house_members.json"), "r", encoding="utf-8") as f:
+        members = json.load(f)
+    yield "HouseMembers", ["userId", "houseId"], ([member["user_id"], member["house_id"]] for member in members)
+
+    yield "Rooms", ["roomId", "roomName", "houseId", "createdAt", "updatedAt"], (
+        [room["room_id"], room["room_name"], room["house_id"], room["created_at"], room["updated_at"]] for room in house["rooms"])
+
+    device_keys = ["device_id", "device_name", "pin_number", "status", "is_default", "room_id", "is_scheduled",
+                   "days_scheduled", "start_time", "off_time", "scheduled_by", "wattage", "created_at", "updated_at"]
+    yield "Devices", ["deviceId", "deviceName", "pinNumber", "status", "isDefault", "roomId", "isScheduled",
+                      "daysScheduled", "startTime", "offTime", "scheduledBy", "wattage", "createdAt", "updatedAt"], (
+        [device[key] for key in device_keys] for room in house["rooms"] for device in room["devices"])
+
+    logs_path = os.path.join(data_dir, "logs.json")
+    if os.path.exists(logs_path):
+        with open(logs_path, "r", encoding="utf-8") as f:
+            logs = json.load(f)
+        log_keys = ["device_control_log_id", "status_changed_from", "status_changed_to", "device_id",
+                    "device_wattage", "user_id", "created_at", "updated_at"]
+        yield "DeviceControlLogs", ["deviceControlLogId", "statusChangedFrom", "statusChangedTo", "deviceId",
+                                    "deviceWattage", "userId", "createdAt", "updatedAt"], (
+            [log[key] for key in log_keys] for log in logs)
+
+
+def restore_legacy_house_data(data_dir: str = "data") -> BackupReport | SQLAlchemyError:
+    return restore_sections(read_legacy_backup(data_dir))
@@ -1,12 +1,13 @@
 from typing import List
 
-from sqlalchemy import Column, Integer, Boolean, Float, Text, ForeignKey, DateTime, func, VARCHAR
+from sqlalchemy import Column, Integer, Boolean, Float, Text, ForeignKey, Index, func, VARCHAR
 from sqlalchemy.orm import relationship, Mapped
-from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from .database import Base
+from .types import DateTime, UUID
 
 from helpers.data_models import House, Room as RoomData, Device as DeviceData, HouseMember as HouseMemberData, DeviceControlLog as DeviceControlLogData
+from helpers.timestamps import utc_now
 
 
 class Houses(Base):
@@ -15,10 +16,10 @@ class Houses(Base):
     houseId = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     houseName = Column(Text, nullable=False)
     passwordHash = Column(Text, nullable=False)
-    createdAt = Column(DateTime(timezone=True),
+    createdAt = Column(DateTime(timezone=True), default=utc_now,
                        server_default=func.now(), nullable=False)
-    updatedAt = Column(DateTime(timezone=True), server_default=func.now(
-    ), onupdate=func.now(), nullable=False)
+    updatedAt = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(
+    ), onupdate=utc_now, nullable=False)
 
     # Relationships
     rooms: Mapped[List["Room"]] = relationship('Room', back_populates='house',
@@ -29,8 +30,8 @@ class Houses(Base):
         house.house_id = str(self.houseId)
         house.house_name = str(self.houseName)
         house.house_password_hash = str(self.passwordHash)
-        house.created_at = str(self.createdAt)
-        house.updated_at = str(self.updatedAt)
+        house.created_at = self.createdAt
+        house.updated_at = self.updatedAt
         house.rooms = [room.get_data() for room in self.rooms]
         return house
 
@@ -56,10 +57,10 @@ class Room(Base):
     roomName = Column(Text, nullable=True)
     houseId = Column(UUID(as_uuid=True), ForeignKey(
         'House.houseId', ondelete='CASCADE'), nullable=False)
-    createdAt = Column(DateTime(timezone=True),
+    createdAt = Column(DateTime(timezone=True), default=utc_now,
                        server_default=func.now(), nullable=False)
-    updatedAt = Column(DateTime(timezone=True), server_default=func.now(
-    ), onupdate=func.now(), nullable=False)
+    updatedAt = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(
+    ), onupdate=utc_now, nullable=False)
 
     # Relationships
     house: Mapped["Houses"] = relationship(
@@ -72,8 +73,8 @@ class Room(Base):
         room.room_id = str(self.roomId)
         room.room_name = str(self.roomName)
         room.house_id = str(self.houseId)
-        room.created_at = str(self.createdAt)
-        room.updated_at = str(self.updatedAt)
+        room.created_at = self.createdAt
+        room.updated_at = self.updatedAt
         room.devices = [device.get_data() for device in self.devices]
         return room
 
@@ -90,14 +91,15 @@ class Device(Base):
         'Rooms.roomId', ondelete='CASCADE'), nullable=False)
     isScheduled = Column(Boolean, default=False, nullable=False)
     daysScheduled = Column(VARCHAR(30), nullable=True)
-    startTime = Column(VARCHAR(10), nullable=True)
-    offTime = Column(VARCHAR(10), nullable=True)
+    # Comma separated times or sunrise/sunset offsets, see services/scheduled_device.py
+    startTime = Column(VARCHAR(64), nullable=True)
+    offTime = Column(VARCHAR(64), nullable=True)
     scheduledBy = Column(Text, nullable=True)
     wattage = Column(Float, nullable=True)
-    createdAt = Column(DateTime(timezone=True),
+    createdAt = Column(DateTime(timezone=True), default=utc_now,
                        server_default=func.now(), nullable=False)
-    updatedAt = Column(DateTime(timezone=True), server_default=func.now(
-    ), onupdate=func.now(), nullable=False)
+    updatedAt = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(
+    ), onupdate=utc_now, nullable=False)
 
     def get_data(self):
         device = DeviceData()
@@ -118,13 +120,22 @@ class Device(Base):
             self.scheduledBy) if self.scheduledBy is not None else None
         device.wattage = float(
             str(self.wattage)) if self.wattage is not None else None
-        device.created_at = str(self.createdAt)
-        device.updated_at = str(self.updatedAt)
+        device.created_at = self.createdAt
+        device.updated_at = self.updatedAt
         return device
 
 
 class DeviceControlLog(Base):
     __tablename__ = "DeviceControlLogs"
+    # Created by alembic/versions/0002_device_control_log_indexes.py
+    __table_args__ = (
+        Index("ix_DeviceControlLogs_deviceId_createdAt", "deviceId", "createdAt"),
+        Index("ix_DeviceControlLogs_createdAt_brin",
+              "createdAt", postgresql_using="brin").ddl_if(dialect="postgresql"),
+        # Created by alembic/versions/0003_device_control_log_keyset_index.py
+        Index("ix_DeviceControlLogs_createdAt_deviceControlLogId",
+              "createdAt", "deviceControlLogId"),
+    )
 
     deviceControlLogId = Column(
         UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -133,19 +144,30 @@ class DeviceControlLog(Base):
     deviceId = Column(UUID(as_uuid=True), nullable=False)
     deviceWattage = Column(Float, nullable=True)
     userId = Column(Text, nullable=False)
-    createdAt = Column(DateTime(timezone=True),
+    createdAt = Column(DateTime(timezone=True), default=utc_now,
                        server_default=func.now(), nullable=False)
-    updatedAt = Column(DateTime(timezone=True), server_default=func.now(
-    ), onupdate=func.now(), nullable=False)
+    updatedAt = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(
+    ), onupdate=utc_now, nullable=False)
 
     def get_data(self):
-        device_control_log = DeviceControlLogData()
-        device_control_log.device_control_log_id = str(self.deviceControlLogId)
-        device_control_log.device_id = str(self.deviceId)
-        device_control_log.device_wattage = float(str(self.deviceWattage))
-        device_control_log.user_id = str(self.userId)
-        device_control_log.status_changed_from = bool(self.statusChangedFrom)
-        device_control_log.status_changed_to = bool(self.statusChangedTo)
-        device_control_log.created_at = self.createdAt.isoformat()
-        device_control_log.updated_at = self.updatedAt.isoformat()
-        return device_control_log
+        return DeviceControlLogData(device_control_log_id=str(self.deviceControlLogId),
+                                    device_id=str(self.deviceId),
+                                    user_id=str(self.userId),
+                                    status_changed_from=bool(
+                                        self.statusChangedFrom),
+                                    status_changed_to=bool(
+                                        self.statusChangedTo),
+                                    device_wattage=float(
+                                        str(self.deviceWattage)) if self.deviceWattage is not None else None,
+                                    created_at=self.createdAt,
+                                    updated_at=self.updatedAt)
+
+
+class DeviceEnergyRollup(Base):
+    '''Per device on-time and energy for one hour, maintained from device switches (services/energy_rollup.py).'''
+    __tablename__ = "DeviceEnergyRollups"
+
+    deviceId = Column(UUID(as_uuid=True), primary_key=True)
+    bucketStart = Column(DateTime(timezone=True), primary_key=True)
+    onSeconds = Column(Float, default=0, nullable=False)
+    wattHours = Column(Float, default=0, nullable=False)
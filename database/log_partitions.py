@@ -0,0 +1,218 @@
+import gzip
+import json
+import os
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+from sqlalchemy import Connection, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.database import disable_statement_timeout, engine
+from helpers.config import LOG_ARCHIVE_DIR
+
+
+LOG_TABLE = "DeviceControlLogs"
+DEFAULT_PARTITION = f"{LOG_TABLE}_default"
+UNPARTITIONED_TABLE = f"{LOG_TABLE}_unpartitioned"
+LOG_INDEXES = ["ix_DeviceControlLogs_deviceId_createdAt",
+               "ix_DeviceControlLogs_createdAt_brin",
+               "ix_DeviceControlLogs_createdAt_deviceControlLogId"]
+
+# Months created ahead of time so new logs never land in the default partition.
+PARTITION_MONTHS_AHEAD = 2
+
+
+def get_month_start(moment: datetime) -> datetime:
+    '''Partitions are monthly in UTC.'''
+    moment = moment.astimezone(
+        timezone.utc) if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month_start: datetime, months: int) -> datetime:
+    index = month_start.year * 12 + month_start.month - 1 + months
+    return month_start.replace(year=index // 12, month=index % 12 + 1)
+
+
+def get_partition_name(month_start: datetime) -> str:
+    return f"{LOG_TABLE}_{month_start:%Y_%m}"
+
+
+def is_partitioned(connection: Connection) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    return bool(connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :table)"),
+        {"table": LOG_TABLE}).scalar())
+
+
+def get_partition_months(connection: Connection) -> List[Tuple[str, datetime]]:
+    '''Returns (partition name, month start) of the monthly partitions, oldest first.'''
+    names = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table"),
+        {"table": LOG_TABLE}).scalars().all()
+    months: List[Tuple[str, datetime]] = []
+    for name in names:
+        if name == DEFAULT_PARTITION:
+            continue
+        month = datetime.strptime(name[len(LOG_TABLE) + 1:], "%Y_%m")
+        months.append((name, month.replace(tzinfo=timezone.utc)))
+    return sorted(months, key=lambda partition: partition[1])
+
+
+def get_range_sql(month_start: datetime) -> str:
+    return f"FROM ('{month_start.isoformat()}') TO ('{add_months(month_start, 1).isoformat()}')"
+
+
+def create_month_partition(connection: Connection, month_start: datetime):
+    '''Adds the month's partition, moving any of its rows out of the default partition first.'''
+    name = get_partition_name(month_start)
+    month_range = {"start": month_start, "end": add_months(month_start, 1)}
+    connection.execute(
+        text(f'CREATE TABLE "{name}" (LIKE "{LOG_TABLE}" INCLUDING DEFAULTS)'))
+    connection.execute(text(
+        f'INSERT INTO "{name}" SELECT * FROM "{DEFAULT_PARTITION}" WHERE "createdAt" >= :start AND "createdAt" < :end'), month_range)
+    connection.execute(text(
+        f'DELETE FROM "{DEFAULT_PARTITION}" WHERE "createdAt" >= :start AND "createdAt" < :end'), month_range)
+    connection.execute(text(
+        f'ALTER TABLE "{LOG_TABLE}" ATTACH PARTITION "{name}" FOR VALUES {get_range_sql(month_start)}'))
+
+
+def enable_log_partitioning() -> int | SQLAlchemyError:
+    '''
+    Converts DeviceControlLogs into a table range partitioned by month on createdAt and
+    returns the number of logs moved. Run it with the server stopped.
+    '''
+    try:
+        with engine.begin() as connection:
+            if connection.dialect.name != "postgresql":
+                print("[Log Partitions] Partitioning needs PostgreSQL. (Skipped)")
+                return 0
+            if is_partitioned(connection):
+                print("[Log Partitions] Already partitioned. (Skipped)")
+                return 0
+            disable_statement_timeout(connection)
+
+            connection.execute(
+                text(f'ALTER TABLE "{LOG_TABLE}" RENAME TO "{UNPARTITIONED_TABLE}"'))
+            connection.execute(text(
+                f'ALTER TABLE "{UNPARTITIONED_TABLE}" RENAME CONSTRAINT "{LOG_TABLE}_pkey" TO "{UNPARTITIONED_TABLE}_pkey"'))
+            for index in LOG_INDEXES:
+                connection.execute(
+                    text(f'ALTER INDEX IF EXISTS "{index}" RENAME TO "{index}_unpartitioned"'))
+
+            # The partition key has to be part of the primary key.
+            connection.execute(text(
+                f'CREATE TABLE "{LOG_TABLE}" (LIKE "{UNPARTITIONED_TABLE}" INCLUDING DEFAULTS, '
+                f'PRIMARY KEY ("deviceControlLogId", "createdAt")) PARTITION BY RANGE ("createdAt")'))
+            connection.execute(text(
+                f'CREATE INDEX "{LOG_INDEXES[0]}" ON "{LOG_TABLE}" ("deviceId", "createdAt")'))
+            connection.execute(text(
+                f'CREATE INDEX "{LOG_INDEXES[1]}" ON "{LOG_TABLE}" USING brin ("createdAt")'))
+            connection.execute(text(
+                f'CREATE INDEX "{LOG_INDEXES[2]}" ON "{LOG_TABLE}" ("createdAt", "deviceControlLogId")'))
+            connection.execute(
+                text(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{LOG_TABLE}" DEFAULT'))
+
+            first_log_at = connection.execute(
+                text(f'SELECT MIN("createdAt") FROM "{UNPARTITIONED_TABLE}"')).scalar()
+            current_month = get_month_start(datetime.now(timezone.utc))
+            month = get_month_start(
+                first_log_at) if first_log_at is not None else current_month
+            while month <= add_months(current_month, PARTITION_MONTHS_AHEAD):
+                connection.execute(text(
+                    f'CREATE TABLE "{get_partition_name(month)}" PARTITION OF "{LOG_TABLE}" FOR VALUES {get_range_sql(month)}'))
+                month = add_months(month, 1)
+
+            moved_logs = connection.execute(
+                text(f'INSERT INTO "{LOG_TABLE}" SELECT * FROM "{UNPARTITIONED_TABLE}"')).rowcount
+            connection.execute(text(f'DROP TABLE "{UNPARTITIONED_TABLE}"'))
+            return moved_logs
+    except SQLAlchemyError as SQLError:
+        print("[Log Partitions] Enable Partitioning Failed.")
+        print(SQLError)
+        return SQLError
+
+
+def ensure_log_partitions(months_ahead: int = PARTITION_MONTHS_AHEAD) -> int | SQLAlchemyError:
+    '''Creates the monthly partitions from the current month to `months_ahead` months out, returns how many were added.'''
+    try:
+        with engine.begin() as connection:
+            if not is_partitioned(connection):
+                return 0
+            existing_months = {month for _, month in get_partition_months(connection)}
+            current_month = get_month_start(datetime.now(timezone.utc))
+            created = 0
+            for offset in range(months_ahead + 1):
+                month = add_months(current_month, offset)
+                if month not in existing_months:
+                    create_month_partition(connection, month)
+                    created += 1
+            return created
+    except SQLAlchemyError as SQLError:
+        print("[Log Partitions] Create Partitions Failed.")
+        print(SQLError)
+        return SQLError
+
+
+def export_logs(connection: Connection, query: str, params: dict, path: str) -> int:
+    '''Streams the query's rows to a gzip NDJSON file, written under a temporary name until complete. No rows, no file.'''
+    result = connection.execution_options(
+        stream_results=True, yield_per=5000).execute(text(query), params)
+    count = 0
+    with gzip.open(f"{path}.tmp", "wt", encoding="utf-8") as archive:
+        for row in result.mappings():
+            archive.write(json.dumps(
+                dict(row), default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value)))
+            archive.write("\n")
+            count += 1
+    if count == 0:
+        os.remove(f"{path}.tmp")
+    else:
+        os.replace(f"{path}.tmp", path)
+    return count
+
+
+def archive_old_logs(retention_months: int, archive_dir: str = LOG_ARCHIVE_DIR) -> int | SQLAlchemyError:
+    '''
+    Moves logs from before the last `retention_months` whole months into gzip NDJSON files
+    in `archive_dir` and returns how many were archived. Whole partitions are detached and
+    dropped, an unpartitioned table is trimmed with a DELETE.
+    '''
+    os.makedirs(archive_dir, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    cutoff = add_months(get_month_start(now), -retention_months)
+    archived = 0
+    try:
+        with engine.begin() as connection:
+            partitioned = is_partitioned(connection)
+            old_partitions = [name for name, month in get_partition_months(connection)
+                              if add_months(month, 1) <= cutoff] if partitioned else []
+
+        # One transaction per partition, a failure keeps the partitions archived before it.
+        for name in old_partitions:
+            with engine.begin() as connection:
+                disable_statement_timeout(connection)
+                archived += export_logs(connection, f'SELECT * FROM "{name}" ORDER BY "createdAt"', {},
+                                        os.path.join(archive_dir, f"{name}.ndjson.gz"))
+                connection.execute(
+                    text(f'ALTER TABLE "{LOG_TABLE}" DETACH PARTITION "{name}"'))
+                connection.execute(text(f'DROP TABLE "{name}"'))
+
+        # Old rows outside the monthly partitions, or the whole table when it isn't partitioned.
+        table = DEFAULT_PARTITION if partitioned else LOG_TABLE
+        with engine.begin() as connection:
+            disable_statement_timeout(connection)
+            path = os.path.join(
+                archive_dir, f"{LOG_TABLE}_before_{cutoff:%Y_%m}_{now:%Y%m%dT%H%M%S%f}.ndjson.gz")
+            exported = export_logs(connection, f'SELECT * FROM "{table}" WHERE "createdAt" < :cutoff ORDER BY "createdAt"',
+                                   {"cutoff": cutoff}, path)
+            if exported > 0:
+                connection.execute(
+                    text(f'DELETE FROM "{table}" WHERE "createdAt" < :cutoff'), {"cutoff": cutoff})
+                archived += exported
+        return archived
+    except SQLAlchemyError as SQLError:
+        print("[Log Partitions] Archive Logs Failed.")
+        print(SQLError)
+        return SQLError
@@ -0,0 +1,46 @@
+import uuid
+from datetime import datetime, timezone
+
+from sqlalchemy import DateTime as SQLDateTime, Uuid
+from sqlalchemy.types import TypeDecorator
+
+
+class UUID(TypeDecorator):
+    '''
+    Portable UUID column: native UUID on PostgreSQL, CHAR(32) on SQLite.
+    Accepts UUID strings as well as uuid.UUID values, the way database.actions passes IDs.
+    '''
+
+    impl = Uuid
+    cache_ok = True
+
+    def __init__(self, as_uuid: bool = True):
+        super().__init__(as_uuid=as_uuid)
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, str):
+            return uuid.UUID(value)
+        return value
+
+
+class DateTime(TypeDecorator):
+    '''
+    Time zone aware timestamps on every backend. SQLite has no time zone type, so values are
+    stored as UTC there and read back as UTC, matching its CURRENT_TIMESTAMP server defaults.
+    '''
+
+    impl = SQLDateTime
+    cache_ok = True
+
+    def __init__(self, timezone: bool = True):
+        super().__init__(timezone=timezone)
+
+    def process_bind_param(self, value, dialect):
+        if dialect.name == "sqlite" and isinstance(value, datetime) and value.tzinfo is not None:
+            return value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if dialect.name == "sqlite" and isinstance(value, datetime) and value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value
@@ -1,24 +1,45 @@
-from typing import List
+import math
+import uuid
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List
 
-from gpiozero import OutputDevice
+from controller.gpio import OutputChannel
+from helpers.timestamps import EPOCH, format_timestamp, from_epoch_us, to_epoch_us
 
 
+# Dataclasses so orjson encodes them directly (helpers/responses.py). orjson leaves out fields
+# starting with an underscore, which keeps the relay handle and the password hash out of responses.
+# eq=False keeps identity comparison, the controller looks devices and rooms up by identity.
+# slots=True drops the per-instance __dict__, attributes outside the declared fields can't be set.
+# Timestamps stay datetimes, orjson writes them as ISO 8601 strings, to_dict() formats them for the other encoders.
+
+@dataclass(eq=False, slots=True)
 class Device():
-    device_id: str
-    device_name: str
-    pin_number: int
-    status: bool
-    is_default: bool
-    room_id: str
+    device_id: str = ""
+    device_name: str = ""
+    pin_number: int = 0
+    status: bool = False
+    is_default: bool = False
+    room_id: str = ""
     is_scheduled: bool = False
     days_scheduled: str | None = None
     start_time: str | None = None
     off_time: str | None = None
     scheduled_by: str | None = None
     wattage: float | None = None
-    created_at: str
-    updated_at: str
-    output_device: OutputDevice | None = None
+    created_at: datetime = EPOCH
+    updated_at: datetime = EPOCH
+    _output_device: OutputChannel | None = None
+
+    @property
+    def output_device(self) -> OutputChannel | None:
+        return self._output_device
+
+    @output_device.setter
+    def output_device(self, output_device: OutputChannel | None):
+        self._output_device = output_device
 
     def to_dict(self):
         return {
@@ -34,45 +55,55 @@ class Device():
             "off_time": self.off_time,
             "scheduled_by": self.scheduled_by,
             "wattage": self.wattage,
-            "created_at": self.created_at,
-            "updated_at": self.updated_at,
+            "created_at": format_timestamp(self.created_at),
+            "updated_at": format_timestamp(self.updated_at),
             # "output_device": self.output_device.__dict__ if self.output_device else None
         }
 
 
+@dataclass(eq=False, slots=True)
 class Room():
-    room_id: str
-    room_name: str
-    house_id: str
-    created_at: str
-    updated_at: str
-    devices: List[Device]
+    room_id: str = ""
+    room_name: str = ""
+    house_id: str = ""
+    created_at: datetime = EPOCH
+    updated_at: datetime = EPOCH
+    devices: List[Device] = field(default_factory=list)
 
     def to_dict(self):
         return {
             "room_id": self.room_id,
             "room_name": self.room_name,
             "house_id": self.house_id,
-            "created_at": self.created_at,
-            "updated_at": self.updated_at,
+            "created_at": format_timestamp(self.created_at),
+            "updated_at": format_timestamp(self.updated_at),
             "devices": [device.to_dict() for device in self.devices]
         }
 
 
+@dataclass(eq=False, slots=True)
 class House():
-    house_id: str
-    house_name: str
-    house_password_hash: str
-    created_at: str
-    updated_at: str
-    rooms: List[Room]
+    house_id: str = ""
+    house_name: str = ""
+    created_at: datetime = EPOCH
+    updated_at: datetime = EPOCH
+    rooms: List[Room] = field(default_factory=list)
+    _house_password_hash: str = field(default="", repr=False)
+
+    @property
+    def house_password_hash(self) -> str:
+        return self._house_password_hash
+
+    @house_password_hash.setter
+    def house_password_hash(self, house_password_hash: str):
+        self._house_password_hash = house_password_hash
 
     def to_dict(self):
         return {
             "house_id": self.house_id,
             "house_name": self.house_name,
-            "created_at": self.created_at,
-            "updated_at": self.updated_at,
+            "created_at": format_timestamp(self.created_at),
+            "updated_at": format_timestamp(self.updated_at),
             "rooms": [room.to_dict() for room in self.rooms]
         }
 
@@ -81,15 +112,16 @@ class House():
             "house_id": self.house_id,
             "house_name": self.house_name,
             "house_password_hash": self.house_password_hash,
-            "created_at": self.created_at,
-            "updated_at": self.updated_at,
+            "created_at": format_timestamp(self.created_at),
+            "updated_at": format_timestamp(self.updated_at),
             "rooms": [room.to_dict() for room in self.rooms]
         }
 
 
+@dataclass(eq=False, slots=True)
 class HouseMember():
-    house_id: str
-    user_id: str
+    house_id: str = ""
+    user_id: str = ""
 
     def to_dict(self):
         return {
@@ -98,15 +130,16 @@ class HouseMember():
         }
 
 
+@dataclass(eq=False, slots=True)
 class DeviceControlLog():
-    device_control_log_id: str
-    device_id: str
-    user_id: str
-    status_changed_from: bool
-    status_changed_to: bool
-    device_wattage: float
-    created_at: str
-    updated_at: str
+    device_control_log_id: str = ""
+    device_id: str = ""
+    user_id: str = ""
+    status_changed_from: bool = False
+    status_changed_to: bool = False
+    device_wattage: float | None = None
+    created_at: datetime = EPOCH
+    updated_at: datetime = EPOCH
 
     def to_dict(self):
         return {
@@ -116,6 +149,107 @@ class DeviceControlLog():
             "status_changed_from": self.status_changed_from,
             "status_changed_to": self.status_changed_to,
             "device_wattage": self.device_wattage,
-            "created_at": self.created_at,
-            "updated_at": self.updated_at
+            "created_at": format_timestamp(self.created_at),
+            "updated_at": format_timestamp(self.updated_at)
         }
+
+
+class LogBatch():
+    '''
+    Device control logs stored by column, what the bulk log queries return. A month of logs
+    is hundreds of thousands of rows, as DeviceControlLog objects each one costs a few hundred
+    bytes of objects and strings, here it is ~60 bytes in typed arrays.
+
+    Device and user IDs are interned: `device_codes[i]` indexes `device_ids`. Timestamps are
+    epoch microseconds, a missing wattage is NaN. The arrays support the buffer protocol, so
+    numpy.frombuffer(batch.created_at, dtype=batch.created_at.typecode) reads them without copying.
+    Indexing or iterating builds DeviceControlLog objects one at a time.
+    '''
+
+    __slots__ = ("log_ids", "device_ids", "device_codes", "user_ids", "user_codes", "status_changed_from",
+                 "status_changed_to", "device_wattages", "created_at", "updated_at", "device_codes_by_id", "user_codes_by_id")
+
+    # 16 bytes per log.
+    log_ids: bytearray
+    device_ids: List[str]
+    device_codes: array
+    user_ids: List[str]
+    user_codes: array
+    status_changed_from: array
+    status_changed_to: array
+    device_wattages: array
+    created_at: array
+    updated_at: array
+    device_codes_by_id: Dict[Any, int]
+    user_codes_by_id: Dict[Any, int]
+
+    def __init__(self):
+        self.log_ids = bytearray()
+        self.device_ids = []
+        self.device_codes = array("I")
+        self.user_ids = []
+        self.user_codes = array("I")
+        self.status_changed_from = array("b")
+        self.status_changed_to = array("b")
+        self.device_wattages = array("d")
+        self.created_at = array("q")
+        self.updated_at = array("q")
+        self.device_codes_by_id = {}
+        self.user_codes_by_id = {}
+
+    def extend(self, rows: Iterable[tuple]):
+        '''
+        Appends (deviceControlLogId, deviceId, userId, statusChangedFrom, statusChangedTo,
+        deviceWattage, createdAt, updatedAt) rows as the database returns them.
+        '''
+        columns = list(zip(*rows))
+        if len(columns) == 0:
+            return
+        log_ids, device_ids, user_ids, status_changed_from, status_changed_to, device_wattages, created_at, updated_at = columns
+        self.log_ids += b"".join([log_id.bytes for log_id in log_ids])
+        self.device_codes.extend(intern_ids(
+            device_ids, self.device_codes_by_id, self.device_ids))
+        self.user_codes.extend(intern_ids(
+            user_ids, self.user_codes_by_id, self.user_ids))
+        self.status_changed_from.extend(status_changed_from)
+        self.status_changed_to.extend(status_changed_to)
+        self.device_wattages.extend([wattage if wattage is not None else math.nan
+                                     for wattage in device_wattages])
+        self.created_at.extend([to_epoch_us(moment) for moment in created_at])
+        self.updated_at.extend([to_epoch_us(moment) for moment in updated_at])
+
+    def __len__(self):
+        return len(self.created_at)
+
+    def __getitem__(self, index: int) -> DeviceControlLog:
+        if index < 0:
+            index += len(self)
+        wattage = self.device_wattages[index]
+        return DeviceControlLog(device_control_log_id=str(uuid.UUID(bytes=bytes(self.log_ids[index * 16:index * 16 + 16]))),
+                                device_id=self.device_ids[self.device_codes[index]],
+                                user_id=self.user_ids[self.user_codes[index]],
+                                status_changed_from=bool(
+                                    self.status_changed_from[index]),
+                                status_changed_to=bool(
+                                    self.status_changed_to[index]),
+                                device_wattage=wattage if not math.isnan(
+                                    wattage) else None,
+                                created_at=from_epoch_us(
+                                    self.created_at[index]),
+                                updated_at=from_epoch_us(self.updated_at[index]))
+
+    def __iter__(self) -> Iterator[DeviceControlLog]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+def intern_ids(ids: Iterable[Any], codes_by_id: Dict[Any, int], interned: List[str]) -> List[int]:
+    '''Codes for `ids`, IDs not seen before are added to `interned` as strings.'''
+    codes = []
+    for id in ids:
+        code = codes_by_id.get(id)
+        if code is None:
+            code = codes_by_id[id] = len(interned)
+            interned.append(str(id))
+        codes.append(code)
+    return codes
@@ -1,3 +1,5 @@
+from typing import List
+
 from pydantic import BaseModel
 
 
@@ -36,6 +38,32 @@ class SwitchDeviceRequest(BaseModel):
     statusTo: bool
 
 
+class DeviceSwitch(BaseModel):
+    deviceId: str
+    state: bool
+
+
+class Scenes():
+    '''Built-in scenes for /switch-devices, the room scenes need a roomId.'''
+    ALL_OFF = "all_off"
+    ALL_ON = "all_on"
+    ROOM_OFF = "room_off"
+    ROOM_ON = "room_on"
+
+    ALL = [ALL_OFF, ALL_ON, ROOM_OFF, ROOM_ON]
+    ROOM = [ROOM_OFF, ROOM_ON]
+
+
+class SwitchDevicesRequest(BaseModel):
+    '''Either `switches` or a `scene` (with `roomId` for the room scenes).'''
+    houseId: str
+    userId: str
+    userName: str
+    switches: List[DeviceSwitch] | None = None
+    scene: str | None = None
+    roomId: str | None = None
+
+
 class ConfigureDeviceRequest(BaseModel):
     houseId: str
     userId: str
@@ -70,6 +98,8 @@ class ResponseStatusCodes():
     INVALID_REQUEST = "INVALID_REQUEST"
     REQUEST_FULLFILLED = "REQUEST_FULLFILLED"
     SWITCH_DEVICE_ERROR = "SWITCH_DEVICE_ERROR"
+    SERVER_STARTING = "SERVER_STARTING"
+    INVALID_SESSION = "INVALID_SESSION"
 
 
 def is_valid_request(request_body: list):
@@ -0,0 +1,35 @@
+from typing import Any, Dict, Mapping
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+
+# Marks an envelope without a "data" key, as opposed to "data": null.
+NO_DATA: Any = object()
+
+
+def build_envelope(status: str, status_code: str, message: str, data: Any = NO_DATA) -> Dict[str, Any]:
+    '''The {"status", "status_code", "message", "data"} wrapper every endpoint answers with.'''
+    envelope = {
+        "status": status,
+        "status_code": status_code,
+        "message": message
+    }
+    if data is not NO_DATA:
+        envelope["data"] = data
+    return envelope
+
+
+def api_response(status: str, status_code: str, message: str, http_status: int, data: Any = NO_DATA,
+                 headers: Mapping[str, str] | None = None) -> ORJSONResponse:
+    '''
+    Envelope encoded with orjson. `data` can hold helpers.data_models objects as they are,
+    they are dataclasses and orjson encodes them without building dicts first.
+    '''
+    return ORJSONResponse(content=build_envelope(status, status_code, message, data),
+                          status_code=http_status, headers=headers)
+
+
+def encode_envelope(status: str, status_code: str, message: str) -> bytes:
+    '''Encoded envelope for the ASGI middlewares that answer before reaching FastAPI.'''
+    return orjson.dumps(build_envelope(status, status_code, message))
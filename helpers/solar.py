@@ -0,0 +1,34 @@
+import math
+from datetime import date, datetime, timezone
+
+
+def _julian_to_datetime(julian_date: float) -> datetime:
+    return datetime.fromtimestamp((julian_date - 2440587.5) * 86400, tz=timezone.utc)
+
+
+def get_sun_times(day: date, latitude: float, longitude: float) -> tuple[datetime, datetime] | None:
+    '''
+    Returns sunrise and sunset (UTC) for `day` using the sunrise equation,
+    accurate to about a minute. None during polar day or night.
+    '''
+    # Days since J2000.0 for solar noon of `day`.
+    n = day.toordinal() + 1721425.0 - 2451545.0 + 0.0008
+    mean_solar_time = n - longitude / 360
+    mean_anomaly = (357.5291 + 0.98560028 * mean_solar_time) % 360
+    m = math.radians(mean_anomaly)
+    center = 1.9148 * math.sin(m) + 0.02 * math.sin(2 * m) + 0.0003 * math.sin(3 * m)
+    ecliptic_longitude = math.radians(
+        (mean_anomaly + center + 180 + 102.9372) % 360)
+    solar_transit = 2451545.0 + mean_solar_time + 0.0053 * \
+        math.sin(m) - 0.0069 * math.sin(2 * ecliptic_longitude)
+
+    declination = math.asin(math.sin(ecliptic_longitude)
+                            * math.sin(math.radians(23.4397)))
+    phi = math.radians(latitude)
+    cos_hour_angle = (math.sin(math.radians(-0.833)) - math.sin(phi) * math.sin(declination)) / \
+        (math.cos(phi) * math.cos(declination))
+    if cos_hour_angle < -1 or cos_hour_angle > 1:
+        return None
+    hour_angle = math.degrees(math.acos(cos_hour_angle))
+
+    return _julian_to_datetime(solar_transit - hour_angle / 360), _julian_to_datetime(solar_transit + hour_angle / 360)
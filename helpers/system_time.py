@@ -1,37 +1,50 @@
-import ntplib
-
 from time import ctime
 import datetime
 
 import subprocess
 
+from helpers.config import NTP_SERVER, NTP_TIMEOUT_SECONDS
+
 
 class SystemTime():
+    '''Sets the system clock from an NTP server, the Pi has no real time clock.'''
+
+    server: str
+    timeout: float
+    is_synced: bool = False
 
-    def __init__(self):
-        self.set_system_time_from_server()
+    def __init__(self, server: str = NTP_SERVER, timeout: float = NTP_TIMEOUT_SECONDS):
+        self.server = server
+        self.timeout = timeout
 
     def fetch_time_from_server(self):
+        # Imported here so it loads on the background sync thread, not at server import.
+        import ntplib
         client = ntplib.NTPClient()
         try:
-            # Replace 'pool.ntp.org' with your preferred NTP server
-            response = client.request('pool.ntp.org', version=3)
+            response = client.request(
+                self.server, version=3, timeout=self.timeout)
             return datetime.datetime.strptime(ctime(response.tx_time), "%a %b %d %H:%M:%S %Y")
         except Exception as e:
             print(f"Failed to fetch time from NTP server: {e}")
             return None
 
-    def set_system_time_from_server(self):
+    def set_system_time_from_server(self) -> bool:
+        '''Returns whether the system time was set.'''
         server_time = self.fetch_time_from_server()
         if server_time:
             new_time = server_time.strftime("%Y-%m-%d %H:%M:%S")
             try:
                 # Run the 'date' command to set the system time
-                subprocess.run(['sudo', 'date', '--set', new_time], check=True)
+                subprocess.run(['sudo', 'date', '--set', new_time],
+                               check=True, timeout=self.timeout)
                 print(f"System time set to {new_time}")
+                self.is_synced = True
+                return True
             except subprocess.CalledProcessError as e:
                 print(f"Failed to set system time: {e}")
             except Exception as e:
                 print(f"An error occurred: {e}")
         else:
             print("Could not set system time because fetching time failed.")
+        return False
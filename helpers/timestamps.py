@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta, timezone
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def utc_now() -> datetime:
+    '''
+    Column default for createdAt/updatedAt. Stamped in Python for microsecond precision, SQLite's
+    CURRENT_TIMESTAMP only has whole seconds and would sort before logs written earlier that second.
+    '''
+    return datetime.now(timezone.utc)
+
+
+def to_epoch_us(moment: datetime) -> int:
+    '''Integer microseconds since the Unix epoch, exact unlike datetime.timestamp(). Naive datetimes are UTC.'''
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - EPOCH) // MICROSECOND
+
+
+def from_epoch_us(epoch_us: int) -> datetime:
+    return EPOCH + timedelta(microseconds=epoch_us)
+
+
+def format_timestamp(moment: datetime | None) -> str | None:
+    '''A timestamp's API form, ISO 8601 like orjson writes datetimes. Only for encoders that can't take datetimes.'''
+    return moment.isoformat() if moment is not None else None
@@ -1,76 +1,28 @@
-import json
-from typing import Any
+import os
 
-from database.actions import add_user,  create_room, init_house_db
-from database.database import get_db
-from database.db_models import Device, DeviceControlLog, HouseMember
 from sqlalchemy.exc import SQLAlchemyError
 
-logs: Any
+from database.backup import DEFAULT_BACKUP_PATH, restore_house_data, restore_legacy_house_data
 
-with open('data/logs.json', 'r', encoding='utf-8') as f:
-    logs = json.load(f)
 
+# Restores the newest backup in ./data, replacing the database's contents in one transaction.
+# Backups made by earlier versions (house_data.json, house_members.json, logs.json) are read too.
 
-with open('data/house_data.json', 'r', encoding='utf-8') as f:
-    house_data = json.load(f)
-    house: Any = init_house_db(house_data["house_password_hash"])
+LEGACY_BACKUP_PATH = "data/house_data.json"
 
-    if isinstance(house, SQLAlchemyError):
-        raise Exception(house._message())
+has_backup = os.path.exists(DEFAULT_BACKUP_PATH)
+has_legacy_backup = os.path.exists(LEGACY_BACKUP_PATH)
 
-    for room in house.rooms:
-        room: Any = create_room(room.room_name, house.house_id)
+if not has_backup and not has_legacy_backup:
+    print("[Load] No backup found in ./data. (Skipped)")
+    raise SystemExit(0)
 
-        if isinstance(room, SQLAlchemyError):
-            raise Exception(room._message())
+if has_backup and (not has_legacy_backup or os.path.getmtime(DEFAULT_BACKUP_PATH) >= os.path.getmtime(LEGACY_BACKUP_PATH)):
+    report = restore_house_data(DEFAULT_BACKUP_PATH)
+else:
+    report = restore_legacy_house_data("data")
 
-        for device in room.devices:
-            # device = create_device(device.device_name, device.pin_number, room.room_id)
-            db = get_db()
-            try:
-                with db.begin() as txn:
-                    new_device = Device(deviceName=device["device_name"], pinNumber=device["pin_number"],
-                                        roomId=room["room_id"], status=device["status"], isScheduled=device["is_scheduled"],
-                                        isDefault=device["is_default"], daysScheduled=device["days_scheduled"], startTime=device[
-                                            "start_time"], offTime=device["off_time"], scheduledBy=device["scheduled_by"], wattage=device["wattage"]
-                                        )
-                    db.add(new_device)
-                    db.flush()
-                    for log in logs:
-                        if log.device_id == device.device_id:
-                            db = get_db()
-                            try:
-                                with db.begin() as txn:
-                                    new_log = DeviceControlLog(statusChangedFrom=log["status_changed_from"],
-                                                               statusChangedTo=log["status_changed_to"],
-                                                               deviceId=new_device.get_data().device_id,
-                                                               deviceWattage=float(
-                                                                   str(new_device.wattage)),
-                                                               userId=log["user_id"])
-                                    db.add(new_log)
-                                    db.flush
-                            except SQLAlchemyError as SQLError:
-                                print("[DB] Device Creation Failed.")
-                                print(SQLError)
-                            finally:
-                                db.close()
-            except SQLAlchemyError as SQLError:
-                print("[DB] Device Creation Failed.")
-                print(SQLError)
-            finally:
-                db.close()
+if isinstance(report, SQLAlchemyError):
+    raise Exception(report._message())
 
-print("[Loaded] House Data")
-print("[Loaded] Device Control Logs")
-
-with open('data/house_members.json', 'r', encoding='utf-8') as f:
-    house_members_data: Any = json.load(f)
-
-    for house_member in house_members_data:
-        user = add_user(house_member["user_id"])
-
-        if isinstance(user, SQLAlchemyError):
-            raise Exception(user._message())
-
-print("[Loaded] House Members Data")
+report.print_summary("Loaded")
@@ -0,0 +1,14 @@
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.log_partitions import enable_log_partitioning
+
+
+# Converts DeviceControlLogs to monthly range partitions (PostgreSQL only).
+# Run it while the server is stopped and set AUTOPI_LOG_PARTITIONING=true so the server keeps creating partitions.
+
+moved_logs = enable_log_partitioning()
+
+if isinstance(moved_logs, SQLAlchemyError):
+    raise Exception(moved_logs._message())
+
+print(f"[Partitioned] {moved_logs} Device Control Log(s) moved into monthly partitions.")
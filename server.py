@@ -1,27 +1,103 @@
-from fastapi import FastAPI, status, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, status, WebSocket, WebSocketDisconnect
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import json
+import asyncio
+import os
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 
 from sqlalchemy.exc import SQLAlchemyError
 
 from controller.controller_device import ControllerDevice
+from controller.gpio import create_gpio_backend
+
+from database.actions import add_user, delete_user, get_device_control_log_page, iter_device_control_logs, create_room, remove_room, create_device, configure_device, remove_device, get_available_gpio_pins
+
+from helpers.responses import api_response, build_envelope, encode_envelope
+from helpers.request_models import is_valid_request, AddRoomRequest, RemoveRoomRequest, AddDeviceRequest, SwitchDeviceRequest, SwitchDevicesRequest, Scenes, ConfigureDeviceRequest, RemoveDeviceRequest, ResponseStatusCodes
+
+from services.access_cache import AccessCache
+from services.device_log_writer import DeviceLogWriter
+from services.energy_rollup import EnergyRollup, summarize_energy_consumption
+from services.executors import run_auth, run_db, run_gpio, shutdown_executors
+from services.log_export import LogExportFormats, MEDIA_TYPES, decode_cursor, encode_cursor, encode_logs
+from services.log_maintenance import LogMaintenance
+from services.metrics import PROMETHEUS_CONTENT_TYPE, MetricsMiddleware, registry as metrics_registry
+from services.sessions import SessionGate, SessionManager
+from services.sys_init import StartupGate, SystemInitializer
+from services.socket import SocketEncodings, SocketEvents, SocketManager, SocketMessage
+from services.schedule import ScheduleDeviceAssistant
+from services.scheduled_device import get_scheduled_device_status, parse_schedule
 
-from database.actions import add_user, get_specific_device_control_logs, get_user, delete_user, get_access, create_room, remove_room, create_device, switch_device, configure_device, remove_device, get_house_data, get_available_gpio_pins
+sys = SystemInitializer()
 
-from helpers.request_models import is_valid_request, AddRoomRequest, RemoveRoomRequest, AddDeviceRequest, SwitchDeviceRequest, ConfigureDeviceRequest, RemoveDeviceRequest, ResponseStatusCodes
 
-from services.energy_consumption import calculate_energy_consumption
-from services.sys_init import SystemInitializer
-from services.socket import SocketEvents, SocketManager
-from services.schedule import ScheduleDeviceAssistant
-from services.scheduled_device import get_scheduled_device_status
+sessions = SessionManager()
+
+
+async def sync_time():
+    if await sys.sync_time():
+        # Re-evaluate schedules against the corrected clock.
+        schedule_assistant.resync()
 
-sys = SystemInitializer()
 
+async def start_controller():
+    # GPIO cleanup runs on the GPIO thread while the house is read from the database.
+    await asyncio.gather(
+        sys.retry_phase("controller_data", lambda: run_db(
+            controller_device.load_data)),
+        sys.retry_phase("gpio_cleanup", lambda: run_gpio(
+            controller_device.release_gpio_resources)))
+    await sys.retry_phase("gpio_devices", lambda: run_gpio(controller_device.initialize_gpio))
 
-app = FastAPI()
+
+async def start_up():
+    '''
+    Staged startup, run after the server is accepting connections. Each phase is retried, e.g.
+    while the database is still starting, and if one keeps failing the process exits so
+    systemd restarts it instead of answering 503 forever.
+    '''
+    try:
+        await sys.retry_phase("house", lambda: run_db(sys.initialize_house))
+        await asyncio.gather(
+            sys.retry_phase("access_cache", lambda: run_db(access_cache.load)),
+            sys.retry_phase("energy_rollup", lambda: run_db(energy_rollup.load)),
+            start_controller())
+        schedule_assistant.load()
+        schedule_assistant.start()
+        sys.mark_ready()
+    except Exception as e:
+        print(f"[Startup] Failed, exiting. {e}")
+        os._exit(1)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    device_log_writer.start()
+    socket_manager.start()
+    log_maintenance.start()
+    # Time sync never delays readiness, the schedules are resynced when it completes.
+    time_sync_task = asyncio.create_task(sync_time())
+    startup_task = asyncio.create_task(start_up())
+    yield
+    for task in (time_sync_task, startup_task):
+        task.cancel()
+    await asyncio.gather(time_sync_task, startup_task, return_exceptions=True)
+    await log_maintenance.stop()
+    await schedule_assistant.stop()
+    await socket_manager.stop()
+    # Write any queued device control logs before the process exits.
+    device_log_writer.stop()
+    shutdown_executors()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse,
+              description="Timestamps are ISO 8601 with a UTC offset, e.g. `2024-08-20T18:30:00.123456+05:30`. "
+              "House, room and device timestamps keep the database's offset, device control logs are in UTC.")
+
+app.add_middleware(SessionGate, session_manager=sessions)
+
+app.add_middleware(StartupGate, system_initializer=sys)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,227 +107,245 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so requests answered by the gates are timed too.
+app.add_middleware(MetricsMiddleware)
+
+
+access_cache = AccessCache()
+
 
 socket_manager = SocketManager()
 
 
-controller_device = ControllerDevice()
+# Read from the socket manager whenever /metrics is scraped.
+metrics_registry.gauge("autopi_socket_clients", "Connected websocket clients.",
+                       callback=lambda: len(socket_manager.clients))
+metrics_registry.gauge("autopi_socket_outbox_depth", "Broadcasts waiting for the dispatcher.",
+                       callback=lambda: socket_manager.outbox.qsize() if socket_manager.outbox is not None else 0)
+metrics_registry.gauge("autopi_socket_queued_messages", "Messages waiting in the websocket clients' queues.",
+                       callback=lambda: sum(client.queue.qsize() for client in list(socket_manager.clients.values())))
+
+# Read from the access cache and session manager's own counts.
+metrics_registry.gauge("autopi_access_cache_members", "House members in the access cache.",
+                       callback=lambda: access_cache.get_stats()["members"])
+metrics_registry.counter("autopi_access_cache_hits_total", "Access checks answered from the cache.",
+                         callback=lambda: access_cache.get_stats()["hits"])
+metrics_registry.counter("autopi_access_cache_misses_total", "Access checks that went to the database.",
+                         callback=lambda: access_cache.get_stats()["misses"])
+metrics_registry.counter("autopi_sessions_issued_total", "Session tokens issued.",
+                         callback=lambda: sessions.get_stats()["issued"])
+metrics_registry.counter("autopi_sessions_verified_total", "Session tokens that verified.",
+                         callback=lambda: sessions.get_stats()["verified"])
+metrics_registry.counter("autopi_sessions_rejected_total", "Session tokens rejected as malformed, forged, expired or revoked.",
+                         callback=lambda: sessions.get_stats()["rejected"])
+metrics_registry.gauge("autopi_sessions_revoked", "Revoked sessions that haven't expired yet.",
+                       callback=lambda: sessions.get_stats()["revoked_sessions"])
+
+
+energy_rollup = EnergyRollup()
+
+
+device_log_writer = DeviceLogWriter(energy_rollup=energy_rollup)
+
+
+metrics_registry.gauge("autopi_log_writer_pending_logs", "Device control logs waiting for the next flush.",
+                       callback=lambda: device_log_writer.get_stats()["pending_logs"])
+metrics_registry.gauge("autopi_log_writer_pending_rollups", "Energy rollup increments waiting for the next flush.",
+                       callback=lambda: device_log_writer.get_stats()["pending_rollups"])
+metrics_registry.counter("autopi_log_writer_flushes_total", "Log writer flushes that wrote to the database.",
+                         callback=lambda: device_log_writer.get_stats()["flush_count"])
+metrics_registry.counter("autopi_log_writer_flushed_logs_total", "Device control logs written by the log writer.",
+                         callback=lambda: device_log_writer.get_stats()["flushed_logs"])
+metrics_registry.counter("autopi_log_writer_failed_flushes_total", "Log writer flushes that failed and were retried.",
+                         callback=lambda: device_log_writer.get_stats()["failed_flushes"])
+metrics_registry.counter("autopi_log_writer_dropped_logs_total", "Device control logs dropped, over the pending limit or rejected by the database.",
+                         callback=lambda: device_log_writer.get_stats()["dropped_logs"])
+
+
+# AUTOPI_GPIO_BACKEND picks real relays, gpiozero's mock pins or simulated ones (controller/gpio.py).
+gpio_backend = create_gpio_backend()
+
 
+controller_device = ControllerDevice(gpio_backend)
 
-schedule_assistant = ScheduleDeviceAssistant(controller_device, socket_manager)
+
+schedule_assistant = ScheduleDeviceAssistant(
+    controller_device, socket_manager, device_log_writer)
+
+
+log_maintenance = LogMaintenance()
+
+
+@app.get("/ready", status_code=status.HTTP_200_OK)
+def get_readiness():
+    if sys.is_ready:
+        return api_response("success", ResponseStatusCodes.REQUEST_FULLFILLED, "Server is ready.",
+                            status.HTTP_200_OK, sys.get_status())
+    return api_response("error", ResponseStatusCodes.SERVER_STARTING, "Server is starting.",
+                        status.HTTP_503_SERVICE_UNAVAILABLE, sys.get_status())
+
+
+@app.get("/metrics", status_code=status.HTTP_200_OK)
+def get_metrics():
+    '''Prometheus text format, open like /ready so a scraper needs no session.'''
+    return Response(content=metrics_registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
 
 
 @app.get("/get-house-member", status_code=status.HTTP_200_OK)
 def get_house_member(userId: str):
     if not is_valid_request([userId]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId.",
+            status.HTTP_400_BAD_REQUEST)
 
-    house_member = get_user(userId)
+    house_member = access_cache.get_member(userId)
 
     if isinstance(house_member, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": house_member._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, house_member._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     if house_member is None:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": f"House member with id '{userId}' not found."
-            },
-            status_code=status.HTTP_404_NOT_FOUND
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, f"House member with id '{userId}' not found.",
+            status.HTTP_404_NOT_FOUND)
 
-    return JSONResponse(
-        content={
-            "status": "success",
-            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-            "message": f"House member with id '{userId}' found.",
-            "data": house_member.to_dict()
-        },
-        status_code=status.HTTP_200_OK
-    )
+    return api_response(
+        "success", ResponseStatusCodes.REQUEST_FULLFILLED, f"House member with id '{userId}' found.",
+        status.HTTP_200_OK, house_member)
 
 
 @app.delete("/delete-house-member", status_code=status.HTTP_201_CREATED)
 def delete_house_member(userId: str):
     if not is_valid_request([userId]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId.",
+            status.HTTP_400_BAD_REQUEST)
 
     delete_count = delete_user(userId)
 
     if isinstance(delete_count, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": delete_count._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, delete_count._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    return JSONResponse(
-        content={
-            "status": "success",
-            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-            "message": f"{delete_count} user(s) deleted successfully.",
-        },
-        status_code=status.HTTP_201_CREATED
-    )
+    access_cache.remove_member(userId)
+    sessions.revoke_user(userId)
+
+    return api_response(
+        "success", ResponseStatusCodes.REQUEST_FULLFILLED, f"{delete_count} user(s) deleted successfully.",
+        status.HTTP_201_CREATED)
 
 
 @app.post("/house-login", status_code=status.HTTP_201_CREATED)
-def house_login(userId: str, password: str):
+async def house_login(userId: str, password: str):
     if not is_valid_request([userId, password]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId and password."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId and password.",
+            status.HTTP_400_BAD_REQUEST)
 
-    is_authenticated = sys.house_login(password)
+    # bcrypt runs on the small auth pool so a burst of logins can't starve the event loop or the DB workers.
+    is_authenticated = await run_auth(sys.house_login, password)
 
     if is_authenticated is None:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.HOUSE_NOT_INITIALIZED,
-                "message": "House is not initialized."
-            },
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE
-        )
+        return api_response(
+            "error", ResponseStatusCodes.HOUSE_NOT_INITIALIZED, "House is not initialized.",
+            status.HTTP_503_SERVICE_UNAVAILABLE)
 
     if not is_authenticated:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_CREDS,
-                "message": "Password was wrong."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_CREDS, "Password was wrong.",
+            status.HTTP_400_BAD_REQUEST)
 
-    house_member = add_user(userId)
+    house_member = await run_db(add_user, userId)
 
     if isinstance(house_member, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": house_member._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, house_member._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    return JSONResponse(
-        content={
-            "status": "success",
-            "status_code": ResponseStatusCodes.USER_LOGGEDIN,
-            "message": f"Logged into the house and user with id '{userId}' added as a member.",
-            "data": house_member.to_dict()
-        },
-        status_code=status.HTTP_201_CREATED
-    )
+    access_cache.add_member(house_member)
+
+    # Later requests send the token as "Authorization: Bearer <token>" instead of logging in again.
+    token, session = sessions.issue(userId)
+
+    return api_response(
+        "success", ResponseStatusCodes.USER_LOGGEDIN, f"Logged into the house and user with id '{userId}' added as a member.",
+        status.HTTP_201_CREATED, {
+            **house_member.to_dict(),
+            "token": token,
+            "token_expires_at": datetime.fromtimestamp(session.expires_at).astimezone().isoformat()
+        })
+
+
+@app.post("/house-logout", status_code=status.HTTP_200_OK)
+def house_logout(request: Request):
+    session = request.scope.get("state", {}).get("session")
+
+    if session is None:
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_SESSION, "Please provide the session token.",
+            status.HTTP_401_UNAUTHORIZED)
+
+    sessions.revoke(session)
+
+    return api_response(
+        "success", ResponseStatusCodes.REQUEST_FULLFILLED, "Logged out of the house.",
+        status.HTTP_200_OK)
+
+
+HOUSE_DETAILS_RESPONSE_PREFIX = encode_envelope(
+    "success", ResponseStatusCodes.REQUEST_FULLFILLED, "House data retrieved successfully.")[:-1] + b',"data":'
 
 
 @app.get("/get-house", status_code=status.HTTP_200_OK)
-def get_house_details(userId: str):
+def get_house_details(userId: str, request: Request):
     if not is_valid_request([userId]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId, userName, houseId and roomName."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId, userName, houseId and roomName.",
+            status.HTTP_400_BAD_REQUEST)
 
-    user = get_user(userId)
+    user = access_cache.get_member(userId)
 
     if isinstance(user, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": user._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, user._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     if user is None:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": f"User with id '{userId}' not found."
-            },
-            status_code=status.HTTP_404_NOT_FOUND
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, f"User with id '{userId}' not found.",
+            status.HTTP_404_NOT_FOUND)
 
-    is_authenticated = get_access(userId)
+    is_authenticated = access_cache.has_access(userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": is_authenticated._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, is_authenticated._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     if not is_authenticated:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": f"{userId} is not authorized to perform this operation."
-            },
-            status_code=status.HTTP_403_FORBIDDEN
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{userId} is not authorized to perform this operation.",
+            status.HTTP_403_FORBIDDEN)
 
-    house_data = get_house_data()
+    house_snapshot = controller_device.get_house_snapshot()
 
-    if isinstance(house_data, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": house_data._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+    if house_snapshot is None:
+        return api_response(
+            "error", ResponseStatusCodes.HOUSE_NOT_INITIALIZED, "House is not initialized.",
+            status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    house_data, etag = house_snapshot
 
-    return JSONResponse(
-        content={
-            "status": "success",
-            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-            "message": "House data retrieved successfully.",
-            "data": house_data.to_dict()
-        },
+    # Polling clients that already hold the current house get an empty 304.
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    return Response(
+        content=HOUSE_DETAILS_RESPONSE_PREFIX + house_data + b"}",
+        media_type="application/json",
+        headers={"ETag": etag},
         status_code=status.HTTP_200_OK
     )
 
@@ -260,68 +354,44 @@ def get_house_details(userId: str):
 async def add_room(request_body: AddRoomRequest):
 
     if not is_valid_request([request_body.userId, request_body.userName, request_body.houseId, request_body.roomName]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId, userName, houseId and roomName."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId, userName, houseId and roomName.",
+            status.HTTP_400_BAD_REQUEST)
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = access_cache.has_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": is_authenticated._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, is_authenticated._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     if not is_authenticated:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": f"{request_body.userName} is not authorized to perform this operation."
-            },
-            status_code=status.HTTP_403_FORBIDDEN
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{request_body.userName} is not authorized to perform this operation.",
+            status.HTTP_403_FORBIDDEN)
 
-    room = create_room(request_body.roomName, request_body.houseId)
+    room = await run_db(create_room, request_body.roomName, request_body.houseId)
 
     if isinstance(room, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": room._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, room._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     controller_device.add_room(room)
 
-    content = {
-        "status": "success",
-        "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-        "message": "Room created successfully.",
-        "data": room.to_dict()
-    }
+    content = build_envelope(
+        "success", ResponseStatusCodes.REQUEST_FULLFILLED, "Room created successfully.", room)
 
-    broadcast_data = {
-        "event": SocketEvents.ADD_ROOM,
-        "user_id": request_body.userId,
-        "message": f"{request_body.userName} created a room {request_body.roomName}.",
-        "data": content["data"]
-    }
+    broadcast_data = SocketMessage(
+        event=SocketEvents.ADD_ROOM,
+        user_id=request_body.userId,
+        message=f"{request_body.userName} created a room {request_body.roomName}.",
+        data=content["data"]
+    )
 
-    await socket_manager.broadcast(json.dumps(broadcast_data))
+    await socket_manager.broadcast(broadcast_data)
 
-    return JSONResponse(
+    return ORJSONResponse(
         content=content,
         status_code=status.HTTP_201_CREATED
     )
@@ -331,159 +401,102 @@ async def add_room(request_body: AddRoomRequest):
 async def delete_room(request_body: RemoveRoomRequest):
 
     if not is_valid_request([request_body.userId, request_body.userName, request_body.houseId, request_body.roomId, request_body.roomName]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId, userName, houseId roomId and roomName."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId, userName, houseId roomId and roomName.",
+            status.HTTP_400_BAD_REQUEST)
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = access_cache.has_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": is_authenticated._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, is_authenticated._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     if not is_authenticated:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": f"{request_body.userName} is not authorized to perform this operation."
-            },
-            status_code=status.HTTP_403_FORBIDDEN
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{request_body.userName} is not authorized to perform this operation.",
+            status.HTTP_403_FORBIDDEN)
 
-    delete_count = remove_room(request_body.roomId)
+    delete_count = await run_db(remove_room, request_body.roomId)
 
     if isinstance(delete_count, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": delete_count._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
-
-    controller_device.remove_room(request_body.roomId, schedule_assistant)
-
-    broadcast_data = {
-        "event": SocketEvents.REMOVE_ROOM,
-        "user_id": request_body.userId,
-        "message": f"{request_body.userName} deleted a room {request_body.roomName}.",
-        "data": {"roomId": request_body.roomId}
-    }
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, delete_count._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    removed_device_ids = await run_gpio(controller_device.remove_room, request_body.roomId, schedule_assistant)
+    for device_id in removed_device_ids:
+        device_log_writer.forget_device(device_id)
+
+    broadcast_data = SocketMessage(
+        event=SocketEvents.REMOVE_ROOM,
+        user_id=request_body.userId,
+        message=f"{request_body.userName} deleted a room {request_body.roomName}.",
+        data={"roomId": request_body.roomId}
+    )
 
-    await socket_manager.broadcast(json.dumps(broadcast_data))
+    await socket_manager.broadcast(broadcast_data)
 
-    return JSONResponse(
-        content={
-            "status": "success",
-            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-            "message": f"{delete_count} Room(s) deleted successfully.",
-        },
-        status_code=status.HTTP_201_CREATED
-    )
+    return api_response(
+        "success", ResponseStatusCodes.REQUEST_FULLFILLED, f"{delete_count} Room(s) deleted successfully.",
+        status.HTTP_201_CREATED)
 
 
 @app.post("/add-device", status_code=status.HTTP_201_CREATED)
 async def add_device(request_body: AddDeviceRequest):
 
     if not is_valid_request([request_body.userId and request_body.userName and request_body.houseId and request_body.roomId and request_body.pinNumber and request_body.deviceName]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId, userName, houseId, roomId, pinNumber and deviceName."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId, userName, houseId, roomId, pinNumber and deviceName.",
+            status.HTTP_400_BAD_REQUEST)
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = access_cache.has_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": is_authenticated._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, is_authenticated._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     if not is_authenticated:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": f"{request_body.userName} is not authorized to perform this operation."
-            },
-            status_code=status.HTTP_403_FORBIDDEN
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{request_body.userName} is not authorized to perform this operation.",
+            status.HTTP_403_FORBIDDEN)
 
-    available_gpio_pins = get_available_gpio_pins()
+    available_gpio_pins = await run_db(get_available_gpio_pins)
 
     if isinstance(available_gpio_pins, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": available_gpio_pins._message()
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, available_gpio_pins._message(),
+            status.HTTP_400_BAD_REQUEST)
 
     if request_body.pinNumber not in [gpio_pin.gpio_pin_number for gpio_pin in available_gpio_pins]:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": f"{request_body.pinNumber} already in use by another device."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{request_body.pinNumber} already in use by another device.",
+            status.HTTP_400_BAD_REQUEST)
 
-    device = create_device(request_body.deviceName,
-                           request_body.pinNumber, request_body.wattage, request_body.roomId)
+    device = await run_db(create_device, request_body.deviceName,
+                          request_body.pinNumber, request_body.wattage, request_body.roomId)
 
     if isinstance(device, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": device._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, device._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    controller_device.add_device(device)
+    await run_gpio(controller_device.add_device, device)
 
-    content = {
-        "status": "success",
-        "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-        "message": "Device created successfully.",
-        "data": device.to_dict()
-    }
+    content = build_envelope(
+        "success", ResponseStatusCodes.REQUEST_FULLFILLED, "Device created successfully.", device)
 
-    broadcast_data = {
-        "event": SocketEvents.ADD_DEVICE,
-        "user_id": request_body.userId,
-        "message": f"{request_body.userName} created a device {request_body.deviceName}.",
-        "data": content["data"]
-    }
+    broadcast_data = SocketMessage(
+        event=SocketEvents.ADD_DEVICE,
+        user_id=request_body.userId,
+        message=f"{request_body.userName} created a device {request_body.deviceName}.",
+        data=content["data"]
+    )
 
-    await socket_manager.broadcast(json.dumps(broadcast_data))
+    await socket_manager.broadcast(broadcast_data)
 
-    return JSONResponse(
+    return ORJSONResponse(
         content=content,
         status_code=status.HTTP_201_CREATED
     )
@@ -493,409 +506,445 @@ async def add_device(request_body: AddDeviceRequest):
 async def toggle_device(request_body: SwitchDeviceRequest):
 
     if not is_valid_request([request_body.userId, request_body.userName, request_body.houseId, request_body.deviceId, request_body.deviceName, request_body.statusFrom, request_body.statusTo]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId, userName, houseId, deviceId, deviceName, statusFrom and statusTo."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId, userName, houseId, deviceId, deviceName, statusFrom and statusTo.",
+            status.HTTP_400_BAD_REQUEST)
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = access_cache.has_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": is_authenticated._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, is_authenticated._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     if not is_authenticated:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": f"{request_body.userName} is not authorized to perform this operation."
-            },
-            status_code=status.HTTP_403_FORBIDDEN
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{request_body.userName} is not authorized to perform this operation.",
+            status.HTTP_403_FORBIDDEN)
 
     try:
-        controller_device.switch_device(
-            request_body.deviceId, request_body.statusTo)
+        await run_gpio(controller_device.switch_device,
+                       request_body.deviceId, request_body.statusTo)
     except Exception as e:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": f"Error switching device: {e}"
-            },
-            # Explicitly setting status_code to 200 to avoid Web Exceptions on Cient Side.
-            status_code=status.HTTP_200_OK
-        )
+        # Explicitly setting status_code to 200 to avoid Web Exceptions on Cient Side.
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, f"Error switching device: {e}",
+            status.HTTP_200_OK)
 
-    update_count = switch_device(request_body.deviceId,
-                                 request_body.statusFrom, request_body.statusTo, request_body.userId)
-
-    if isinstance(update_count, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": update_count._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+    device = controller_device.get_device(request_body.deviceId)
+
+    # Queued and written to the database in batches by the log writer.
+    device_log_writer.log_switch(request_body.deviceId, request_body.statusFrom,
+                                 request_body.statusTo, request_body.userId, device.wattage if device is not None else None)
+    update_count = 1
 
     _state = "on" if request_body.statusTo else "off"
 
-    content = {
-        "status": "success",
-        "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-        "message": "Device Switched successfully.",
-        "data": f"{update_count} device(s) swicthed {_state}"
-    }
+    content = build_envelope("success", ResponseStatusCodes.REQUEST_FULLFILLED, "Device Switched successfully.",
+                             f"{update_count} device(s) swicthed {_state}")
 
-    broadcast_data = {
-        "event": SocketEvents.SWITCH_DEVICE,
-        "user_id": request_body.userId,
-        "message": f"{request_body.userName} turned {_state} {request_body.deviceName}.",
-        "data": {"deviceId": request_body.deviceId, "state": request_body.statusTo}
-    }
+    broadcast_data = SocketMessage(
+        event=SocketEvents.SWITCH_DEVICE,
+        user_id=request_body.userId,
+        message=f"{request_body.userName} turned {_state} {request_body.deviceName}.",
+        data={"deviceId": request_body.deviceId, "state": request_body.statusTo}
+    )
 
-    await socket_manager.broadcast(json.dumps(broadcast_data))
+    await socket_manager.broadcast(broadcast_data)
 
-    return JSONResponse(
+    return ORJSONResponse(
         content=content,
         status_code=status.HTTP_201_CREATED
     )
 
 
+@app.patch("/switch-devices", status_code=status.HTTP_202_ACCEPTED)
+async def switch_devices(request_body: SwitchDevicesRequest):
+    '''Switches a list of devices or a built-in scene with one access check, log batch and broadcast.'''
+
+    if not is_valid_request([request_body.userId, request_body.userName, request_body.houseId]) or \
+            (request_body.switches is None) == (request_body.scene is None):
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId, userName, houseId and either switches or a scene.",
+            status.HTTP_400_BAD_REQUEST)
+
+    is_authenticated = access_cache.has_access(request_body.userId)
+
+    if isinstance(is_authenticated, SQLAlchemyError):
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, is_authenticated._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    if not is_authenticated:
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{request_body.userName} is not authorized to perform this operation.",
+            status.HTTP_403_FORBIDDEN)
+
+    if request_body.scene is not None:
+        switches = controller_device.get_scene_switches(
+            request_body.scene, request_body.roomId)
+        if switches is None:
+            return api_response(
+                "error", ResponseStatusCodes.INVALID_DATA, f"Unknown scene or room, scenes are {', '.join(Scenes.ALL)} (room scenes need a roomId).",
+                status.HTTP_400_BAD_REQUEST)
+    else:
+        switches = [(switch.deviceId, switch.state)
+                    for switch in request_body.switches or []]
+
+    switched, failed = await run_gpio(controller_device.switch_devices, switches)
+
+    # Queued together, so they are written in one multi-row insert.
+    device_log_writer.log_switches([(device.device_id, previous_status, device.status, device.wattage)
+                                    for device, previous_status in switched], request_body.userId)
+
+    switched_devices = [{"deviceId": device.device_id, "state": device.status}
+                        for device, _ in switched]
+
+    data = {
+        "switched": switched_devices,
+        "failed": [{"deviceId": device_id, "message": message} for device_id, message in failed.items()]
+    }
+    if len(failed) == 0:
+        content = build_envelope("success", ResponseStatusCodes.REQUEST_FULLFILLED,
+                                 f"{len(switched)} device(s) switched.", data)
+    else:
+        content = build_envelope("error", ResponseStatusCodes.SWITCH_DEVICE_ERROR,
+                                 f"{len(switched)} device(s) switched, {len(failed)} failed.", data)
+
+    if len(switched) > 0:
+        broadcast_data = SocketMessage(
+            event=SocketEvents.SWITCH_DEVICES,
+            user_id=request_body.userId,
+            message=f"{request_body.userName} switched {len(switched)} device(s).",
+            data={"devices": switched_devices, "scene": request_body.scene}
+        )
+
+        await socket_manager.broadcast(broadcast_data)
+
+    return ORJSONResponse(
+        content=content,
+        # Explicitly setting status_code to 200 to avoid Web Exceptions on Cient Side.
+        status_code=status.HTTP_200_OK
+    )
+
+
 @app.put("/configure-device", status_code=status.HTTP_202_ACCEPTED)
 async def config_device(request_body: ConfigureDeviceRequest):
 
     if not is_valid_request([request_body.houseId, request_body.userId, request_body.userName, request_body.deviceId, request_body.deviceName, request_body.pinNumber, request_body.status, request_body.isDefault, request_body.isScheduled]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide houseId, userId, userName, deviceId, deviceName, pinNumber, status, isDefault and isScheduled."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide houseId, userId, userName, deviceId, deviceName, pinNumber, status, isDefault and isScheduled.",
+            status.HTTP_400_BAD_REQUEST)
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = access_cache.has_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": is_authenticated._message()
-            },
-            status_code=status.HTTP_202_ACCEPTED
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, is_authenticated._message(),
+            status.HTTP_202_ACCEPTED)
 
     if not is_authenticated:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": f"{request_body.userName} is not authorized to perform this operation."
-            },
-            status_code=status.HTTP_403_FORBIDDEN
-        )
-
-    updated_device_count = configure_device(request_body.deviceId,
-                                            request_body.deviceName, request_body.pinNumber, request_body.status, request_body.isDefault, request_body.isScheduled, request_body.daysScheduled, request_body.startTime, request_body.offTime, request_body.wattage, request_body.userId)
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{request_body.userName} is not authorized to perform this operation.",
+            status.HTTP_403_FORBIDDEN)
+
+    if request_body.isScheduled:
+        try:
+            parse_schedule(request_body.daysScheduled,
+                           request_body.startTime, request_body.offTime)
+        except ValueError as e:
+            return api_response(
+                "error", ResponseStatusCodes.INVALID_DATA, f"Invalid schedule. {e}",
+                status.HTTP_400_BAD_REQUEST)
+
+    # Switches still queued are written first, so configure_device compares its status against them
+    # and its log follows theirs.
+    await run_db(device_log_writer.flush)
+
+    updated_device_count = await run_db(configure_device, request_body.deviceId,
+                                        request_body.deviceName, request_body.pinNumber, request_body.status, request_body.isDefault, request_body.isScheduled, request_body.daysScheduled, request_body.startTime, request_body.offTime, request_body.wattage, request_body.userId)
 
     if isinstance(updated_device_count, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": updated_device_count._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, updated_device_count._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    device = controller_device.get_device(request_body.deviceId)
+    # A scheduled device takes its schedule's current status, otherwise it keeps its own.
+    scheduled_status = get_scheduled_device_status(
+        request_body.startTime, request_body.offTime) if request_body.isScheduled else None
 
-    if device is not None:
-        controller_device.remove_device(device.device_id)
+    device = await run_gpio(controller_device.configure_device, request_body.deviceId, request_body.deviceName,
+                            request_body.pinNumber, scheduled_status, request_body.isDefault, request_body.isScheduled,
+                            request_body.daysScheduled, request_body.startTime, request_body.offTime, request_body.userId,
+                            request_body.wattage)
 
-        is_on = False
+    if device is not None:
+        # configure_device stored and logged this status, the energy rollup follows it and a status
+        # queued by a switch since the flush above can't overwrite it.
+        device_log_writer.record_status_change(
+            device.device_id, scheduled_status if request_body.isScheduled else request_body.status, request_body.wattage)
 
         if request_body.isScheduled:
-            is_on = get_scheduled_device_status(
-                request_body.startTime, request_body.offTime)
+            schedule_assistant.schedule_device(device)
         else:
-            is_on = device.status
-
-        device.device_name = request_body.deviceName
-        device.pin_number = request_body.pinNumber
-        device.is_scheduled = request_body.isScheduled
-        device.days_scheduled = request_body.daysScheduled if request_body.isScheduled else ""
-        device.start_time = request_body.startTime if request_body.isScheduled else ""
-        device.off_time = request_body.offTime if request_body.isScheduled else ""
-        device.status = is_on
-        device.scheduled_by = request_body.userId
-        device.output_device = None
-
-        controller_device.add_device(device)
-        new_device = controller_device.get_device(device.device_id)
-
-        if new_device is not None:
-            if request_body.isScheduled:
-                schedule_assistant.schedule_device(new_device)
-            else:
-                schedule_assistant.remove_scheduled_device(
-                    new_device.device_id)
-
-    broadcast_data = {
-        "event": SocketEvents.CONFIGURE_DEVICE,
-        "user_id": request_body.userId,
-        "message": f"{request_body.userName} updated the configuration of {request_body.deviceName}.",
-        "data": device.to_dict() if device is not None else None
-    }
+            schedule_assistant.remove_scheduled_device(device.device_id)
 
-    await socket_manager.broadcast(json.dumps(broadcast_data))
-
-    return JSONResponse(
-        content={
-            "status": "success",
-            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-            "message": "Device Configured successfully.",
-            "data": f"{updated_device_count} Device(s) configured."
-        },
-        status_code=status.HTTP_201_CREATED
+    broadcast_data = SocketMessage(
+        event=SocketEvents.CONFIGURE_DEVICE,
+        user_id=request_body.userId,
+        message=f"{request_body.userName} updated the configuration of {request_body.deviceName}.",
+        data=device
     )
 
+    await socket_manager.broadcast(broadcast_data)
+
+    return api_response(
+        "success", ResponseStatusCodes.REQUEST_FULLFILLED, "Device Configured successfully.",
+        status.HTTP_201_CREATED, f"{updated_device_count} Device(s) configured.")
+
 
 @app.delete("/remove-device", status_code=status.HTTP_200_OK)
 async def delete_device(request_body: RemoveDeviceRequest):
 
     if not is_valid_request([request_body.userId, request_body.userName, request_body.houseId, request_body.roomId, request_body.deviceId, request_body.deviceName]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId, userName, houseId, roomId, deviceId and deviceName."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId, userName, houseId, roomId, deviceId and deviceName.",
+            status.HTTP_400_BAD_REQUEST)
 
-    is_authenticated = get_access(request_body.userId)
+    is_authenticated = access_cache.has_access(request_body.userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": is_authenticated._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, is_authenticated._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     if not is_authenticated:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": f"{request_body.userName} is not authorized to perform this operation."
-            },
-            status_code=status.HTTP_403_FORBIDDEN
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{request_body.userName} is not authorized to perform this operation.",
+            status.HTTP_403_FORBIDDEN)
 
-    delete_count = remove_device(request_body.deviceId)
+    delete_count = await run_db(remove_device, request_body.deviceId)
 
     if isinstance(delete_count, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": delete_count._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, delete_count._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    controller_device.remove_device(request_body.deviceId)
+    await run_gpio(controller_device.remove_device, request_body.deviceId)
     schedule_assistant.remove_scheduled_device(request_body.deviceId)
+    device_log_writer.forget_device(request_body.deviceId)
 
-    broadcast_data = {
-        "event": SocketEvents.REMOVE_DEVICE,
-        "user_id": request_body.userId,
-        "message": f"{request_body.userName} removed device {request_body.deviceName}.",
-        "data": {"deviceId": request_body.deviceId}
-    }
+    broadcast_data = SocketMessage(
+        event=SocketEvents.REMOVE_DEVICE,
+        user_id=request_body.userId,
+        message=f"{request_body.userName} removed device {request_body.deviceName}.",
+        data={"deviceId": request_body.deviceId}
+    )
 
-    await socket_manager.broadcast(json.dumps(broadcast_data))
+    await socket_manager.broadcast(broadcast_data)
 
-    return JSONResponse(
-        content={
-            "status": "success",
-            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-            "message": f"{delete_count} Device(s) deleted successfully.",
-        },
-        status_code=status.HTTP_201_CREATED
-    )
+    return api_response(
+        "success", ResponseStatusCodes.REQUEST_FULLFILLED, f"{delete_count} Device(s) deleted successfully.",
+        status.HTTP_201_CREATED)
 
 
 @app.get("/get-available-gpio-pins", status_code=status.HTTP_200_OK)
 def get_all_available_gpio_pins(userId: str):
     if not is_valid_request([userId]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId.",
+            status.HTTP_400_BAD_REQUEST)
 
-    house_member = get_user(userId)
+    house_member = access_cache.get_member(userId)
 
     if isinstance(house_member, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": house_member._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, house_member._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     if house_member is None:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": f"House member with id '{userId}' not found."
-            },
-            status_code=status.HTTP_404_NOT_FOUND
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"House member with id '{userId}' not found.",
+            status.HTTP_404_NOT_FOUND)
 
     available_gpio_pins = get_available_gpio_pins()
 
     if isinstance(available_gpio_pins, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": available_gpio_pins._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, available_gpio_pins._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    return JSONResponse(
-        content={
-            "status": "success",
-            "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-            "message": f"Get available GPIO pins succeed.",
-            "data": [gpio_pin_config.to_dict() for gpio_pin_config in available_gpio_pins]
-        },
-        status_code=status.HTTP_200_OK
-    )
+    return api_response(
+        "success", ResponseStatusCodes.REQUEST_FULLFILLED, f"Get available GPIO pins succeed.",
+        status.HTTP_200_OK, [gpio_pin_config.to_dict() for gpio_pin_config in available_gpio_pins])
 
 
 @app.get("/get-energy-consumption", status_code=status.HTTP_200_OK)
 async def get_energy_consumption(userId: str):
     if not is_valid_request([userId]):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_DATA,
-                "message": "Please provide userId."
-            },
-            status_code=status.HTTP_400_BAD_REQUEST
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId.",
+            status.HTTP_400_BAD_REQUEST)
 
-    is_authenticated = get_access(userId)
+    is_authenticated = access_cache.has_access(userId)
 
     if isinstance(is_authenticated, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": is_authenticated._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, is_authenticated._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     if not is_authenticated:
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.INVALID_REQUEST,
-                "message": f"{userId} is not authorized to perform this operation."
-            },
-            status_code=status.HTTP_403_FORBIDDEN
-        )
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{userId} is not authorized to perform this operation.",
+            status.HTTP_403_FORBIDDEN)
 
     today = datetime.now()
     current_month_start = today.replace(day=15)
     last_month_start = (current_month_start -
                         timedelta(days=30)).replace(day=15)
 
-    logs = get_specific_device_control_logs(
-        last_month_start, current_month_start)
+    # Sums hourly rollups instead of replaying the month's control logs.
+    consumption, device_rooms = await asyncio.gather(
+        run_db(energy_rollup.get_energy_consumption, last_month_start.astimezone(),
+               current_month_start.astimezone(), device_log_writer.get_pending_rollups()),
+        run_gpio(controller_device.get_device_rooms))
+
+    if isinstance(consumption, SQLAlchemyError):
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, consumption._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    energy_consumption = summarize_energy_consumption(
+        {device_id: watt_hours for device_id, (_, watt_hours) in consumption.items()}, device_rooms)
+
+    content = build_envelope("success", ResponseStatusCodes.REQUEST_FULLFILLED, f"Energy Consumption calculated successfully.", {
+        "energy_consumption_watt_hours": energy_consumption.total_watt_hours,
+        "device_watt_hours": energy_consumption.device_watt_hours,
+        "room_watt_hours": energy_consumption.room_watt_hours,
+        "start_date": last_month_start.isoformat(),
+        "end_date": current_month_start.isoformat()
+    })
+
+    broadcast_data = SocketMessage(
+        event=SocketEvents.ENERGY_CONSUMPTION_CALCULATED,
+        user_id=userId,
+        message=f"Energy Consumption calculated successfully.",
+        data=content["data"]
+    )
+
+    await socket_manager.broadcast(broadcast_data)
+
+    return ORJSONResponse(
+        content=content,
+        status_code=status.HTTP_200_OK
+    )
+
+
+# Largest page /get-device-control-logs returns, bigger ranges should use /export-device-control-logs.
+MAX_LOG_PAGE_SIZE = 5000
+
+
+def parse_log_range(startDate: str | None, endDate: str | None):
+    '''Returns (start_date, end_date), raises ValueError for malformed ISO 8601 dates.'''
+    return (datetime.fromisoformat(startDate) if startDate is not None else None,
+            datetime.fromisoformat(endDate) if endDate is not None else None)
+
+
+@app.get("/get-device-control-logs", status_code=status.HTTP_200_OK)
+async def get_device_control_logs(userId: str, startDate: str | None = None, endDate: str | None = None, deviceId: str = "all",
+                                  cursor: str | None = None, limit: int = 500):
+    if not is_valid_request([userId]):
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId.",
+            status.HTTP_400_BAD_REQUEST)
+
+    try:
+        start_date, end_date = parse_log_range(startDate, endDate)
+        after = decode_cursor(cursor) if cursor is not None else None
+    except ValueError as e:
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, f"Invalid date range or cursor. {e}",
+            status.HTTP_400_BAD_REQUEST)
+
+    is_authenticated = access_cache.has_access(userId)
+
+    if isinstance(is_authenticated, SQLAlchemyError):
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, is_authenticated._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    if not is_authenticated:
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{userId} is not authorized to perform this operation.",
+            status.HTTP_403_FORBIDDEN)
+
+    limit = max(1, min(limit, MAX_LOG_PAGE_SIZE))
+    logs = await run_db(get_device_control_log_page, start_date, end_date, deviceId, after, limit)
 
     if isinstance(logs, SQLAlchemyError):
-        return JSONResponse(
-            content={
-                "status": "error",
-                "status_code": ResponseStatusCodes.SERVER_ERROR,
-                "message": logs._message()
-            },
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, logs._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return api_response("success", ResponseStatusCodes.REQUEST_FULLFILLED, "Device Control Logs fetched successfully.",
+                        status.HTTP_200_OK, {
+                            "logs": list(logs),
+                            # None on the last page.
+                            "next_cursor": encode_cursor(logs[-1]) if len(logs) == limit else None
+                        })
+
+
+@app.get("/export-device-control-logs", status_code=status.HTTP_200_OK)
+def export_device_control_logs(userId: str, startDate: str | None = None, endDate: str | None = None, deviceId: str = "all",
+                               format: str = LogExportFormats.NDJSON):
+    if not is_valid_request([userId]) or format not in LogExportFormats.ALL:
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, "Please provide userId and a format of ndjson or csv.",
+            status.HTTP_400_BAD_REQUEST)
 
-    energy_consumption_watt_hours = calculate_energy_consumption(
-        logs, current_month_start)
-
-    content = {
-        "status": "success",
-        "status_code": ResponseStatusCodes.REQUEST_FULLFILLED,
-        "message": f"Energy Consumption calculated successfully.",
-        "data": {
-            "energy_consumption_watt_hours": energy_consumption_watt_hours,
-            "start_date": last_month_start.isoformat(),
-            "end_date": current_month_start.isoformat()
-        }
-    }
+    try:
+        start_date, end_date = parse_log_range(startDate, endDate)
+    except ValueError as e:
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_DATA, f"Invalid date range. {e}",
+            status.HTTP_400_BAD_REQUEST)
 
-    broadcast_data = {
-        "event": SocketEvents.ENERGY_CONSUMPTION_CALCULATED,
-        "user_id": userId,
-        "message": f"Energy Consumption calculated successfully.",
-        "data": content["data"]
-    }
+    is_authenticated = access_cache.has_access(userId)
 
-    await socket_manager.broadcast(json.dumps(broadcast_data))
+    if isinstance(is_authenticated, SQLAlchemyError):
+        return api_response(
+            "error", ResponseStatusCodes.SERVER_ERROR, is_authenticated._message(),
+            status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    return JSONResponse(
-        content=content,
-        status_code=status.HTTP_200_OK
+    if not is_authenticated:
+        return api_response(
+            "error", ResponseStatusCodes.INVALID_REQUEST, f"{userId} is not authorized to perform this operation.",
+            status.HTTP_403_FORBIDDEN)
+
+    # Rows are read through a server-side cursor and encoded as they are sent.
+    return StreamingResponse(
+        encode_logs(iter_device_control_logs(
+            start_date, end_date, deviceId), format),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="device_control_logs.{format}"'}
     )
 
 
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await socket_manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, user_id: str, encoding: str = SocketEncodings.JSON):
+    # Clients choose the broadcast wire format with ?encoding=json|compact|msgpack.
+    await socket_manager.connect(websocket, encoding)
     try:
         while True:
             data = await websocket.receive_text()
             await socket_manager.is_alive(f"User {user_id} sent: {data}", websocket)
     except WebSocketDisconnect:
         socket_manager.disconnect(websocket)
-        broadcast_content = {
-            "event": SocketEvents.USER_LEFT,
-            "user_id": user_id,
-            "message": f"Client #{user_id} left.",
-            "data": {"userId": user_id},
-        }
-        await socket_manager.broadcast(json.dumps(broadcast_content))
+        broadcast_content = SocketMessage(
+            event=SocketEvents.USER_LEFT,
+            user_id=user_id,
+            message=f"Client #{user_id} left.",
+            data={"userId": user_id}
+        )
+        await socket_manager.broadcast(broadcast_content)
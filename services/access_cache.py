@@ -0,0 +1,88 @@
+import threading
+from typing import Dict
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.actions import get_house, get_house_members
+
+from helpers.data_models import HouseMember
+
+
+class AccessCache():
+    '''
+    In-memory copy of the house members used to authorize requests without a DB round trip.
+    Loaded during startup, or on first use.
+    '''
+
+    house_id: str | None = None
+    house_members: Dict[str, HouseMember]
+    is_loaded: bool = False
+
+    hits: int = 0
+    misses: int = 0
+
+    lock: threading.Lock
+
+    def __init__(self):
+        self.house_members = {}
+        self.lock = threading.Lock()
+
+    def load(self) -> bool | SQLAlchemyError:
+        house = get_house()
+        if isinstance(house, SQLAlchemyError):
+            print("[Access Cache] Loading house failed.")
+            return house
+
+        house_members = get_house_members()
+        if isinstance(house_members, SQLAlchemyError):
+            print("[Access Cache] Loading house members failed.")
+            return house_members
+
+        with self.lock:
+            self.house_id = house.house_id if house is not None else None
+            self.house_members = {
+                house_member.user_id: house_member for house_member in house_members}
+            self.is_loaded = True
+
+        print(f"[Access Cache] Loaded {len(self.house_members)} house member(s).")
+        return True
+
+    def ensure_loaded(self) -> bool | SQLAlchemyError:
+        if self.is_loaded:
+            return True
+        return self.load()
+
+    def get_member(self, user_id: str) -> HouseMember | None | SQLAlchemyError:
+        loaded = self.ensure_loaded()
+        if isinstance(loaded, SQLAlchemyError):
+            return loaded
+
+        house_member = self.house_members.get(user_id)
+        if house_member is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return house_member
+
+    def has_access(self, user_id: str) -> bool | SQLAlchemyError:
+        house_member = self.get_member(user_id)
+        if isinstance(house_member, SQLAlchemyError):
+            return house_member
+        return house_member is not None and house_member.house_id == self.house_id
+
+    def add_member(self, house_member: HouseMember):
+        with self.lock:
+            if self.house_id is None:
+                self.house_id = house_member.house_id
+            self.house_members[house_member.user_id] = house_member
+
+    def remove_member(self, user_id: str):
+        with self.lock:
+            self.house_members.pop(user_id, None)
+
+    def get_stats(self):
+        return {
+            "members": len(self.house_members),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,276 @@
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy.exc import DataError, IntegrityError, SQLAlchemyError
+
+from database.actions import persist_device_switches
+
+from helpers.config import LOG_FLUSH_BATCH_SIZE, LOG_FLUSH_INTERVAL_SECONDS, LOG_MAX_PENDING, LOG_RETRY_MAX_SECONDS
+
+from services.energy_rollup import EnergyRollup, RollupIncrements
+
+
+class DeviceLogWriter():
+    '''
+    Write-behind queue for device switches.
+
+    Switch events are buffered in memory and written by a background thread as one
+    multi-row insert once `batch_size` events are pending or `flush_interval` seconds
+    have passed. Device statuses are coalesced so a flapping device is updated once
+    per flush. Pending events are drained by `stop()` on shutdown.
+
+    With an `energy_rollup`, each switch also produces hourly energy increments that
+    are coalesced per bucket and upserted in the same transaction as the logs.
+
+    A failed flush is retried with exponential backoff, keeping at most `max_pending`
+    logs (the oldest are dropped). From the `SPLIT_AFTER_FAILURES`th failure in a row
+    the logs are written in halving chunks, so a single row the database refuses is
+    dropped instead of blocking the queue.
+    '''
+
+    SPLIT_AFTER_FAILURES = 3
+
+    batch_size: int
+    flush_interval: float
+    max_pending: int
+    retry_max_seconds: float
+
+    pending_logs: List[Dict[str, Any]]
+    pending_statuses: Dict[str, bool]
+    pending_rollups: RollupIncrements
+    energy_rollup: EnergyRollup | None
+
+    condition: threading.Condition
+    # Held for a whole flush, so a flush from another thread waits for the worker's to be written.
+    flush_lock: threading.Lock
+    worker_thread: threading.Thread | None = None
+    is_running: bool = False
+
+    flush_count: int = 0
+    flushed_logs: int = 0
+    failed_flushes: int = 0
+    consecutive_failures: int = 0
+    dropped_logs: int = 0
+
+    def __init__(self, batch_size: int = LOG_FLUSH_BATCH_SIZE, flush_interval: float = LOG_FLUSH_INTERVAL_SECONDS,
+                 energy_rollup: EnergyRollup | None = None, max_pending: int = LOG_MAX_PENDING,
+                 retry_max_seconds: float = LOG_RETRY_MAX_SECONDS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retry_max_seconds = retry_max_seconds
+        self.energy_rollup = energy_rollup
+        self.pending_logs = []
+        self.pending_statuses = {}
+        self.pending_rollups = {}
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+
+    def start(self):
+        with self.condition:
+            if self.is_running:
+                return
+            self.is_running = True
+        self.worker_thread = threading.Thread(target=self._worker)
+        self.worker_thread.daemon = True
+        self.worker_thread.start()
+
+    def log_switch(self, device_id: str, from_status: bool, to_status: bool, user_id: str, wattage: float | None):
+        log = {
+            "statusChangedFrom": from_status,
+            "statusChangedTo": to_status,
+            "deviceId": device_id,
+            "deviceWattage": wattage,
+            "userId": user_id,
+            # Stamped now, the row may be written a few seconds later.
+            "createdAt": datetime.now().astimezone(),
+        }
+        with self.condition:
+            self.pending_logs.append(log)
+            self.pending_statuses[device_id] = to_status
+            self._add_rollup(device_id, to_status, wattage, log["createdAt"])
+            if len(self.pending_logs) >= self.batch_size:
+                self.condition.notify()
+
+    def log_switches(self, switches: List[Tuple[str, bool, bool, float | None]], user_id: str):
+        '''Queues (device_id, from_status, to_status, wattage) switches made together, they land in the same flush.'''
+        created_at = datetime.now().astimezone()
+        logs = [{
+            "statusChangedFrom": from_status,
+            "statusChangedTo": to_status,
+            "deviceId": device_id,
+            "deviceWattage": wattage,
+            "userId": user_id,
+            "createdAt": created_at,
+        } for device_id, from_status, to_status, wattage in switches]
+        with self.condition:
+            self.pending_logs.extend(logs)
+            for device_id, _, to_status, wattage in switches:
+                self.pending_statuses[device_id] = to_status
+                self._add_rollup(device_id, to_status, wattage, created_at)
+            if len(self.pending_logs) >= self.batch_size:
+                self.condition.notify()
+
+    def record_status_change(self, device_id: str, to_status: bool, wattage: float | None):
+        '''
+        Tracks a status that is persisted elsewhere (e.g. configure device) for energy rollups. A status
+        still queued for the device is dropped, it is older and would overwrite the stored one.
+        '''
+        with self.condition:
+            self.pending_statuses.pop(device_id, None)
+            self._add_rollup(device_id, to_status, wattage,
+                             datetime.now().astimezone())
+
+    def forget_device(self, device_id: str):
+        '''Ends a deleted device's energy tracking, an interval still open is closed now and written with the next flush.'''
+        if self.energy_rollup is None:
+            return
+        with self.condition:
+            merge_rollups(self.pending_rollups, self.energy_rollup.forget_device(
+                device_id, datetime.now().astimezone()))
+
+    def _add_rollup(self, device_id: str, to_status: bool, wattage: float | None, at: datetime):
+        if self.energy_rollup is None:
+            return
+        increments = self.energy_rollup.record_switch(
+            device_id, to_status, wattage, at)
+        merge_rollups(self.pending_rollups, increments)
+
+    def get_pending_rollups(self) -> RollupIncrements:
+        with self.condition:
+            return {key: list(increment) for key, increment in self.pending_rollups.items()}
+
+    def flush(self) -> int | SQLAlchemyError:
+        '''Writes everything queued so far, after any flush already in progress.'''
+        with self.flush_lock:
+            return self._flush()
+
+    def _flush(self) -> int | SQLAlchemyError:
+        with self.condition:
+            logs = self.pending_logs
+            device_statuses = self.pending_statuses
+            rollups = self.pending_rollups
+            self.pending_logs = []
+            self.pending_statuses = {}
+            self.pending_rollups = {}
+
+        if len(logs) == 0 and len(device_statuses) == 0 and len(rollups) == 0:
+            return 0
+
+        rollup_rows = [{"deviceId": device_id, "bucketStart": bucket_start,
+                        "onSeconds": on_seconds, "wattHours": watt_hours}
+                       for (device_id, bucket_start), (on_seconds, watt_hours) in rollups.items()]
+        if self.consecutive_failures >= self.SPLIT_AFTER_FAILURES:
+            count = persist_device_switches([], device_statuses, rollup_rows)
+            if not isinstance(count, SQLAlchemyError):
+                # Statuses and rollups are written, only logs can be left to retry.
+                device_statuses, rollups = {}, {}
+                written, logs, error = self._write_logs_split(logs)
+                self.flushed_logs += written
+                count = error if error is not None else written
+        else:
+            count = persist_device_switches(logs, device_statuses, rollup_rows)
+            if not isinstance(count, SQLAlchemyError):
+                self.flushed_logs += count
+
+        if isinstance(count, SQLAlchemyError):
+            # Put the batch back in front of anything queued meanwhile, newer statuses win.
+            with self.condition:
+                self.pending_logs = logs + self.pending_logs
+                self.pending_statuses = {
+                    **device_statuses, **self.pending_statuses}
+                merge_rollups(self.pending_rollups, rollups)
+                self.failed_flushes += 1
+                self.consecutive_failures += 1
+                dropped = self._drop_oldest_logs()
+            print(
+                f"[Log Writer] Flush failed, {len(logs)} log(s) kept for retry in {self.get_retry_delay():.0f}s.")
+            if dropped > 0:
+                print(f"[Log Writer] Backlog over {self.max_pending} log(s), dropped the {dropped} oldest.")
+            return count
+
+        with self.condition:
+            self.consecutive_failures = 0
+        self.flush_count += 1
+        return count
+
+    def _write_logs_split(self, logs: List[Dict[str, Any]]) -> Tuple[int, List[Dict[str, Any]], SQLAlchemyError | None]:
+        '''
+        Writes the logs in halving chunks and returns how many were written, the logs left and
+        the error that stopped it. A single log the database rejects as invalid is dropped.
+        '''
+        written = 0
+        chunks = [logs]
+        while len(chunks) > 0:
+            chunk = chunks.pop()
+            result = persist_device_switches(chunk, {})
+            if not isinstance(result, SQLAlchemyError):
+                written += result
+            elif len(chunk) > 1:
+                # Second half pushed first so the logs are still written oldest first.
+                chunks.extend([chunk[len(chunk) // 2:], chunk[:len(chunk) // 2]])
+            elif isinstance(result, (IntegrityError, DataError)):
+                with self.condition:
+                    self.dropped_logs += 1
+                print(f"[Log Writer] Dropped a log the database rejected: {chunk[0]}")
+            else:
+                return written, [log for pending in [chunk] + chunks[::-1] for log in pending], result
+        return written, [], None
+
+    def _drop_oldest_logs(self) -> int:
+        overflow = len(self.pending_logs) - self.max_pending
+        if overflow <= 0:
+            return 0
+        del self.pending_logs[:overflow]
+        self.dropped_logs += overflow
+        return overflow
+
+    def get_retry_delay(self) -> float:
+        '''Seconds to wait before the next flush, doubling with every failure in a row.'''
+        if self.consecutive_failures == 0:
+            return 0.0
+        return min(self.flush_interval * 2 ** self.consecutive_failures, self.retry_max_seconds)
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                if self.consecutive_failures > 0:
+                    # Back off however many logs are pending, a full batch would otherwise retry at once.
+                    deadline = time.monotonic() + self.get_retry_delay()
+                    while self.is_running and time.monotonic() < deadline:
+                        self.condition.wait(deadline - time.monotonic())
+                elif self.is_running and len(self.pending_logs) < self.batch_size:
+                    self.condition.wait(self.flush_interval)
+                is_running = self.is_running
+            self.flush()
+            if not is_running:
+                return
+
+    def stop(self):
+        with self.condition:
+            self.is_running = False
+            self.condition.notify()
+        if self.worker_thread is not None and self.worker_thread.is_alive():
+            self.worker_thread.join()
+        # Drain anything queued after the worker's last flush.
+        self.flush()
+        print(f"[Log Writer] Stopped, {self.flushed_logs} log(s) written in {self.flush_count} flush(es).")
+
+    def get_stats(self):
+        return {
+            "pending_logs": len(self.pending_logs),
+            "pending_rollups": len(self.pending_rollups),
+            "flush_count": self.flush_count,
+            "flushed_logs": self.flushed_logs,
+            "failed_flushes": self.failed_flushes,
+            "dropped_logs": self.dropped_logs,
+        }
+
+
+def merge_rollups(target: RollupIncrements, increments: RollupIncrements):
+    for key, (on_seconds, watt_hours) in increments.items():
+        increment = target.setdefault(key, [0.0, 0.0])
+        increment[0] += on_seconds
+        increment[1] += watt_hours
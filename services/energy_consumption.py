@@ -1,36 +1,76 @@
+'''
+Reference implementation of the energy consumption from raw control logs, vectorized with NumPy.
+The hub serves energy from the hourly rollups (services/energy_rollup.py), this engine is only used
+by benchmarks/energy_consumption.py to time and cross-check that path, so NumPy is a dev requirement.
+'''
 from datetime import datetime
-from typing import List
-
-from helpers.data_models import DeviceControlLog
-
-
-def calculate_energy_consumption(logs: List[DeviceControlLog], end_date: datetime):
-    '''Returns Energy Consumption in watt-hours'''
-    total_energy_consumed = 0.0  # in watt-hours
-    last_on_time = None
-
-    # Iterate through logs to calculate total on-time
-    for log in logs:
-        if log.status_changed_to and not log.status_changed_from:
-            # Device was turned ON
-            last_on_time = datetime.fromisoformat(log.created_at)
-        elif log.status_changed_from and not log.status_changed_to and last_on_time:
-            # Device was turned OFF and there was a previous ON event
-            duration = datetime.fromisoformat(
-                log.created_at) - last_on_time  # timedelta
-            hours_on = duration.total_seconds() / 3600  # Convert seconds to hours
-            # Energy in watt-hours
-            energy_consumed = (
-                hours_on * log.device_wattage) if log.device_wattage is not None else 0.0
-            total_energy_consumed += energy_consumed
-            last_on_time = None  # Reset for the next on-off pair
-
-    # Handle edge case where the device was still ON at the end of the period
-    if last_on_time:
-        duration = end_date - last_on_time
-        hours_on = duration.total_seconds() / 3600
-        energy_consumed = (
-            hours_on * log.device_wattage) if log.device_wattage is not None else 0.0
-        total_energy_consumed += energy_consumed
-
-    return total_energy_consumed
+from typing import Dict
+
+import numpy as np
+
+from helpers.data_models import LogBatch
+
+from services.energy_rollup import EnergyConsumption, summarize_energy_consumption
+
+
+def calculate_device_watt_hours(device_codes: np.ndarray, timestamps: np.ndarray, status_changed_to: np.ndarray,
+                                wattages: np.ndarray, end_timestamp: float, device_count: int) -> np.ndarray:
+    '''
+    Returns watt-hours per device code from parallel log arrays in any order.
+
+    Logs are sorted by (device, time) and every device's status is replayed on its own:
+    an interval starts on a log that turns a device ON from OFF (a repeated ON keeps the
+    original start) and ends on the next log that turns it OFF, or at `end_timestamp`.
+    An interval uses the wattage of its ON log, falling back to its OFF log's, and
+    missing wattages (NaN) count as 0.
+    '''
+    watt_hours = np.zeros(device_count, dtype=np.float64)
+    if len(device_codes) == 0:
+        return watt_hours
+
+    order = np.lexsort((timestamps, device_codes))
+    devices = device_codes[order]
+    times = timestamps[order]
+    is_on = status_changed_to[order].astype(bool)
+    watts = wattages[order]
+
+    # Status before each log, a device's first log starts from OFF.
+    was_on = np.empty_like(is_on)
+    was_on[0] = False
+    was_on[1:] = is_on[:-1]
+    was_on[1:][devices[1:] != devices[:-1]] = False
+
+    # Per device the edges alternate ON, OFF, ON, ... so an ON edge's end is the next edge if it's the same device's.
+    edges = np.flatnonzero(is_on != was_on)
+    starts = edges[is_on[edges]]
+    next_edge_position = np.searchsorted(edges, starts, side="right")
+    has_off = next_edge_position < len(edges)
+    ends = edges[np.minimum(next_edge_position, len(edges) - 1)]
+    has_off &= devices[ends] == devices[starts]
+
+    start_times = times[starts]
+    end_times = np.where(has_off, times[ends], end_timestamp)
+    hours_on = np.maximum(end_times - start_times, 0.0) / 3600
+
+    interval_watts = watts[starts]
+    interval_watts = np.where(
+        np.isnan(interval_watts) & has_off, watts[ends], interval_watts)
+    interval_watt_hours = np.nan_to_num(hours_on * interval_watts)
+
+    return np.bincount(devices[starts], weights=interval_watt_hours, minlength=device_count)
+
+
+def calculate_energy_consumption(logs: LogBatch, end_date: datetime, device_rooms: Dict[str, str] | None = None) -> EnergyConsumption:
+    '''
+    Returns Energy Consumption in watt-hours per device, per room and for the house.
+    `device_rooms` maps device_id -> room_id, devices missing from it are left out of the room totals.
+    '''
+    device_codes = np.frombuffer(logs.device_codes, dtype=logs.device_codes.typecode)
+    timestamps = np.frombuffer(logs.created_at, dtype=logs.created_at.typecode) / 1_000_000
+    status_changed_to = np.frombuffer(logs.status_changed_to, dtype=logs.status_changed_to.typecode)
+    wattages = np.frombuffer(logs.device_wattages, dtype=logs.device_wattages.typecode)
+
+    device_watt_hours = calculate_device_watt_hours(
+        device_codes, timestamps, status_changed_to, wattages, end_date.timestamp(), len(logs.device_ids))
+
+    return summarize_energy_consumption(dict(zip(logs.device_ids, device_watt_hours.tolist())), device_rooms)
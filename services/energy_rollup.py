@@ -0,0 +1,157 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.actions import get_energy_rollup_totals, get_open_device_intervals
+
+
+BUCKET_SIZE = timedelta(hours=1)
+
+# (device_id, bucket_start) -> [on_seconds, watt_hours]
+RollupIncrements = Dict[Tuple[str, datetime], List[float]]
+
+
+class EnergyConsumption():
+    '''Watt-hours per device, per room and for the whole house.'''
+
+    device_watt_hours: Dict[str, float]
+    room_watt_hours: Dict[str, float]
+    total_watt_hours: float
+
+    def __init__(self, device_watt_hours: Dict[str, float], room_watt_hours: Dict[str, float], total_watt_hours: float):
+        self.device_watt_hours = device_watt_hours
+        self.room_watt_hours = room_watt_hours
+        self.total_watt_hours = total_watt_hours
+
+    def to_dict(self):
+        return {
+            "device_watt_hours": self.device_watt_hours,
+            "room_watt_hours": self.room_watt_hours,
+            "total_watt_hours": self.total_watt_hours
+        }
+
+
+def summarize_energy_consumption(device_watt_hours: Dict[str, float], device_rooms: Dict[str, str] | None = None) -> EnergyConsumption:
+    '''
+    Adds per device watt-hours up per room and for the house. `device_rooms` maps device_id -> room_id,
+    devices missing from it (e.g. deleted since) count for the house but no room.
+    '''
+    room_watt_hours: Dict[str, float] = {}
+    if device_rooms is not None:
+        for device_id, watt_hours in device_watt_hours.items():
+            room_id = device_rooms.get(device_id)
+            if room_id is not None:
+                room_watt_hours[room_id] = room_watt_hours.get(
+                    room_id, 0.0) + watt_hours
+    return EnergyConsumption(device_watt_hours, room_watt_hours, sum(device_watt_hours.values()))
+
+
+def to_utc(moment: datetime) -> datetime:
+    '''Naive datetimes are treated as UTC, the way the database returns them without a time zone.'''
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def floor_to_bucket(moment: datetime) -> datetime:
+    return to_utc(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def add_interval(increments: RollupIncrements, device_id: str, on_since: datetime, off_at: datetime, wattage: float | None):
+    '''Splits an ON interval over hourly buckets and adds its on-time and watt-hours to `increments`.'''
+    start = to_utc(on_since)
+    end = to_utc(off_at)
+    while start < end:
+        bucket_start = floor_to_bucket(start)
+        bucket_end = min(end, bucket_start + BUCKET_SIZE)
+        seconds = (bucket_end - start).total_seconds()
+        increment = increments.setdefault((device_id, bucket_start), [0.0, 0.0])
+        increment[0] += seconds
+        increment[1] += seconds / 3600 * wattage if wattage is not None else 0.0
+        start = bucket_end
+
+
+class EnergyRollup():
+    '''
+    Tracks which devices are ON and turns every completed ON interval into hourly
+    on-time/watt-hour increments, so energy for any range is a sum over buckets.
+    Intervals still open are added at query time. `load()` runs during startup.
+    '''
+
+    # device_id -> (on_since, wattage)
+    open_intervals: Dict[str, Tuple[datetime, float | None]]
+    lock: threading.Lock
+
+    def __init__(self):
+        self.open_intervals = {}
+        self.lock = threading.Lock()
+
+    def load(self) -> bool | SQLAlchemyError:
+        open_intervals = get_open_device_intervals()
+        if isinstance(open_intervals, SQLAlchemyError):
+            print("[Energy Rollup] Loading open intervals failed.")
+            return open_intervals
+        with self.lock:
+            self.open_intervals = {device_id: (to_utc(on_since), wattage)
+                                   for device_id, on_since, wattage in open_intervals}
+        return True
+
+    def record_switch(self, device_id: str, to_status: bool, wattage: float | None, at: datetime) -> RollupIncrements:
+        increments: RollupIncrements = {}
+        with self.lock:
+            if to_status:
+                # A repeated ON keeps the original start.
+                if device_id not in self.open_intervals:
+                    self.open_intervals[device_id] = (to_utc(at), wattage)
+            else:
+                open_interval = self.open_intervals.pop(device_id, None)
+                if open_interval is not None:
+                    on_since, on_wattage = open_interval
+                    add_interval(increments, device_id, on_since, at,
+                                 on_wattage if on_wattage is not None else wattage)
+        return increments
+
+    def forget_device(self, device_id: str, at: datetime) -> RollupIncrements:
+        '''Closes a deleted device's open interval at `at`, so it stops counting as ON.'''
+        increments: RollupIncrements = {}
+        with self.lock:
+            open_interval = self.open_intervals.pop(device_id, None)
+        if open_interval is not None:
+            on_since, wattage = open_interval
+            add_interval(increments, device_id, on_since, at, wattage)
+        return increments
+
+    def get_energy_consumption(self, start_date: datetime, end_date: datetime, pending: RollupIncrements | None = None) -> Dict[str, Tuple[float, float]] | SQLAlchemyError:
+        '''
+        Returns device_id -> (on_seconds, watt_hours) between the hours of `start_date` and `end_date`.
+        `pending` are increments not written to the database yet.
+        '''
+        start = floor_to_bucket(start_date)
+        end = to_utc(end_date)
+
+        totals = get_energy_rollup_totals(start, end)
+        if isinstance(totals, SQLAlchemyError):
+            return totals
+
+        consumption = {device_id: (on_seconds, watt_hours)
+                       for device_id, on_seconds, watt_hours in totals}
+
+        # Devices that are still ON count up to the end of the range.
+        open_increments: RollupIncrements = {}
+        if pending is not None:
+            for (device_id, bucket_start), increment in pending.items():
+                if start <= bucket_start < end:
+                    open_increments[(device_id, bucket_start)] = list(increment)
+        with self.lock:
+            for device_id, (on_since, wattage) in self.open_intervals.items():
+                add_interval(open_increments, device_id,
+                             max(on_since, start), end, wattage)
+        for (device_id, _), (on_seconds, watt_hours) in open_increments.items():
+            current_seconds, current_watt_hours = consumption.get(
+                device_id, (0.0, 0.0))
+            consumption[device_id] = (
+                current_seconds + on_seconds, current_watt_hours + watt_hours)
+
+        return consumption
@@ -0,0 +1,43 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, TypeVar
+
+from helpers.config import AUTH_EXECUTOR_WORKERS, DB_EXECUTOR_WORKERS
+
+
+T = TypeVar("T")
+
+
+# Bounded pool for synchronous SQLAlchemy work so a slow query never stalls the event loop.
+db_executor = ThreadPoolExecutor(
+    max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="autopi-db")
+
+# A single thread owns GPIO and the controller's house tree, which also serializes their updates.
+gpio_executor = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="autopi-gpio")
+
+# bcrypt checks get their own small pool, a burst of logins queues here instead of taking the DB workers.
+auth_executor = ThreadPoolExecutor(
+    max_workers=AUTH_EXECUTOR_WORKERS, thread_name_prefix="autopi-auth")
+
+
+async def run_db(action: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, partial(action, *args, **kwargs))
+
+
+async def run_gpio(action: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(gpio_executor, partial(action, *args, **kwargs))
+
+
+async def run_auth(action: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(auth_executor, partial(action, *args, **kwargs))
+
+
+def shutdown_executors():
+    auth_executor.shutdown(wait=True)
+    gpio_executor.shutdown(wait=True)
+    db_executor.shutdown(wait=True)
@@ -0,0 +1,74 @@
+import csv
+import io
+import uuid
+from datetime import datetime
+from typing import Iterable, Iterator, Tuple
+
+import orjson
+
+from helpers.data_models import DeviceControlLog
+from helpers.timestamps import format_timestamp
+
+
+class LogExportFormats():
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+    ALL = [NDJSON, CSV]
+
+
+MEDIA_TYPES = {
+    LogExportFormats.NDJSON: "application/x-ndjson",
+    LogExportFormats.CSV: "text/csv",
+}
+
+CSV_COLUMNS = ["device_control_log_id", "device_id", "user_id", "status_changed_from",
+               "status_changed_to", "device_wattage", "created_at", "updated_at"]
+
+# Encoded rows are sent in chunks of about this many bytes.
+CHUNK_SIZE = 64 * 1024
+
+
+def encode_logs(logs: Iterable[DeviceControlLog], format: str) -> Iterator[bytes]:
+    '''Encodes logs as NDJSON lines or CSV rows (with a header), yielding chunks of CHUNK_SIZE bytes.'''
+    if format == LogExportFormats.CSV:
+        yield from encode_csv_logs(logs)
+        return
+
+    # orjson encodes the log dataclasses straight to bytes.
+    chunk = bytearray()
+    for log in logs:
+        chunk += orjson.dumps(log, option=orjson.OPT_APPEND_NEWLINE)
+        if len(chunk) >= CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk.clear()
+
+    if len(chunk) > 0:
+        yield bytes(chunk)
+
+
+def encode_csv_logs(logs: Iterable[DeviceControlLog]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+
+    for log in logs:
+        writer.writerow([log.device_control_log_id, log.device_id, log.user_id, log.status_changed_from, log.status_changed_to,
+                         log.device_wattage, format_timestamp(log.created_at), format_timestamp(log.updated_at)])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell() > 0:
+        yield buffer.getvalue().encode("utf-8")
+
+
+def encode_cursor(log: DeviceControlLog) -> str:
+    return f"{format_timestamp(log.created_at)}|{log.device_control_log_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    '''Raises ValueError for a malformed cursor.'''
+    created_at, _, log_id = cursor.rpartition("|")
+    return datetime.fromisoformat(created_at), str(uuid.UUID(log_id))
@@ -0,0 +1,57 @@
+import asyncio
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.log_partitions import archive_old_logs, ensure_log_partitions
+
+from helpers.config import LOG_MAINTENANCE_INTERVAL_HOURS, LOG_PARTITIONING, LOG_RETENTION_MONTHS
+
+from services.executors import run_db
+
+
+class LogMaintenance():
+    '''
+    Periodic device control log upkeep on the server's event loop: creates upcoming monthly
+    partitions when partitioning is on and archives logs older than the retention.
+    Does nothing when both are disabled.
+    '''
+
+    partitioning: bool
+    retention_months: int
+    interval_seconds: float
+    worker_task: asyncio.Task | None = None
+
+    def __init__(self, partitioning: bool = LOG_PARTITIONING, retention_months: int = LOG_RETENTION_MONTHS,
+                 interval_hours: float = LOG_MAINTENANCE_INTERVAL_HOURS):
+        self.partitioning = partitioning
+        self.retention_months = retention_months
+        self.interval_seconds = interval_hours * 3600
+
+    def start(self):
+        if not self.partitioning and self.retention_months <= 0:
+            return
+        self.worker_task = asyncio.get_running_loop().create_task(self._worker())
+
+    async def stop(self):
+        if self.worker_task is not None:
+            self.worker_task.cancel()
+            await asyncio.gather(self.worker_task, return_exceptions=True)
+            self.worker_task = None
+
+    def run(self):
+        if self.partitioning:
+            created = ensure_log_partitions()
+            if not isinstance(created, SQLAlchemyError) and created > 0:
+                print(f"[Log Maintenance] Created {created} log partition(s).")
+        if self.retention_months > 0:
+            archived = archive_old_logs(self.retention_months)
+            if not isinstance(archived, SQLAlchemyError) and archived > 0:
+                print(f"[Log Maintenance] Archived {archived} log(s).")
+
+    async def _worker(self):
+        while True:
+            try:
+                await run_db(self.run)
+            except Exception as e:
+                print(f"[Log Maintenance] : Run failed. {e}")
+            await asyncio.sleep(self.interval_seconds)
@@ -0,0 +1,295 @@
+import functools
+import math
+from abc import ABC, abstractmethod
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterator, List, Tuple, TypeVar
+
+
+T = TypeVar("T")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a relay write (tens of µs) through a query to a bcrypt check (~100 ms on a Pi).
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label_value(str(value))}"' for name,
+             value in zip(label_names, label_values)]
+    if extra != "":
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric(ABC):
+    '''A metric family, one series per combination of label values.'''
+
+    type: str = "untyped"
+    name: str
+    help: str
+    label_names: Tuple[str, ...]
+    lock: threading.Lock
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.lock = threading.Lock()
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self.render_samples()
+
+    @abstractmethod
+    def render_samples(self) -> Iterator[str]:
+        ...
+
+
+class Counter(Metric):
+    '''A value that only goes up, incremented as it happens or read from a service's own count by `callback`.'''
+
+    type = "counter"
+    values: Dict[Tuple[str, ...], float]
+    callback: Callable[[], float] | None
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = (), callback: Callable[[], float] | None = None):
+        super().__init__(name, help, label_names)
+        self.values = {}
+        self.callback = callback
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        with self.lock:
+            self.values[label_values] = self.values.get(
+                label_values, 0.0) + amount
+
+    def render_samples(self) -> Iterator[str]:
+        if self.callback is not None:
+            yield f"{self.name} {format_value(self.callback())}"
+            return
+        with self.lock:
+            values = list(self.values.items())
+        for label_values, value in values:
+            yield f"{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}"
+
+
+class Gauge(Metric):
+    '''A value set as it changes, or read from `callback` when rendered.'''
+
+    type = "gauge"
+    values: Dict[Tuple[str, ...], float]
+    callback: Callable[[], float] | None
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = (), callback: Callable[[], float] | None = None):
+        super().__init__(name, help, label_names)
+        self.values = {}
+        self.callback = callback
+
+    def set(self, value: float, *label_values: str):
+        with self.lock:
+            self.values[label_values] = value
+
+    def render_samples(self) -> Iterator[str]:
+        if self.callback is not None:
+            yield f"{self.name} {format_value(self.callback())}"
+            return
+        with self.lock:
+            values = list(self.values.items())
+        for label_values, value in values:
+            yield f"{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}"
+
+
+class HistogramSeries():
+    # Per bucket counts, not cumulative, the last one is +Inf.
+    counts: List[int]
+    sum: float = 0.0
+    count: int = 0
+
+    def __init__(self, bucket_count: int):
+        self.counts = [0] * (bucket_count + 1)
+
+
+class Histogram(Metric):
+    type = "histogram"
+    buckets: Tuple[float, ...]
+    series: Dict[Tuple[str, ...], HistogramSeries]
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+
+    def observe(self, value: float, *label_values: str):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = HistogramSeries(
+                    len(self.buckets))
+            series.counts[bisect_left(self.buckets, value)] += 1
+            series.sum += value
+            series.count += 1
+
+    def time(self, *label_values: str) -> "Timer":
+        '''`with histogram.time(...):` observes the block's duration in seconds.'''
+        return Timer(self, label_values)
+
+    def render_samples(self) -> Iterator[str]:
+        with self.lock:
+            series = [(label_values, list(values.counts), values.sum, values.count)
+                      for label_values, values in self.series.items()]
+        for label_values, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(
+                    self.label_names, label_values, 'le="' + format_value(bound) + '"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            labels = format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum{labels} {format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Timer():
+    histogram: Histogram
+    label_values: Tuple[str, ...]
+    start: float = 0.0
+
+    def __init__(self, histogram: Histogram, label_values: Tuple[str, ...]):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() -
+                               self.start, *self.label_values)
+
+
+class MetricsRegistry():
+    '''
+    In-process metrics rendered in the Prometheus text format at /metrics. Recording is a lock
+    and a dictionary update, a few µs, so the metrics stay on in production.
+    '''
+
+    metrics: Dict[str, Metric]
+    lock: threading.Lock
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Any:
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(
+                    f"Metric '{metric.name}' is already registered.")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label_names: Tuple[str, ...] = (), callback: Callable[[], float] | None = None) -> Counter:
+        return self.register(Counter(name, help, label_names, callback))
+
+    def gauge(self, name: str, help: str, label_names: Tuple[str, ...] = (), callback: Callable[[], float] | None = None) -> Gauge:
+        return self.register(Gauge(name, help, label_names, callback))
+
+    def histogram(self, name: str, help: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, label_names, buckets))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+# Metrics of the hot paths, recorded where they happen.
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "autopi_http_request_duration_seconds", "HTTP request latency until the response is sent, by route template.",
+    ("method", "route", "status"))
+DEVICE_SWITCHES = registry.counter(
+    "autopi_device_switches_total", "Devices switched by the controller, by result.", ("result",))
+DEVICE_SWITCH_SECONDS = registry.histogram(
+    "autopi_device_switch_duration_seconds", "ControllerDevice.switch_device duration.")
+GPIO_WRITE_SECONDS = registry.histogram(
+    "autopi_gpio_write_duration_seconds", "Relay output on()/off() duration.", ("action",))
+DB_ACTION_SECONDS = registry.histogram(
+    "autopi_db_action_duration_seconds", "database.actions function duration, including the transaction.", ("action",))
+DB_ACTION_ERRORS = registry.counter(
+    "autopi_db_action_errors_total", "database.actions calls that failed with an SQLAlchemyError.", ("action",))
+PASSWORD_CHECK_SECONDS = registry.histogram(
+    "autopi_password_check_duration_seconds", "bcrypt house password check duration.")
+SOCKET_FANOUT_SECONDS = registry.histogram(
+    "autopi_socket_broadcast_fanout_seconds", "Time to queue one broadcast for every websocket client.")
+SOCKET_BROADCASTS = registry.counter(
+    "autopi_socket_broadcasts_total", "Broadcasts dispatched to the websocket clients.")
+SCHEDULE_LAG_SECONDS = registry.histogram(
+    "autopi_schedule_lag_seconds", "How late scheduled transitions were switched.")
+
+
+def timed(histogram: Histogram, *label_values: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    '''Decorator observing every call's duration, raising or not.'''
+    def decorator(function: Callable[..., T]) -> Callable[..., T]:
+        @functools.wraps(function)
+        def timed_function(*args: Any, **kwargs: Any) -> T:
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, *label_values)
+        return timed_function
+    return decorator
+
+
+class MetricsMiddleware():
+    '''
+    ASGI middleware recording HTTP request latency per (method, route template, status).
+    Requests answered before routing, e.g. by StartupGate, are recorded as route "unrouted".
+    '''
+
+    def __init__(self, app, histogram: Histogram = HTTP_REQUEST_SECONDS):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # FastAPI puts the matched route in the scope.
+            route = scope.get("route")
+            self.histogram.observe(time.perf_counter() - start, scope["method"],
+                                   getattr(route, "path", "unrouted"), str(status_code))
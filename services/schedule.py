@@ -1,106 +1,238 @@
-import json
+import asyncio
+import heapq
 import threading
+import time
 from datetime import datetime
-from typing import Any, List
-import asyncio
-
-from database.actions import switch_device
+from typing import Any, Dict, List, Tuple
 
 from helpers.data_models import Device
 
-from services.scheduled_device import get_scheduled_device_status
-from services.socket import SocketEvents, SocketManager
+from services.device_log_writer import DeviceLogWriter
+from services.executors import run_gpio
+from services.metrics import SCHEDULE_LAG_SECONDS
+from services.scheduled_device import DeviceSchedule, evaluate_schedules, parse_schedule
+from services.socket import SocketEvents, SocketManager, SocketMessage
+
+
+# Longest single sleep, after which the wall clock is checked for jumps (e.g. NTP sync after boot).
+MAX_SLEEP_SECONDS = 300
+CLOCK_JUMP_TOLERANCE_SECONDS = 2
 
 
 class ScheduleDeviceAssistant():
-    scheduled_devices: List[Device] = []
+    '''
+    Switches scheduled devices from a heap of their next ON/OFF transitions.
+
+    The worker runs as a task on the server's event loop and sleeps until the earliest
+    transition. Scheduling or removing a device is O(log n): stale heap entries are
+    skipped using a per-device generation instead of being searched for.
+    '''
+
+    scheduled_devices: Dict[str, Device]
+    schedules: Dict[str, DeviceSchedule]
     controller_device: Any
     socket_manager: SocketManager
+    device_log_writer: DeviceLogWriter
+
+    # (timestamp, sequence, device_id, generation), sequence keeps equal timestamps ordered.
+    transitions: List[Tuple[float, int, str, int]]
+    generations: Dict[str, int]
+    sequence: int = 0
+    lock: threading.Lock
+
+    loop: asyncio.AbstractEventLoop | None = None
+    wake_event: asyncio.Event | None = None
+    worker_task: asyncio.Task | None = None
 
-    stop_event: threading.Event
-    worker_thread: threading.Thread | None = None
+    # Lateness of fired transitions in milliseconds.
+    jitter_count: int = 0
+    jitter_total_ms: float = 0.0
+    jitter_max_ms: float = 0.0
+    jitter_last_ms: float = 0.0
 
-    def __init__(self, controller_device: Any, socket_manager: SocketManager):
-        scheduled_devices = controller_device.get_scheduled_devices()
-        scheduled_devices = scheduled_devices if scheduled_devices is not None else []
-        self.scheduled_devices = scheduled_devices
+    def __init__(self, controller_device: Any, socket_manager: SocketManager, device_log_writer: DeviceLogWriter):
         self.controller_device = controller_device
         self.socket_manager = socket_manager
-        self.stop_event = threading.Event()
-
-    def start_scheduled_devices_watch(self):
-        # Stop the current worker thread if it is running
-        if self.worker_thread is not None and self.worker_thread.is_alive():
-            self.stop_event.set()
-            self.worker_thread.join()
-
-        # Clear the stop event for the new worker thread
-        self.stop_event.clear()
-
-        # Start a new worker thread
-        self.worker_thread = threading.Thread(
-            target=self._scheduled_devices_worker)
-        self.worker_thread.daemon = True
-        self.worker_thread.start()
-
-    def _scheduled_devices_worker(self):
-        asyncio.run(self._scheduled_devices_worker_async())
-
-    async def _scheduled_devices_worker_async(self):
-        while not self.stop_event.is_set():
-            await self.switch_scheduled_devices()
-            # Wait for 60 seconds or until stop_event is set
-            if not self.stop_event.wait(60):
-                await asyncio.sleep(0)
-
-    async def switch_scheduled_devices(self):
-        today = datetime.now().strftime("%a")
-        for device in self.scheduled_devices:
-            if today.lower() in device.days_scheduled.lower() if device.days_scheduled is not None else "":
-                is_on = get_scheduled_device_status(
-                    device.start_time if device.start_time is not None else "",
-                    device.off_time if device.off_time is not None else "")
-                if is_on != device.status:
-                    device.status = is_on
-                    try:
-                        self.controller_device.switch_device(
-                            device.device_id, is_on)
-                        broadcast_data = {
-                            "event": SocketEvents.SCHEDULED_SWITCH_DEVICE,
-                            "user_id": f"{device.scheduled_by}|-|Schedule Assistant",
-                            "message": f"Schedule Assistant turned {'on' if is_on else 'off'} {device.device_name}.",
-                            "data": {"deviceId": device.device_id, "state": is_on}
-                        }
-                        await self.socket_manager.broadcast(json.dumps(broadcast_data))
-                        switch_device(device.device_id, device.status, is_on,
-                                      f"{device.scheduled_by}|-|Schedule Assistant")
-                    except Exception as e:
-                        print(
-                            f"[Schedule Assistant] : Switch scheduled device failed. {e}")
+        self.device_log_writer = device_log_writer
+        self.scheduled_devices = {}
+        self.schedules = {}
+        self.transitions = []
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        '''Reads the scheduled devices from the controller, once it has loaded the house.'''
+        scheduled_devices = self.controller_device.get_scheduled_devices()
+        with self.lock:
+            for device in scheduled_devices if scheduled_devices is not None else []:
+                schedule = self.parse_device_schedule(device)
+                if schedule is not None:
+                    self.scheduled_devices[device.device_id] = device
+                    self.schedules[device.device_id] = schedule
+
+    def start(self):
+        '''Starts the worker on the running event loop, called from the app lifespan.'''
+        self.loop = asyncio.get_running_loop()
+        self.wake_event = asyncio.Event()
+        self.resync()
+        self.worker_task = self.loop.create_task(self._worker())
+
+    async def stop(self):
+        if self.worker_task is not None:
+            self.worker_task.cancel()
+            await asyncio.gather(self.worker_task, return_exceptions=True)
+            self.worker_task = None
+
+    def resync(self):
+        '''Re-evaluates every scheduled device now, used at start and after the clock jumps.'''
+        with self.lock:
+            self.transitions = []
+            for device_id in self.scheduled_devices:
+                self._push(device_id, time.time())
+        self._wake()
+
+    def parse_device_schedule(self, device: Device) -> DeviceSchedule | None:
+        try:
+            return parse_schedule(device.days_scheduled if device.days_scheduled is not None else "",
+                                  device.start_time if device.start_time is not None else "",
+                                  device.off_time if device.off_time is not None else "")
+        except ValueError as e:
+            print(
+                f"[Schedule Assistant] : Invalid schedule for {device.device_name}. {e}")
+            return None
 
     def schedule_device(self, device: Device):
-        self.remove_scheduled_device(device.device_id)
-        self.scheduled_devices.append(device)
-        # Restart the watch only if the worker thread is not already running
-        if self.worker_thread is None or not self.worker_thread.is_alive():
-            self.start_scheduled_devices_watch()
+        schedule = self.parse_device_schedule(device)
+        if schedule is None:
+            self.remove_scheduled_device(device.device_id)
+            return
+        with self.lock:
+            self.scheduled_devices[device.device_id] = device
+            self.schedules[device.device_id] = schedule
+            # Drop any transition queued for the previous schedule.
+            self.generations[device.device_id] = self.generations.get(
+                device.device_id, 0) + 1
+            # Evaluate right away, the worker then queues the device's next transition.
+            self._push(device.device_id, time.time())
+        self._wake()
 
     def get_scheduled_device(self, device_id: str):
-        for device in self.scheduled_devices:
-            if device.device_id == device_id:
-                return device
+        return self.scheduled_devices.get(device_id)
 
     def remove_scheduled_device(self, device_id: str):
-        device = self.get_scheduled_device(device_id)
-        if device is not None:
-            self.scheduled_devices.remove(device)
-            # Restart the watch only if there are scheduled devices left
-            if len(self.scheduled_devices) > 0:
-                self.start_scheduled_devices_watch()
-            else:
-                self.stop_scheduled_devices_watch()
-
-    def stop_scheduled_devices_watch(self):
-        if self.worker_thread is not None and self.worker_thread.is_alive():
-            self.stop_event.set()
-            self.worker_thread.join()
+        with self.lock:
+            self.schedules.pop(device_id, None)
+            if self.scheduled_devices.pop(device_id, None) is not None:
+                # Invalidates the device's queued transition.
+                self.generations[device_id] = self.generations.get(
+                    device_id, 0) + 1
+
+    def _push(self, device_id: str, timestamp: float):
+        self.sequence += 1
+        heapq.heappush(self.transitions, (timestamp, self.sequence,
+                       device_id, self.generations.get(device_id, 0)))
+
+    def _wake(self):
+        if self.loop is None or self.wake_event is None:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.wake_event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.wake_event.set)
+
+    def _pop_due(self, now: float) -> Tuple[List[Tuple[float, Device, DeviceSchedule, int]], float | None]:
+        '''Returns the devices due at `now` and when the next transition is.'''
+        due: List[Tuple[float, Device, DeviceSchedule, int]] = []
+        with self.lock:
+            while len(self.transitions) > 0:
+                timestamp, _, device_id, generation = self.transitions[0]
+                device = self.scheduled_devices.get(device_id)
+                if device is None or generation != self.generations.get(device_id, 0):
+                    heapq.heappop(self.transitions)
+                    continue
+                if timestamp > now:
+                    return due, timestamp
+                heapq.heappop(self.transitions)
+                due.append(
+                    (timestamp, device, self.schedules[device_id], generation))
+        return due, None
+
+    async def _worker(self):
+        wake_event = self.wake_event
+        if wake_event is None:
+            return
+        while True:
+            due, next_timestamp = self._pop_due(time.time())
+
+            # All due devices are evaluated against one clock read.
+            states = evaluate_schedules(
+                {device.device_id: schedule for _, device, schedule, _ in due})
+            for timestamp, device, _, generation in due:
+                is_on, next_transition = states[device.device_id]
+                await self.switch_scheduled_device(device, is_on, next_transition, timestamp, generation)
+
+            if len(due) > 0:
+                continue
+
+            timeout = MAX_SLEEP_SECONDS if next_timestamp is None else min(
+                MAX_SLEEP_SECONDS, max(0.0, next_timestamp - time.time()))
+            wall_start, monotonic_start = time.time(), time.monotonic()
+            wake_event.clear()
+            try:
+                await asyncio.wait_for(wake_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            clock_drift = (time.time() - wall_start) - \
+                (time.monotonic() - monotonic_start)
+            if abs(clock_drift) > CLOCK_JUMP_TOLERANCE_SECONDS:
+                print(
+                    f"[Schedule Assistant] : System clock moved by {clock_drift:.0f}s, rescheduling.")
+                self.resync()
+
+    async def switch_scheduled_device(self, device: Device, is_on: bool, next_transition: datetime | None, due_timestamp: float, generation: int):
+        with self.lock:
+            # Skip if the device was rescheduled or removed since this transition was queued.
+            if self.generations.get(device.device_id, 0) == generation and next_transition is not None:
+                self._push(device.device_id, next_transition.timestamp())
+
+        if is_on == device.status:
+            return
+
+        self.record_jitter(due_timestamp)
+        previous_status = device.status
+        try:
+            # Updates device.status and the controller's house snapshot.
+            await run_gpio(self.controller_device.switch_device, device.device_id, is_on)
+            broadcast_data = SocketMessage(
+                event=SocketEvents.SCHEDULED_SWITCH_DEVICE,
+                user_id=f"{device.scheduled_by}|-|Schedule Assistant",
+                message=f"Schedule Assistant turned {'on' if is_on else 'off'} {device.device_name}.",
+                data={"deviceId": device.device_id, "state": is_on}
+            )
+            await self.socket_manager.broadcast(broadcast_data)
+            self.device_log_writer.log_switch(device.device_id, previous_status, is_on,
+                                              f"{device.scheduled_by}|-|Schedule Assistant", device.wattage)
+        except Exception as e:
+            device.status = is_on
+            print(
+                f"[Schedule Assistant] : Switch scheduled device failed. {e}")
+
+    def record_jitter(self, due_timestamp: float):
+        lateness_ms = max(0.0, (time.time() - due_timestamp) * 1000)
+        SCHEDULE_LAG_SECONDS.observe(lateness_ms / 1000)
+        self.jitter_count += 1
+        self.jitter_total_ms += lateness_ms
+        self.jitter_max_ms = max(self.jitter_max_ms, lateness_ms)
+        self.jitter_last_ms = lateness_ms
+
+    def get_jitter_stats(self):
+        return {
+            "transitions": self.jitter_count,
+            "mean_ms": self.jitter_total_ms / self.jitter_count if self.jitter_count > 0 else 0.0,
+            "max_ms": self.jitter_max_ms,
+            "last_ms": self.jitter_last_ms,
+        }
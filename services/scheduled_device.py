@@ -1,17 +1,190 @@
-from datetime import datetime
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
 
+from helpers.config import HOUSE_LATITUDE, HOUSE_LONGITUDE
+from helpers.solar import get_sun_times
+
+
+SECONDS_PER_DAY = 86400
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+
+WEEK_DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+ALL_DAYS = ",".join(WEEK_DAYS)
+
+SUNRISE = "sunrise"
+SUNSET = "sunset"
+
+# Used for sunrise/sunset schedules when the house location is not configured.
+DEFAULT_SUN_TIMES = {SUNRISE: 6 * 3600, SUNSET: 18 * 3600}
+
+
+class TimeSpec():
+    '''A time of day, either fixed or relative to sunrise/sunset, e.g. "07:30", "07:30:15", "sunset-20".'''
+
+    seconds: int
+    anchor: str | None = None
+
+    def __init__(self, seconds: int, anchor: str | None = None):
+        self.seconds = seconds
+        self.anchor = anchor
+
+    def resolve(self, day: datetime) -> int:
+        '''Seconds after midnight of `day`.'''
+        if self.anchor is None:
+            return self.seconds
+        return get_sun_seconds(day, self.anchor) + self.seconds
+
+
+def parse_time_spec(value: str) -> TimeSpec:
+    value = value.strip().lower()
+    for anchor in (SUNRISE, SUNSET):
+        if value.startswith(anchor):
+            offset = value[len(anchor):].strip()
+            # Offsets are in minutes
+            return TimeSpec(int(offset) * 60 if offset != "" else 0, anchor)
+
+    parts = [int(part) for part in value.split(":")]
+    if len(parts) not in (2, 3):
+        raise ValueError(f"Invalid time '{value}'.")
+    hour, minute, second = parts[0], parts[1], parts[2] if len(parts) == 3 else 0
+    if not (0 <= hour < 24 and 0 <= minute < 60 and 0 <= second < 60):
+        raise ValueError(f"Invalid time '{value}'.")
+    return TimeSpec(hour * 3600 + minute * 60 + second)
+
+
+_sun_seconds_cache: Dict[Tuple[str, str], int] = {}
+
+
+def get_sun_seconds(day: datetime, anchor: str) -> int:
+    key = (day.strftime("%Y-%m-%d"), anchor)
+    seconds = _sun_seconds_cache.get(key)
+    if seconds is not None:
+        return seconds
+
+    seconds = DEFAULT_SUN_TIMES[anchor]
+    if HOUSE_LATITUDE is not None and HOUSE_LONGITUDE is not None:
+        sun_times = get_sun_times(day.date(), HOUSE_LATITUDE, HOUSE_LONGITUDE)
+        if sun_times is not None:
+            local = (sun_times[0] if anchor == SUNRISE else sun_times[1]).astimezone().replace(
+                tzinfo=None)
+            seconds = int((local - day.replace(hour=0, minute=0,
+                          second=0, microsecond=0)).total_seconds())
+
+    if len(_sun_seconds_cache) > 1024:
+        _sun_seconds_cache.clear()
+    _sun_seconds_cache[key] = seconds
+    return seconds
 
-def get_scheduled_device_status(start_time: str, off_time: str) -> bool:
-    current = datetime.now()
-    current_time = current.hour * 60 + current.minute
 
-    start_hour, start_minute = map(int, start_time.split(":"))
-    off_hour, off_minute = map(int, off_time.split(":"))
+class DeviceSchedule():
+    '''
+    A device schedule parsed once from its days_scheduled/start_time/off_time strings.
 
-    start_total_minutes = start_hour * 60 + start_minute
-    off_total_minutes = off_hour * 60 + off_minute
+    start_time and off_time may list several comma separated times, paired in order,
+    for several intervals a day. Each week resolves to sorted, merged ON intervals in
+    integer seconds from Monday 00:00, an interval may run into the next day.
+    '''
 
-    if start_total_minutes <= off_total_minutes:
-        return start_total_minutes <= current_time <= off_total_minutes
-    # Handle overnight case
-    return current_time >= start_total_minutes or current_time <= off_total_minutes
+    day_mask: List[bool]
+    intervals: List[Tuple[TimeSpec, TimeSpec]]
+    is_fixed: bool
+    week_cache: Dict[datetime, List[Tuple[int, int]]]
+
+    def __init__(self, day_mask: List[bool], intervals: List[Tuple[TimeSpec, TimeSpec]]):
+        self.day_mask = day_mask
+        self.intervals = intervals
+        self.is_fixed = all(start.anchor is None and off.anchor is None
+                            for start, off in intervals)
+        self.week_cache = {}
+
+    def get_week_intervals(self, week_start: datetime) -> List[Tuple[int, int]]:
+        cached = self.week_cache.get(week_start)
+        if cached is not None:
+            return cached
+
+        intervals: List[Tuple[int, int]] = []
+        for day_index in range(7):
+            if not self.day_mask[day_index]:
+                continue
+            day = week_start + timedelta(days=day_index)
+            day_offset = day_index * SECONDS_PER_DAY
+            for start_spec, off_spec in self.intervals:
+                start = start_spec.resolve(day)
+                off = off_spec.resolve(day)
+                if off <= start:
+                    # Overnight interval
+                    off += SECONDS_PER_DAY
+                intervals.append((day_offset + start, day_offset + off))
+
+        merged = merge_intervals(intervals)
+        # Fixed schedules are the same every week, sunrise/sunset ones only need the current weeks.
+        if len(self.week_cache) > 4:
+            self.week_cache.clear()
+        self.week_cache[week_start] = merged
+        return merged
+
+    def get_state(self, now: datetime) -> Tuple[bool, datetime | None]:
+        '''Returns whether the device should be on at `now` and when that next changes, None if it never does.'''
+        week_start = (now - timedelta(days=now.weekday())
+                      ).replace(hour=0, minute=0, second=0, microsecond=0)
+        key = datetime.min if self.is_fixed else week_start
+
+        # Last week's intervals can run into this week, next week's bound the next transition.
+        intervals: List[Tuple[int, int]] = []
+        for week_offset in (-1, 0, 1):
+            week_key = key if self.is_fixed else week_start + \
+                timedelta(weeks=week_offset)
+            shift = week_offset * SECONDS_PER_WEEK
+            intervals.extend((start + shift, off + shift)
+                             for start, off in self.get_week_intervals(week_key))
+        intervals = merge_intervals(intervals)
+
+        seconds = (now - week_start).total_seconds()
+        index = bisect_right(intervals, (seconds, float("inf"))) - 1
+        if index >= 0 and intervals[index][0] <= seconds < intervals[index][1]:
+            is_on, edge = True, intervals[index][1]
+        elif index + 1 < len(intervals):
+            is_on, edge = False, intervals[index + 1][0]
+        else:
+            return False, None
+
+        # Spans the whole horizon, e.g. a 24 hour schedule on every day.
+        if is_on and edge >= 2 * SECONDS_PER_WEEK:
+            return True, None
+        return is_on, week_start + timedelta(seconds=edge)
+
+
+def merge_intervals(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, off in sorted(intervals):
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], off))
+        else:
+            merged.append((start, off))
+    return merged
+
+
+def parse_schedule(days_scheduled: str, start_time: str, off_time: str) -> DeviceSchedule:
+    '''Raises ValueError for a malformed schedule.'''
+    days = days_scheduled.lower()
+    day_mask = [day in days for day in WEEK_DAYS]
+
+    start_specs = [parse_time_spec(value)
+                   for value in start_time.split(",") if value.strip() != ""]
+    off_specs = [parse_time_spec(value)
+                 for value in off_time.split(",") if value.strip() != ""]
+    if len(start_specs) != len(off_specs):
+        raise ValueError("start_time and off_time must list the same number of times.")
+
+    return DeviceSchedule(day_mask, list(zip(start_specs, off_specs)))
+
+
+def evaluate_schedules(schedules: Dict[str, DeviceSchedule], now: datetime | None = None) -> Dict[str, Tuple[bool, datetime | None]]:
+    '''Evaluates every schedule against a single clock read.'''
+    now = now if now is not None else datetime.now()
+    return {device_id: schedule.get_state(now) for device_id, schedule in schedules.items()}
+
+
+def get_scheduled_device_status(start_time: str, off_time: str) -> bool:
+    return parse_schedule(ALL_DAYS, start_time, off_time).get_state(datetime.now())[0]
@@ -0,0 +1,238 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs
+
+from helpers.config import SESSION_REQUIRED, SESSION_SECRET, SESSION_TTL_HOURS
+from helpers.request_models import ResponseStatusCodes
+from helpers.responses import encode_envelope
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class Session():
+    user_id: str
+    session_id: str
+    issued_at: int
+    expires_at: int
+
+    def __init__(self, user_id: str, session_id: str, issued_at: int, expires_at: int):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.issued_at = issued_at
+        self.expires_at = expires_at
+
+
+class SessionManager():
+    '''
+    Issues and verifies session tokens, so the password is checked with bcrypt once per login
+    instead of identifying every request by a bare userId.
+
+    A token is `<payload>.<signature>`: base64url JSON {"u": user_id, "s": session_id,
+    "i": issued_at, "e": expires_at} signed with HMAC-SHA256. Verifying is a signature
+    comparison and two dictionary lookups. Revoked sessions and users are kept in memory
+    until the tokens they cover expire. Without AUTOPI_SESSION_SECRET the key is random per
+    process, so a restart ends every session along with the revocations.
+    '''
+
+    secret: bytes
+    ttl_seconds: int
+
+    # session_id -> expires_at, user_id -> tokens issued up to this second are revoked.
+    revoked_sessions: Dict[str, int]
+    revoked_users: Dict[str, int]
+    lock: threading.Lock
+
+    issued: int = 0
+    verified: int = 0
+    rejected: int = 0
+
+    def __init__(self, secret: str | None = SESSION_SECRET, ttl_hours: float = SESSION_TTL_HOURS):
+        self.secret = secret.encode(
+            "utf-8") if secret is not None else os.urandom(32)
+        self.ttl_seconds = int(ttl_hours * 3600)
+        self.revoked_sessions = {}
+        self.revoked_users = {}
+        self.lock = threading.Lock()
+
+    def sign(self, payload: str) -> str:
+        return b64encode(hmac.new(self.secret, payload.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, user_id: str) -> Tuple[str, Session]:
+        now = int(time.time())
+        session = Session(user_id, b64encode(os.urandom(12)),
+                          now, now + self.ttl_seconds)
+        payload = b64encode(json.dumps({"u": session.user_id, "s": session.session_id, "i": session.issued_at,
+                                        "e": session.expires_at}, separators=(",", ":")).encode("utf-8"))
+        self.issued += 1
+        return f"{payload}.{self.sign(payload)}", session
+
+    def verify(self, token: str) -> Session | None:
+        '''Returns the token's session, or None if it is malformed, forged, expired or revoked.'''
+        session = self.decode(token)
+        if session is None or session.expires_at <= time.time() or session.session_id in self.revoked_sessions or \
+                session.issued_at <= self.revoked_users.get(session.user_id, -1):
+            self.rejected += 1
+            return None
+        self.verified += 1
+        return session
+
+    def decode(self, token: str) -> Session | None:
+        # Tokens are base64url, anything else can't be signed or compared and is rejected as malformed.
+        if not token.isascii():
+            return None
+        payload, _, signature = token.partition(".")
+        if not hmac.compare_digest(self.sign(payload), signature):
+            return None
+        try:
+            claims = json.loads(b64decode(payload))
+            return Session(claims["u"], claims["s"], claims["i"], claims["e"])
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            return None
+
+    def revoke(self, session: Session):
+        with self.lock:
+            self.prune()
+            self.revoked_sessions[session.session_id] = session.expires_at
+
+    def revoke_user(self, user_id: str):
+        '''Ends every session issued to `user_id` so far, e.g. when the member is removed.'''
+        with self.lock:
+            self.prune()
+            # Tokens are stamped in whole seconds, so one issued in this same second is revoked too.
+            self.revoked_users[user_id] = int(time.time())
+
+    def prune(self):
+        now = time.time()
+        self.revoked_sessions = {session_id: expires_at for session_id, expires_at in self.revoked_sessions.items()
+                                 if expires_at > now}
+        self.revoked_users = {user_id: revoked_at for user_id, revoked_at in self.revoked_users.items()
+                              if revoked_at + self.ttl_seconds > now}
+
+    def get_stats(self):
+        return {
+            "issued": self.issued,
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "revoked_sessions": len(self.revoked_sessions),
+            "revoked_users": len(self.revoked_users),
+        }
+
+
+def get_scope_token(scope) -> str | None:
+    '''Bearer token from the Authorization header, or the `token` query parameter (websockets can't set headers).'''
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token != "":
+                return token.strip()
+    tokens = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("token")
+    return tokens[0] if tokens else None
+
+
+def get_scope_user_ids(scope) -> List[str]:
+    '''User IDs a request names outside its body: the userId query parameter and the websocket path.'''
+    user_ids = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("userId", [])
+    if scope["type"] == "websocket" and scope["path"].startswith("/ws/"):
+        user_ids.append(scope["path"][len("/ws/"):])
+    return user_ids
+
+
+class SessionGate():
+    '''
+    ASGI middleware that checks session tokens. A request with a token is rejected with 401 if
+    the token isn't valid, and with 403 if it names a different userId (query string, websocket
+    path or JSON body) than the token's. The session is put in scope["state"]["session"].
+    With AUTOPI_SESSION_REQUIRED, requests outside `open_paths` need a token.
+    '''
+
+    def __init__(self, app, session_manager: SessionManager, required: bool = SESSION_REQUIRED,
+                 open_paths=("/house-login", "/ready", "/metrics", "/docs", "/openapi.json")):
+        self.app = app
+        self.session_manager = session_manager
+        self.required = required
+        self.open_paths = set(open_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        token = get_scope_token(scope)
+        if token is None:
+            if self.required and scope["path"] not in self.open_paths:
+                await self.reject(scope, send, 401, "Please log in to the house.")
+                return
+            await self.app(scope, receive, send)
+            return
+
+        session = self.session_manager.verify(token)
+        if session is None:
+            await self.reject(scope, send, 401, "Session is invalid or expired, please log in again.")
+            return
+
+        user_ids = get_scope_user_ids(scope)
+        if scope["type"] == "http" and scope["method"] in ("POST", "PUT", "PATCH", "DELETE"):
+            body, receive = await read_body(receive)
+            user_ids.extend(get_body_user_ids(body))
+        if any(user_id != session.user_id for user_id in user_ids):
+            await self.reject(scope, send, 403, "Session belongs to a different user.")
+            return
+
+        scope.setdefault("state", {})["session"] = session
+        await self.app(scope, receive, send)
+
+    async def reject(self, scope, send, status_code: int, message: str):
+        if scope["type"] == "websocket":
+            # 1008, policy violation.
+            await send({"type": "websocket.close", "code": 1008})
+            return
+        body = encode_envelope("error", ResponseStatusCodes.INVALID_SESSION, message)
+        await send({"type": "http.response.start", "status": status_code, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+async def read_body(receive):
+    '''Reads the whole request body and returns it with a receive callable that replays it.'''
+    chunks: List[bytes] = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    body = b"".join(chunks)
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+    return body, replay
+
+
+def get_body_user_ids(body: bytes) -> List[str]:
+    if len(body) == 0:
+        return []
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return []
+    user_id = data.get("userId") if isinstance(data, dict) else None
+    return [user_id] if isinstance(user_id, str) else []
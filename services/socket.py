@@ -1,24 +1,250 @@
+import asyncio
+import time
+from datetime import datetime
 from fastapi import WebSocket
-from typing import List
+from typing import Any, Dict, List
+
+import orjson
+
+try:
+    import msgpack  # type: ignore
+except ImportError:  # Optional, clients asking for msgpack fall back to compact JSON.
+    msgpack = None
+
+from helpers.config import SOCKET_CLIENT_QUEUE_SIZE, SOCKET_SLOW_CONSUMER_POLICY, SOCKET_SEND_TIMEOUT_SECONDS
+from helpers.timestamps import format_timestamp
+from services.metrics import SOCKET_BROADCASTS, SOCKET_FANOUT_SECONDS
+
+
+class SlowConsumerPolicy():
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEWEST = "drop_newest"
+    DISCONNECT = "disconnect"
+
+
+class SocketEncodings():
+    JSON = "json"  # {"event", "user_id", "message", "data"} text frames
+    COMPACT = "compact"  # {"e", "u", "m", "d"} text frames without whitespace
+    MSGPACK = "msgpack"  # {"e", "u", "m", "d"} binary frames
+
+    ALL = [JSON, COMPACT, MSGPACK]
+
+
+def encode_msgpack_value(value: Any):
+    '''msgpack fallback for data models and timestamps, sent in the same form as in JSON frames.'''
+    if isinstance(value, datetime):
+        return format_timestamp(value)
+    return value.to_dict()
+
+
+class SocketMessage():
+    '''A broadcast event, encoded at most once per wire format and shared by every client.'''
+
+    event: str
+    user_id: str
+    message: str
+    data: Any
+    encoded: Dict[str, str | bytes]
+
+    def __init__(self, event: str, user_id: str, message: str, data: Any = None):
+        self.event = event
+        self.user_id = user_id
+        self.message = message
+        self.data = data
+        self.encoded = {}
+
+    def encode(self, encoding: str) -> str | bytes:
+        frame = self.encoded.get(encoding)
+        if frame is None:
+            # data may hold helpers.data_models dataclasses, orjson encodes them directly.
+            if encoding == SocketEncodings.COMPACT:
+                frame = orjson.dumps(self.to_compact_dict()).decode("utf-8")
+            elif encoding == SocketEncodings.MSGPACK and msgpack is not None:
+                frame = msgpack.packb(self.to_compact_dict(),
+                                      default=encode_msgpack_value)
+            else:
+                frame = orjson.dumps(self.to_dict()).decode("utf-8")
+            self.encoded[encoding] = frame
+        return frame
+
+    def to_dict(self):
+        return {
+            "event": self.event,
+            "user_id": self.user_id,
+            "message": self.message,
+            "data": self.data
+        }
+
+    def to_compact_dict(self):
+        return {
+            "e": self.event,
+            "u": self.user_id,
+            "m": self.message,
+            "d": self.data
+        }
+
+
+class SocketClient():
+    '''A connected websocket with its own bounded outbound queue drained by a writer task.'''
+
+    websocket: WebSocket
+    encoding: str
+    queue: asyncio.Queue
+    writer_task: asyncio.Task | None = None
+    dropped_messages: int = 0
+
+    def __init__(self, websocket: WebSocket, queue_size: int, encoding: str):
+        self.websocket = websocket
+        self.encoding = encoding
+        self.queue = asyncio.Queue(maxsize=queue_size)
 
 
 class SocketManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    '''
+    Broadcasts are put on a single outbox and return immediately, a dispatcher task
+    copies each message to every client's queue and per-client writer tasks send them
+    concurrently. A client that fails or times out on send is evicted.
+    '''
+
+    def __init__(self, queue_size: int = SOCKET_CLIENT_QUEUE_SIZE, slow_consumer_policy: str = SOCKET_SLOW_CONSUMER_POLICY,
+                 send_timeout: float = SOCKET_SEND_TIMEOUT_SECONDS):
+        self.clients: Dict[WebSocket, SocketClient] = {}
+        self.queue_size = queue_size
+        self.slow_consumer_policy = slow_consumer_policy
+        self.send_timeout = send_timeout
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.outbox: asyncio.Queue | None = None
+        self.dispatcher_task: asyncio.Task | None = None
+        self.evicted_clients = 0
+
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.clients.keys())
+
+    def start(self):
+        '''Binds the manager to the running event loop, called from the app lifespan or the first connect.'''
+        if self.dispatcher_task is not None and not self.dispatcher_task.done():
+            return
+        self.loop = asyncio.get_running_loop()
+        self.outbox = asyncio.Queue()
+        self.dispatcher_task = self.loop.create_task(self._dispatcher())
+
+    async def stop(self):
+        tasks = [client.writer_task for client in self.clients.values()
+                 if client.writer_task is not None]
+        if self.dispatcher_task is not None:
+            tasks.append(self.dispatcher_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.clients.clear()
+        self.dispatcher_task = None
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, encoding: str = SocketEncodings.JSON):
+        self.start()
         await websocket.accept()
-        self.active_connections.append(websocket)
+        if encoding not in SocketEncodings.ALL:
+            encoding = SocketEncodings.JSON
+        if encoding == SocketEncodings.MSGPACK and msgpack is None:
+            print("[Socket] msgpack is not installed, using compact JSON.")
+            encoding = SocketEncodings.COMPACT
+        client = SocketClient(websocket, self.queue_size, encoding)
+        client.writer_task = asyncio.get_running_loop().create_task(
+            self._writer(client))
+        self.clients[websocket] = client
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        client = self.clients.pop(websocket, None)
+        if client is not None and client.writer_task is not None and client.writer_task is not asyncio.current_task():
+            client.writer_task.cancel()
 
     async def is_alive(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        client = self.clients.get(websocket)
+        if client is not None:
+            self._enqueue(client, message)
+
+    async def broadcast(self, message: SocketMessage | str):
+        self.publish(message)
+
+    def publish(self, message: SocketMessage | str):
+        '''Queues a message for every client without waiting for any send, safe to call from other threads.'''
+        if self.loop is None or self.outbox is None or len(self.clients) == 0:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.outbox.put_nowait(message)
+        else:
+            self.loop.call_soon_threadsafe(self.outbox.put_nowait, message)
+
+    async def _dispatcher(self):
+        outbox = self.outbox
+        if outbox is None:
+            return
+        while True:
+            message = await outbox.get()
+            start = time.perf_counter()
+            for client in list(self.clients.values()):
+                self._enqueue(client, message)
+            SOCKET_FANOUT_SECONDS.observe(time.perf_counter() - start)
+            SOCKET_BROADCASTS.inc()
+
+    def _enqueue(self, client: SocketClient, message: SocketMessage | str):
+        try:
+            client.queue.put_nowait(message)
+            return
+        except asyncio.QueueFull:
+            client.dropped_messages += 1
+
+        if self.slow_consumer_policy == SlowConsumerPolicy.DISCONNECT:
+            print("[Socket] Client queue full, disconnecting slow client.")
+            self._evict(client)
+        elif self.slow_consumer_policy == SlowConsumerPolicy.DROP_OLDEST:
+            client.queue.get_nowait()
+            client.queue.put_nowait(message)
+        # DROP_NEWEST: the new message is discarded.
+
+    async def _writer(self, client: SocketClient):
+        try:
+            while True:
+                message = await client.queue.get()
+                # Plain strings are sent as they are, SocketMessages in the client's encoding.
+                frame = message.encode(client.encoding) if isinstance(
+                    message, SocketMessage) else message
+                if isinstance(frame, bytes):
+                    await asyncio.wait_for(client.websocket.send_bytes(frame), self.send_timeout)
+                else:
+                    await asyncio.wait_for(client.websocket.send_text(frame), self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Socket] Send failed, evicting client. {e!r}")
+            self._evict(client)
+
+    def _evict(self, client: SocketClient):
+        if self.clients.pop(client.websocket, None) is None:
+            return
+        self.evicted_clients += 1
+        if client.writer_task is not None and client.writer_task is not asyncio.current_task():
+            client.writer_task.cancel()
+        asyncio.get_running_loop().create_task(self._close(client.websocket))
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    def get_stats(self):
+        return {
+            "clients": len(self.clients),
+            "outbox_depth": self.outbox.qsize() if self.outbox is not None else 0,
+            "queued_messages": sum(client.queue.qsize() for client in self.clients.values()),
+            "dropped_messages": sum(client.dropped_messages for client in self.clients.values()),
+            "evicted_clients": self.evicted_clients,
+        }
 
 
 class SocketEvents():
@@ -26,6 +252,7 @@ class SocketEvents():
     REMOVE_ROOM = "REMOVE_ROOM"
     ADD_DEVICE = "ADD_DEVICE"
     SWITCH_DEVICE = "SWITCH_DEVICE"
+    SWITCH_DEVICES = "SWITCH_DEVICES"
     SCHEDULED_SWITCH_DEVICE = "SCHEDULED_SWITCH_DEVICE"
     CONFIGURE_DEVICE = "CONFIGURE_DEVICE"
     REMOVE_DEVICE = "REMOVE_DEVICE"
@@ -1,19 +1,93 @@
-import bcrypt
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict
 
 from sqlalchemy.exc import SQLAlchemyError
 
 from database.actions import get_house, init_house_db
 
+from helpers.config import NTP_TIMEOUT_SECONDS, STARTUP_ATTEMPTS, STARTUP_RETRY_SECONDS
+from helpers.request_models import ResponseStatusCodes
+from helpers.responses import encode_envelope
 from helpers.system_time import SystemTime
+from services.metrics import PASSWORD_CHECK_SECONDS
 
 
 class SystemInitializer():
+    '''
+    Runs the server's startup phases after it starts accepting connections and records
+    how long each took. Until `mark_ready()`, StartupGate answers requests with 503.
+    '''
 
     sys_time: SystemTime
+    # Cached by initialize_house() so logins don't re-read the house row.
+    house_password_hash: str | None = None
+
+    started_at: float
+    ready_after_ms: float | None = None
+    is_ready: bool = False
+    phase_timings_ms: Dict[str, float]
+    phase_errors: Dict[str, str]
 
     def __init__(self) -> None:
         self.sys_time = SystemTime()
-        self.initialize_house()
+        self.started_at = time.perf_counter()
+        self.phase_timings_ms = {}
+        self.phase_errors = {}
+
+    async def run_phase(self, name: str, phase: Awaitable[Any]) -> Any:
+        '''Awaits a startup phase, recording its duration and any error before re-raising it. A returned SQLAlchemyError is raised.'''
+        start = time.perf_counter()
+        try:
+            result = await phase
+            if isinstance(result, SQLAlchemyError):
+                raise result
+            return result
+        except Exception as e:
+            self.phase_errors[name] = str(e)
+            print(f"[Startup] {name} failed. {e}")
+            raise
+        finally:
+            self.phase_timings_ms[name] = (time.perf_counter() - start) * 1000
+
+    async def retry_phase(self, name: str, start_phase: Callable[[], Awaitable[Any]], attempts: int = STARTUP_ATTEMPTS,
+                          retry_seconds: float = STARTUP_RETRY_SECONDS) -> Any:
+        '''Runs `start_phase()` as a phase up to `attempts` times, waiting twice as long after each failure.'''
+        for attempt in range(attempts):
+            try:
+                result = await self.run_phase(name, start_phase())
+                self.phase_errors.pop(name, None)
+                return result
+            except Exception:
+                if attempt + 1 >= attempts:
+                    raise
+                delay = retry_seconds * 2 ** attempt
+                print(f"[Startup] Retrying {name} in {delay:g}s ({attempt + 1}/{attempts}).")
+                await asyncio.sleep(delay)
+
+    async def sync_time(self, timeout: float = NTP_TIMEOUT_SECONDS) -> bool:
+        '''Sets the clock from NTP in a worker thread, gives up after `timeout` (plus the `sudo date` call).'''
+        try:
+            return await self.run_phase("time_sync", asyncio.wait_for(
+                asyncio.to_thread(self.sys_time.set_system_time_from_server), timeout * 2))
+        except Exception:
+            return False
+
+    def mark_ready(self):
+        self.is_ready = True
+        self.ready_after_ms = (time.perf_counter() - self.started_at) * 1000
+        phases = ", ".join(f"{name} {duration:.0f} ms" for name,
+                           duration in self.phase_timings_ms.items())
+        print(f"[Startup] Ready after {self.ready_after_ms:.0f} ms ({phases}).")
+
+    def get_status(self):
+        return {
+            "ready": self.is_ready,
+            "ready_after_ms": self.ready_after_ms,
+            "time_synced": self.sys_time.is_synced,
+            "phases_ms": self.phase_timings_ms,
+            "errors": self.phase_errors,
+        }
 
     def initialize_house(self):
         PrintHeading(80)
@@ -31,6 +105,7 @@ class SystemInitializer():
             print("[House] House Initialization Success.")
         else:
             print("[House] House Already Initialized. (Skipped)")
+        self.house_password_hash = house.house_password_hash
 
     def get_house_password(self):
         while True:
@@ -41,19 +116,26 @@ class SystemInitializer():
                 print("Password must be at least 8 characters long. Please try again.")
 
     def hash_password(self, password: str):
+        # bcrypt is imported on first use, it's only needed to set up or log in to the house.
+        import bcrypt
         salt = bcrypt.gensalt(10)
         hashed_pw = bcrypt.hashpw(password.encode('utf-8'), salt)
         return hashed_pw
 
     def house_login(self, password: str):
-        house = get_house()
-        if isinstance(house, SQLAlchemyError):
-            print(f"[House] House Login Error: {house._message()}")
-            return None
-        if house is None:
-            print(f"[House] House is not initialized.")
-            return None
-        return bcrypt.checkpw(password.encode('utf-8'), house.house_password_hash.encode("utf-8"))
+        '''Checks the house password with bcrypt, blocking for ~100 ms on a Pi. None if there is no house.'''
+        if self.house_password_hash is None:
+            house = get_house()
+            if isinstance(house, SQLAlchemyError):
+                print(f"[House] House Login Error: {house._message()}")
+                return None
+            if house is None:
+                print(f"[House] House is not initialized.")
+                return None
+            self.house_password_hash = house.house_password_hash
+        import bcrypt
+        with PASSWORD_CHECK_SECONDS.time():
+            return bcrypt.checkpw(password.encode('utf-8'), self.house_password_hash.encode("utf-8"))
 
 
 class PrintHeading():
@@ -85,3 +167,29 @@ class PrintHeading():
         self.print_italic(heading, width)
         # Frame with "Create New House" centered
         self.print_frame(sub_heading, width)
+
+
+class StartupGate():
+    '''
+    ASGI middleware that answers 503 (HTTP) or closes with 1013 "try again later" (websocket)
+    until startup has finished, except for the paths in `open_paths`.
+    '''
+
+    def __init__(self, app, system_initializer: SystemInitializer, open_paths=("/ready", "/metrics", "/docs", "/openapi.json")):
+        self.app = app
+        self.system_initializer = system_initializer
+        self.open_paths = set(open_paths)
+
+    async def __call__(self, scope, receive, send):
+        if self.system_initializer.is_ready or scope["type"] not in ("http", "websocket") or scope["path"] in self.open_paths:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1013})
+            return
+
+        body = encode_envelope("error", ResponseStatusCodes.SERVER_STARTING, "Server is starting, please retry shortly.")
+        await send({"type": "http.response.start", "status": 503, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"retry-after", b"1")]})
+        await send({"type": "http.response.body", "body": body})
@@ -4,16 +4,18 @@
 # sudo apt-get update -y
 # sudo apt-get upgrade -y
 
-# PostgreSQL Setup
-# Uninstall PostgreSQL in case present (it will delete all the existing postgresql databases from system)
-sudo apt-get --purge remove postgresql postgresql-*
-# Install PostgreSQL
-sudo apt-get install postgresql postgresql-contrib libpq-dev python3-dev 
-# Start PostgreSQL service
-sudo service postgresql start
-# Set up PostgreSQL user and database
-sudo -u postgres psql -c "CREATE USER autopi_hub WITH PASSWORD 'autopi_hub';"
-sudo -u postgres psql -c "CREATE DATABASE autopi_hub OWNER autopi_hub;"
+# PostgreSQL Setup, skipped with AUTOPI_DB_BACKEND=sqlite (the database is a file in ./data)
+if [ "${AUTOPI_DB_BACKEND:-postgresql}" = "postgresql" ]; then
+    # Uninstall PostgreSQL in case present (it will delete all the existing postgresql databases from system)
+    sudo apt-get --purge remove postgresql postgresql-*
+    # Install PostgreSQL
+    sudo apt-get install postgresql postgresql-contrib libpq-dev python3-dev 
+    # Start PostgreSQL service
+    sudo service postgresql start
+    # Set up PostgreSQL user and database
+    sudo -u postgres psql -c "CREATE USER autopi_hub WITH PASSWORD 'autopi_hub';"
+    sudo -u postgres psql -c "CREATE DATABASE autopi_hub OWNER autopi_hub;"
+fi
 
 # Install Global Packages Python3 and pip
 sudo apt-get install python3 python3-pip -y  # Install Python and Pip
@@ -34,8 +36,7 @@ python3 -m pip install RPi.GPIO # Install RPi.GPIO package
 pip install -r requirements.txt
 
 # Database 
-alembic revision --autogenerate -m "AutoPi-Hub" # Regenerate and apply new migrations
-alembic upgrade head # Apply the new migration
+alembic upgrade head # Apply the checked-in migrations in alembic/versions
 
 # Reister HomeAutomationSystem Service to start automatically on boot
 
@@ -47,12 +48,15 @@ USER_NAME=$(whoami)
 sudo bash -c "cat > $SERVICE_FILE" << EOL
 [Unit]
 Description=AutoPi Hubs's Home Automation System with FastAPI Application
-After=network.target
+After=network.target postgresql.service
+# Started along with the database, startup phases are retried until it accepts connections.
+Wants=postgresql.service
 
 [Service]
 User=$USER_NAME
 WorkingDirectory=/home/$USER_NAME/AutoPi-Hub
-ExecStart=/home/$USER_NAME/AutoPi-Hub/venv/bin/uvicorn server:app --host 0.0.0.0 --port 8000 --ws websockets
+Environment=AUTOPI_DB_BACKEND=${AUTOPI_DB_BACKEND:-postgresql}
+ExecStart=/home/$USER_NAME/AutoPi-Hub/venv/bin/uvicorn server:app --host 0.0.0.0 --port 8000 --ws websockets --ws-per-message-deflate true
 Restart=always
 RestartSec=3
 
@@ -0,0 +1,110 @@
+'''
+python -m unittest discover tests
+
+Runs the server on a temporary SQLite database with simulated GPIO. The log writer only
+flushes when told to, so switches stay queued like they do between its flushes.
+'''
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+
+DATA_DIR = tempfile.mkdtemp(prefix="autopi-test-")
+os.environ.update({
+    "AUTOPI_DB_BACKEND": "sqlite",
+    "AUTOPI_SQLITE_PATH": os.path.join(DATA_DIR, "autopi_hub.sqlite3"),
+    "AUTOPI_GPIO_BACKEND": "simulated",
+    "AUTOPI_LOG_FLUSH_BATCH_SIZE": "1000",
+    "AUTOPI_LOG_FLUSH_INTERVAL_SECONDS": "3600",
+    # Never reachable, the tests mustn't set the clock.
+    "AUTOPI_NTP_SERVER": "ntp.invalid",
+    "AUTOPI_NTP_TIMEOUT_SECONDS": "0.1",
+})
+
+import bcrypt  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from database.actions import init_house_db  # noqa: E402
+from database.database import Base, engine, get_db  # noqa: E402
+from database.db_models import Device, DeviceControlLog  # noqa: E402
+
+Base.metadata.create_all(engine)
+init_house_db(bcrypt.hashpw(b"password123", bcrypt.gensalt(4)).decode("utf-8"))
+
+import server  # noqa: E402
+
+
+class ConfigureDeviceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = TestClient(server.app)
+        cls.client.__enter__()
+        for _ in range(200):
+            if cls.client.get("/ready").status_code == 200:
+                break
+            time.sleep(0.05)
+        cls.client.post("/house-login", params={"userId": "u1", "password": "password123"})
+        cls.house_id = cls.client.get("/get-house", params={"userId": "u1"}).json()["data"]["house_id"]
+        cls.room_id = cls.client.post("/add-room", json={"userId": "u1", "userName": "U", "houseId": cls.house_id,
+                                                         "roomName": "Kitchen"}).json()["data"]["room_id"]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.__exit__(None, None, None)
+
+    def add_device(self, pin_number: int) -> str:
+        return self.client.post("/add-device", json={"userId": "u1", "userName": "U", "houseId": self.house_id, "roomId": self.room_id,
+                                                     "pinNumber": pin_number, "deviceName": "Lamp", "wattage": 60}).json()["data"]["device_id"]
+
+    def get_stored_device(self, device_id: str):
+        db = get_db()
+        try:
+            status = db.query(Device.status).filter(Device.deviceId == device_id).scalar()
+            logs = db.query(DeviceControlLog.statusChangedFrom, DeviceControlLog.statusChangedTo).filter(
+                DeviceControlLog.deviceId == device_id).order_by(DeviceControlLog.createdAt).all()
+            return status, [tuple(log) for log in logs]
+        finally:
+            db.close()
+
+    def test_switch_then_configure_before_flush(self):
+        device_id = self.add_device(17)
+        response = self.client.patch("/switch-device", json={"userId": "u1", "userName": "U", "houseId": self.house_id, "deviceId": device_id,
+                                                             "deviceName": "Lamp", "statusFrom": False, "statusTo": True})
+        self.assertEqual(response.status_code, 201)
+
+        # Scheduled for a minute half a day away, so the device is configured OFF.
+        start = datetime.now() + timedelta(hours=12)
+        response = self.client.put("/configure-device", json={
+            "houseId": self.house_id, "userId": "u1", "userName": "U", "deviceId": device_id, "deviceName": "Lamp",
+            "pinNumber": 17, "status": True, "isDefault": True, "isScheduled": True,
+            "daysScheduled": "Mon,Tue,Wed,Thu,Fri,Sat,Sun", "startTime": f"{start:%H:%M}",
+            "offTime": f"{start + timedelta(minutes=1):%H:%M}", "wattage": 60})
+        self.assertEqual(response.status_code, 201)
+        server.device_log_writer.flush()
+
+        status, logs = self.get_stored_device(device_id)
+        self.assertFalse(server.controller_device.get_device(device_id).status)
+        self.assertFalse(status)
+        self.assertEqual(logs, [(False, True), (True, False)])
+
+    def test_configure_keeps_switches_made_after_it(self):
+        device_id = self.add_device(18)
+        response = self.client.put("/configure-device", json={
+            "houseId": self.house_id, "userId": "u1", "userName": "U", "deviceId": device_id, "deviceName": "Lamp",
+            "pinNumber": 18, "status": False, "isDefault": False, "isScheduled": False,
+            "daysScheduled": "", "startTime": "", "offTime": "", "wattage": 60})
+        self.assertEqual(response.status_code, 201)
+        self.client.patch("/switch-device", json={"userId": "u1", "userName": "U", "houseId": self.house_id, "deviceId": device_id,
+                                                 "deviceName": "Lamp", "statusFrom": False, "statusTo": True})
+        server.device_log_writer.flush()
+
+        status, logs = self.get_stored_device(device_id)
+        self.assertTrue(server.controller_device.get_device(device_id).status)
+        self.assertTrue(status)
+        self.assertEqual(logs, [(False, True)])
+
+
+if __name__ == "__main__":
+    unittest.main()
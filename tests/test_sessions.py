@@ -0,0 +1,57 @@
+'''
+python -m unittest discover tests
+'''
+import time
+import unittest
+
+from services.sessions import SessionManager, b64encode
+
+
+class SessionManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session_manager = SessionManager(secret="test-secret", ttl_hours=1)
+
+    def test_issued_token_verifies(self):
+        token, session = self.session_manager.issue("user-1")
+        verified = self.session_manager.verify(token)
+        self.assertIsNotNone(verified)
+        self.assertEqual(verified.user_id, "user-1")
+        self.assertEqual(verified.session_id, session.session_id)
+
+    def test_malformed_tokens_are_rejected(self):
+        token, _ = self.session_manager.issue("user-1")
+        payload, _, signature = token.partition(".")
+        for malformed in ("", ".", "a", "a.", ".b", "a.bé", "é", "é.é", f"{payload}é.{signature}",
+                          f"{payload}.{signature}é", f"{payload}.{signature[:-1]}", f"{payload[:-1]}.{signature}",
+                          "\x00.\x00", f"{payload}.{signature}.extra"):
+            with self.subTest(token=malformed):
+                self.assertIsNone(self.session_manager.verify(malformed))
+        self.assertEqual(self.session_manager.get_stats()["rejected"], 14)
+
+    def test_signed_payloads_that_are_not_claims_are_rejected(self):
+        for payload in (b64encode(b"not json"), b64encode(b"[1, 2]"), b64encode(b'{"u": "user-1"}'), "!!!"):
+            with self.subTest(payload=payload):
+                self.assertIsNone(self.session_manager.verify(
+                    f"{payload}.{self.session_manager.sign(payload)}"))
+
+    def test_token_from_another_secret_is_rejected(self):
+        token, _ = SessionManager(secret="other-secret").issue("user-1")
+        self.assertIsNone(self.session_manager.verify(token))
+
+    def test_revoked_and_expired_tokens_are_rejected(self):
+        token, session = self.session_manager.issue("user-1")
+        self.session_manager.revoke(session)
+        self.assertIsNone(self.session_manager.verify(token))
+
+        token, _ = SessionManager(secret="test-secret", ttl_hours=-1).issue("user-1")
+        self.assertIsNone(self.session_manager.verify(token))
+
+        token, _ = self.session_manager.issue("user-2")
+        self.session_manager.revoke_user("user-2")
+        self.assertIsNone(self.session_manager.verify(token))
+        self.assertGreater(self.session_manager.revoked_users["user-2"], time.time() - 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
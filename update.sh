@@ -1,18 +1,23 @@
 #!/bin/bash
 
+# Stop at the first failing step, e.g. before restarting the server on a failed migration or restore.
+set -e
+
 # Save House Data to ./data directory
-sudo venv/bin/python save_house_data.py
-
-# PostgreSQL Setup
-# Uninstall PostgreSQL
-sudo apt-get --purge remove postgresql postgresql-*
-# Install PostgreSQL
-sudo apt-get install postgresql postgresql-contrib libpq-dev python3-dev
-# Start PostgreSQL service
-sudo service postgresql start
-# Set up PostgreSQL user and database
-sudo -u postgres psql -c "CREATE USER autopi_hub WITH PASSWORD 'autopi_hub';"
-sudo -u postgres psql -c "CREATE DATABASE autopi_hub OWNER autopi_hub;"
+sudo -E venv/bin/python save_house_data.py
+
+# PostgreSQL Setup, skipped with AUTOPI_DB_BACKEND=sqlite (the database is a file in ./data)
+if [ "${AUTOPI_DB_BACKEND:-postgresql}" = "postgresql" ]; then
+    # Uninstall PostgreSQL
+    sudo apt-get --purge remove postgresql postgresql-*
+    # Install PostgreSQL
+    sudo apt-get install postgresql postgresql-contrib libpq-dev python3-dev
+    # Start PostgreSQL service
+    sudo service postgresql start
+    # Set up PostgreSQL user and database, both may survive the reinstall
+    sudo -u postgres psql -c "CREATE USER autopi_hub WITH PASSWORD 'autopi_hub';" || true
+    sudo -u postgres psql -c "CREATE DATABASE autopi_hub OWNER autopi_hub;" || true
+fi
 
 # Pull the latest code from the GitHub repository forcefully and delete local uncommitted changes.
 git fetch origin
@@ -30,14 +35,22 @@ python3 -m pip install RPi.GPIO # Install RPi.GPIO package
 pip install -r requirements.txt
 
 # Databse 
-alembic revision --autogenerate -m "AutoPi-Hub" # Regenerate and apply new migrations
-alembic upgrade head # Apply the new migration
+rm -f alembic/versions/*_autopi_hub.py # Remove migrations autogenerated by earlier versions of this script
+alembic upgrade head # Apply the checked-in migrations in alembic/versions
 
 # Load House Data from ./data directory
-sudo venv/bin/python load_house_data.py
+sudo -E venv/bin/python load_house_data.py
+
+# Re-create monthly log partitions when enabled
+if [ "$AUTOPI_LOG_PARTITIONING" = "true" ]; then
+    sudo -E venv/bin/python partition_logs.py
+fi
+
+# Rebuild hourly energy rollups from the restored logs
+sudo -E venv/bin/python backfill_energy_rollups.py
 
 # Find and kill the process running on port 8000
-sudo kill -9 `sudo lsof -t -i:8000`
+sudo kill -9 `sudo lsof -t -i:8000` || true # Nothing may be running
 
 # Start the FastAPI server
 fastapi run server.py